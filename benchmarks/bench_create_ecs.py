@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+"""
+Compares opening an OVA for ``create_ecs`` the old way (a new ``Ova``, which
+re-reads the tarball and OVF every deploy) with ``image_catalog.CATALOG.open``,
+which reuses the details it read the first time.
+
+vCenter is faked (see ``fake_vcenter.py``) and the disk "upload" just reads
+every VMDK in 8KB blocks, like ``urllib`` does when posting a file.
+
+Usage::
+
+    python -m benchmarks.bench_create_ecs --deploys 20 --disk-mb 64 --read-latency 0.002
+"""
+import io
+import os
+import time
+import logging
+import shutil
+import tarfile
+import argparse
+import tempfile
+from unittest.mock import patch
+from contextlib import contextmanager
+
+from vlab_inf_common.vmware import Ova
+from vlab_inf_common.vmware.ova import FileHandle
+
+from vlab_ecs_api.lib.worker import vmware, image_catalog
+from benchmarks.fake_vcenter import FakeVcenter
+
+UPLOAD_BLOCK = 8192
+OVF = '<NetworkSection><Network ovf:name="VM Network"></Network></NetworkSection>'
+
+
+def make_ova(images_dir, version, disk_mb, disk_count):
+    """Write an OVA with an OVF, a manifest and some (zero filled) disks
+
+    :Returns: String
+    """
+    path = os.path.join(images_dir, vmware.convert_name(version))
+    with tarfile.open(path, 'w') as the_ova:
+        files = [('ECS.ovf', OVF.encode()), ('ECS.mf', b'SHA256(ECS.ovf)= 00\n')]
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            the_ova.addfile(info, io.BytesIO(data))
+        for idx in range(disk_count):
+            info = tarfile.TarInfo('ECS-disk{}.vmdk'.format(idx))
+            info.size = disk_mb * 1024 * 1024
+            the_ova.addfile(info, io.BytesIO(bytes(info.size)))
+    return path
+
+
+class Counter:
+    """Tallies reads of the OVA, split by deploy phase"""
+    def __init__(self, read_latency):
+        self.read_latency = read_latency
+        self.phase = 'open'
+        self.reads = {'open': 0, 'upload': 0}
+        self.seconds = {'open': 0.0, 'upload': 0.0}
+
+    def wrap_read(self, real_read):
+        counter = self
+
+        def read(handle, amount):
+            counter.reads[counter.phase] += 1
+            if counter.read_latency:
+                time.sleep(counter.read_latency)
+            return real_read(handle, amount)
+        return read
+
+    @contextmanager
+    def timing(self, phase):
+        self.phase = phase
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += time.perf_counter() - start
+
+
+def run(opener, counter, vcenter, deploys):
+    """Call ``create_ecs`` repeatedly, using ``opener`` to open the OVA"""
+    def timed_open(name):
+        with counter.timing('open'):
+            return opener(name)
+
+    def fake_deploy(vcenter, ova, network_map, username, machine_name, logger, power_on=True):
+        with counter.timing('upload'):
+            ova.ovf # what CreateImportSpec is sent
+            for disk in ova._disks.values():
+                while disk.read(UPLOAD_BLOCK):
+                    pass
+                disk.seek(0, 0)
+        return vcenter.add_vm(vcenter.base_folder, machine_name)
+
+    @contextmanager
+    def fake_session():
+        yield vcenter
+
+    with patch.object(image_catalog.CATALOG, 'open', timed_open), \
+         patch.object(vmware, 'vcenter_session', fake_session), \
+         patch.object(vmware.virtual_machine, 'deploy_from_ova', fake_deploy), \
+         patch.object(vmware.virtual_machine, 'adjust_ram'), \
+         patch.object(vmware.virtual_machine, 'power'), \
+         patch.object(vmware.virtual_machine, 'set_meta'), \
+         patch.object(vmware.virtual_machine, 'get_info', return_value={}):
+        for idx in range(deploys):
+            vmware.create_ecs('alice', 'ecs{}'.format(idx), '3.2.2', 'alice_frontend', logger=logging.getLogger(__name__))
+
+
+def main(deploys, disk_mb, disk_count, read_latency):
+    """Print the time (and reads of the OVA) each approach takes per deploy"""
+    images_dir = tempfile.mkdtemp()
+    try:
+        path = make_ova(images_dir, '3.2.2', disk_mb, disk_count)
+        print('{:>8} | {:>12} {:>12} | {:>12} {:>12}'.format('', 'open reads', 'open ms', 'upload reads', 'upload ms'))
+        for label in ('legacy', 'cached'):
+            image_catalog.CATALOG.clear()
+            vcenter = FakeVcenter()
+            vcenter.add_network('alice_frontend')
+            counter = Counter(read_latency)
+            if label == 'legacy':
+                opener = lambda name: Ova(path)
+            else:
+                opener = image_catalog.CATALOG.open
+            with patch.object(image_catalog.CATALOG, '_images_dir', images_dir), \
+                 patch.object(FileHandle, 'read', counter.wrap_read(FileHandle.read)):
+                run(opener, counter, vcenter, deploys)
+            print('{:>8} | {:>12.1f} {:>12.2f} | {:>12.1f} {:>12.2f}'.format(label,
+                                                                         counter.reads['open'] / deploys,
+                                                                         counter.seconds['open'] / deploys * 1000,
+                                                                         counter.reads['upload'] / deploys,
+                                                                         counter.seconds['upload'] / deploys * 1000))
+    finally:
+        shutil.rmtree(images_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--deploys', type=int, default=20,
+                        help='How many times to call create_ecs')
+    parser.add_argument('--disk-mb', type=int, default=16,
+                        help='The size of each disk in the fake OVA')
+    parser.add_argument('--disk-count', type=int, default=2,
+                        help='How many disks the fake OVA has')
+    parser.add_argument('--read-latency', type=float, default=0.0,
+                        help='Seconds each read of the OVA takes (i.e. an NFS round trip)')
+    args = parser.parse_args()
+    main(args.deploys, args.disk_mb, args.disk_count, args.read_latency)
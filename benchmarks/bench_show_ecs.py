@@ -0,0 +1,74 @@
+# -*- coding: UTF-8 -*-
+"""
+Compares the bulk (PropertyCollector) ``show_ecs`` with the old approach of
+calling ``virtual_machine.get_info`` for every VM in the user's folder.
+
+Usage::
+
+    python -m benchmarks.bench_show_ecs --latency 0.001 --sizes 10 100 1000
+"""
+import time
+import argparse
+from unittest.mock import patch
+from contextlib import contextmanager
+
+from vlab_inf_common.vmware import vim, virtual_machine
+
+from vlab_ecs_api.lib.worker import vmware
+from benchmarks.fake_vcenter import FakeVcenter
+
+
+def legacy_show_ecs(vcenter, username):
+    """How ``show_ecs`` used to collect information; one ``get_info`` per VM"""
+    ecs_vms = {}
+    folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    for vm in folder.childEntity:
+        info = virtual_machine.get_info(vcenter, vm, username)
+        if info['meta']['component'] == 'Ecs':
+            ecs_vms[vm.name] = info
+    return ecs_vms
+
+
+def measure(func, vcenter):
+    """Run ``func`` once, and report the round trips and seconds it took
+
+    :Returns: Tuple (round_trips, seconds)
+    """
+    vcenter.stub.reset()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    return vcenter.stub.round_trips, elapsed
+
+
+def main(sizes, latency, legacy_max):
+    """Print a table of round trips and run time for each inventory size"""
+    print('{:>6} | {:>15} {:>10} | {:>15} {:>10}'.format('VMs', 'legacy calls', 'seconds', 'bulk calls', 'seconds'))
+    for size in sizes:
+        vcenter = FakeVcenter(latency=latency)
+        vcenter.add_user('alice', size)
+
+        @contextmanager
+        def fake_session():
+            yield vcenter
+
+        with patch('ssl.get_server_certificate', return_value=vcenter.cert), \
+             patch.object(vmware, 'vcenter_session', fake_session):
+            if size <= legacy_max:
+                legacy = measure(lambda: legacy_show_ecs(vcenter, 'alice'), vcenter)
+            else:
+                legacy = ('skipped', float('nan'))
+            bulk = measure(lambda: vmware.show_ecs('alice'), vcenter)
+        print('{:>6} | {:>15} {:>10.3f} | {:>15} {:>10.3f}'.format(size, legacy[0], legacy[1], bulk[0], bulk[1]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='How many VMs to put in the user folder')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds each round trip to the fake vCenter takes')
+    parser.add_argument('--legacy-max', type=int, default=1000,
+                        help='Skip the legacy approach for folders bigger than this')
+    args = parser.parse_args()
+    main(args.sizes, args.latency, args.legacy_max)
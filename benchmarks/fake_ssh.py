@@ -0,0 +1,164 @@
+# -*- coding: UTF-8 -*-
+"""
+A local SSH server that plays back scripted output, in place of an ECS VM.
+
+Each command that's executed is matched against a list of ``Reply`` objects;
+the first whose pattern matches decides what the "remote command" writes, how
+long it waits between each chunk, and the exit code it finishes with. A command
+that matches nothing exits 0 without any output.
+
+Any username and password are accepted, and ``invoke_shell`` gets a shell that
+discards whatever it's sent, which is all ``remote_shell.SSHClient`` needs.
+"""
+import re
+import time
+import socket
+import threading
+import collections
+
+import paramiko
+
+# What a command writes, and how; ``chunks`` are sent to stdout ``delay`` seconds apart
+Reply = collections.namedtuple('Reply', 'pattern chunks delay exit_code')
+
+
+def ecs_replies(lines, seconds):
+    """The output of configuring ECS; each step writes ``lines`` lines over ``seconds``
+
+    :Returns: List of Reply
+    """
+    delay = seconds / max(lines, 1)
+    return [Reply('update_deploy', [b'updating\r\n'] * lines, delay, 0),
+            Reply('ova-step1', [b'step1 progress\r\n'] * lines, delay, 0),
+            Reply('ova-step2', [b'step2 progress\r\n'] * lines, delay, 0)]
+
+
+class _Handler(paramiko.ServerInterface):
+    """Accepts any login, and records which channels asked for a shell or a command"""
+    def __init__(self):
+        self.commands = {}
+        self.ready = threading.Condition()
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_FAILED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        with self.ready:
+            self.commands[channel.get_id()] = None
+            self.ready.notify_all()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        with self.ready:
+            self.commands[channel.get_id()] = command.decode()
+            self.ready.notify_all()
+        return True
+
+
+class FakeSSHServer:
+    """Listens on a local port until the ``with`` block ends
+
+    :param replies: What each command writes, checked in order
+    :type replies: List of Reply
+
+    :param connect_delay: Seconds to wait before answering a new connection
+    :type connect_delay: Float
+
+    :param port: The TCP port to listen on; 0 picks a free one
+    :type port: Integer
+    """
+    def __init__(self, replies=(), connect_delay=0.0, port=0):
+        self.replies = list(replies)
+        self.connect_delay = connect_delay
+        self.commands = []
+        self.port = port
+        self._host_key = paramiko.ECDSAKey.generate()
+        self._sock = None
+        self._threads = []
+        self._closing = False
+
+    def __enter__(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', self.port))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        self._spawn(self._accept)
+        return self
+
+    def __exit__(self, exc_type, exc_value, the_traceback):
+        self._closing = True
+        self._sock.close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _accept(self):
+        while not self._closing:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                # The listening socket was closed
+                return
+            self._spawn(self._serve, client)
+
+    def _serve(self, client):
+        """Run one SSH connection until the client hangs up"""
+        if self.connect_delay:
+            time.sleep(self.connect_delay)
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self._host_key)
+        handler = _Handler()
+        transport.start_server(server=handler)
+        try:
+            while transport.is_active() and not self._closing:
+                channel = transport.accept(timeout=0.5)
+                if channel is None:
+                    continue
+                with handler.ready:
+                    handler.ready.wait_for(lambda: channel.get_id() in handler.commands, timeout=5)
+                    command = handler.commands.pop(channel.get_id(), None)
+                if command is None:
+                    # The interactive shell; nothing is ever run in it
+                    continue
+                self._spawn(self._run, channel, command)
+        finally:
+            transport.close()
+
+    def _run(self, channel, command):
+        """Play back the reply for a command, then close the channel"""
+        self.commands.append(command)
+        reply = self.reply_for(command)
+        try:
+            for chunk in reply.chunks:
+                if reply.delay:
+                    time.sleep(reply.delay)
+                channel.sendall(chunk)
+            channel.send_exit_status(reply.exit_code)
+        finally:
+            channel.close()
+
+    def reply_for(self, command):
+        """The first reply whose pattern matches the command
+
+        :Returns: Reply
+        """
+        for reply in self.replies:
+            if re.search(reply.pattern, command):
+                return reply
+        return Reply('', (), 0, 0)
@@ -0,0 +1,463 @@
+# -*- coding: UTF-8 -*-
+"""
+A stand-in for vCenter that never leaves the local machine.
+
+Real pyVmomi objects are bound to ``FakeStub`` instead of a SOAP connection, so
+every property access and method call still goes through pyVmomi, and gets
+counted as a round trip (with an optional, artificial latency). That makes the
+numbers comparable to what a real vCenter would see, without needing one.
+
+Tasks (power on/off, reconfigure, destroy) run for ``task_latency`` seconds
+before their effect is applied, and a PropertyCollector of our own can wait on
+them with ``WaitForUpdatesEx``, like ``property_collector.wait_for_many`` does.
+"""
+import time
+import datetime
+import threading
+import itertools
+import collections
+
+import ujson
+from pyVmomi import vim, vmodl
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from vlab_inf_common.vmware import vCenter
+
+
+# Folders/datacenters are walked when building a recursive ContainerView
+_CHILD_PROPERTIES = ('childEntity', 'vmFolder', 'networkFolder')
+
+
+def make_cert():
+    """Create a throw-away, self-signed TLS cert; used in place of the vCenter server cert
+
+    :Returns: String
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'fake-vcenter.local')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name)\
+                                    .issuer_name(name)\
+                                    .public_key(key.public_key())\
+                                    .serial_number(x509.random_serial_number())\
+                                    .not_valid_before(now)\
+                                    .not_valid_after(now + datetime.timedelta(days=1))\
+                                    .sign(key, hashes.SHA256())
+    return cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class FakeStub:
+    """Answers the calls pyVmomi would normally send to vCenter over SOAP.
+
+    :param latency: How many seconds each round trip takes
+    :type latency: Float
+
+    :param task_latency: How many seconds a task runs before it's done
+    :type task_latency: Float
+    """
+    def __init__(self, latency=0.0, task_latency=0.0):
+        self.latency = latency
+        self.task_latency = task_latency
+        self.calls = collections.Counter()
+        self._objects = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # collector moId -> {'filters': [(filter, spec)], 'sent': {(moId, path): value}}
+        self._collectors = {}
+
+    @property
+    def round_trips(self):
+        """The total number of calls made to the fake vCenter"""
+        return sum(self.calls.values())
+
+    def reset(self):
+        """Zero out the call counters"""
+        with self._lock:
+            self.calls.clear()
+
+    def add(self, vimtype, prefix, **props):
+        """Create a new managed object within the fake vCenter
+
+        :Returns: pyVmomi.VmomiSupport.ManagedObject
+
+        :param vimtype: The kind of object to make, i.e. vim.VirtualMachine
+        :type vimtype: pyVmomi.VmomiSupport.LazyType
+
+        :param prefix: Prepended to the moId, i.e. ``vm``
+        :type prefix: String
+        """
+        with self._lock:
+            mo_id = '{}-{}'.format(prefix, next(self._ids))
+        the_object = vimtype(mo_id, self)
+        self._objects[mo_id] = props
+        return the_object
+
+    def props(self, the_object):
+        """The (mutable) properties of a managed object
+
+        :Returns: Dictionary
+        """
+        return self._objects[the_object._moId]
+
+    def remove(self, the_object):
+        """Delete a managed object from the fake vCenter"""
+        self._objects.pop(the_object._moId, None)
+
+    def round_trip(self, name):
+        """Account for, and simulate the latency of, one call to vCenter"""
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def InvokeAccessor(self, mo, info):
+        """Called by pyVmomi when reading a property of a managed object"""
+        self.round_trip(info.name)
+        self._settle(mo)
+        try:
+            return self._objects[mo._moId].get(info.name)
+        except KeyError:
+            raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+
+    def InvokeMethod(self, mo, info, args):
+        """Called by pyVmomi when invoking a method on a managed object"""
+        self.round_trip(info.wsdlName)
+        handler = getattr(self, '_{}'.format(info.wsdlName), None)
+        if handler is None:
+            raise NotImplementedError('FakeStub does not support {}'.format(info.wsdlName))
+        return handler(mo, *args)
+
+    def resolve(self, the_object, path):
+        """Read a (possibly nested) property, the way the PropertyCollector does
+
+        :Returns: Object
+        """
+        self._settle(the_object)
+        names = path.split('.')
+        value = self._objects[the_object._moId].get(names[0])
+        for name in names[1:]:
+            if value is None:
+                break
+            value = getattr(value, name)
+        return value
+
+    def task(self, effect):
+        """Start a task, which calls ``effect`` once it's done running
+
+        :Returns: vim.Task
+
+        :param effect: Makes the change the task is for; an exception fails the task
+        :type effect: Function
+        """
+        info = vim.TaskInfo(key='task', state=vim.TaskInfo.State.running)
+        return self.add(vim.Task, 'task', info=info, finish_at=time.time() + self.task_latency, effect=effect)
+
+    def _settle(self, the_object):
+        """Finish a task that has run for long enough"""
+        props = self._objects.get(the_object._moId, {})
+        if props.get('finish_at') is None or props['finish_at'] > time.time():
+            return
+        with self._lock:
+            # Only one reader gets to apply the effect
+            effect = props.pop('effect', None)
+        if effect is None:
+            return
+        info = props['info']
+        try:
+            info.result = effect()
+        except Exception as doh:
+            info.error = vmodl.MethodFault(msg=str(doh))
+            info.state = vim.TaskInfo.State.error
+        else:
+            info.state = vim.TaskInfo.State.success
+        info.completeTime = datetime.datetime.utcnow()
+        props['finish_at'] = None
+
+    def descendants(self, the_object):
+        """Every managed object below the supplied one in the inventory
+
+        :Returns: List
+        """
+        found = []
+        props = self._objects.get(the_object._moId, {})
+        for prop in _CHILD_PROPERTIES:
+            children = props.get(prop)
+            if children is None:
+                continue
+            if not isinstance(children, list):
+                children = [children]
+            for child in children:
+                found.append(child)
+                found += self.descendants(child)
+        return found
+
+    def _RetrieveServiceContent(self, mo):
+        return self.content
+
+    def _RetrieveProperties(self, mo, spec_set):
+        answer = []
+        for spec in spec_set:
+            for obj_spec in spec.objectSet:
+                targets = [] if obj_spec.skip else [obj_spec.obj]
+                for traversal in obj_spec.selectSet:
+                    targets += self.resolve(obj_spec.obj, traversal.path) or []
+                for target in targets:
+                    for prop_spec in spec.propSet:
+                        if not isinstance(target, prop_spec.type):
+                            continue
+                        prop_set = []
+                        for path in prop_spec.pathSet:
+                            value = _typed(self.resolve(target, path))
+                            if value is not None:
+                                prop_set.append(vmodl.DynamicProperty(name=path, val=value))
+                        answer.append(vmodl.query.PropertyCollector.ObjectContent(obj=target,
+                                                                                  propSet=prop_set))
+        return answer
+
+    def _FindChild(self, mo, entity, name):
+        for child in self._objects[entity._moId].get('childEntity', []):
+            if self._objects.get(child._moId, {}).get('name') == name:
+                return child
+        return None
+
+    def _PowerOnVM_Task(self, mo, host=None):
+        def effect():
+            self.props(mo)['runtime'] = vim.vm.RuntimeInfo(powerState='poweredOn')
+        return self.task(effect)
+
+    def _PowerOffVM_Task(self, mo):
+        def effect():
+            self.props(mo)['runtime'] = vim.vm.RuntimeInfo(powerState='poweredOff')
+        return self.task(effect)
+
+    def _ReconfigVM_Task(self, mo, spec):
+        def effect():
+            if spec.annotation is not None:
+                self.props(mo)['config'] = vim.vm.ConfigInfo(annotation=spec.annotation)
+        return self.task(effect)
+
+    def _Destroy_Task(self, mo):
+        def effect():
+            props = self.props(mo)
+            if props['runtime'].powerState == 'poweredOn':
+                raise RuntimeError('The attempted operation cannot be performed in the current state (Powered on).')
+            self.props(props['parent'])['childEntity'].remove(mo)
+            for network in props.get('network', []):
+                self.props(network)['vm'].remove(mo)
+            self.remove(mo)
+        return self.task(effect)
+
+    def _CreatePropertyCollector(self, mo):
+        collector = self.add(vmodl.query.PropertyCollector, 'session')
+        self._collectors[collector._moId] = {'filters': [], 'sent': {}}
+        return collector
+
+    def _CreateFilter(self, mo, spec, partial_updates):
+        the_filter = self.add(vmodl.query.PropertyCollector.Filter, 'session')
+        self._collectors[mo._moId]['filters'].append((the_filter, spec))
+        return the_filter
+
+    def _DestroyPropertyCollector(self, mo):
+        self._collectors.pop(mo._moId, None)
+        self.remove(mo)
+
+    def _WaitForUpdatesEx(self, mo, version, options):
+        collector = self._collectors[mo._moId]
+        max_wait = options.maxWaitSeconds if options and options.maxWaitSeconds is not None else 60
+        deadline = time.time() + max_wait
+        while True:
+            filter_set = []
+            for the_filter, spec in collector['filters']:
+                updates = self._changes(spec, collector['sent'])
+                if updates:
+                    filter_set.append(vmodl.query.PropertyCollector.FilterUpdate(filter=the_filter,
+                                                                                 objectSet=updates))
+            if filter_set:
+                version = str(int(version or 0) + 1)
+                return vmodl.query.PropertyCollector.UpdateSet(version=version, filterSet=filter_set)
+            if time.time() >= deadline:
+                return None
+            # Not a round trip; vCenter holds the request open until there's a change
+            time.sleep(0.005)
+
+    def _changes(self, spec, sent):
+        """What's changed about the objects of a filter since they were last sent
+
+        :Returns: List of vmodl.query.PropertyCollector.ObjectUpdate
+        """
+        updates = []
+        for obj_spec in spec.objectSet:
+            target = obj_spec.obj
+            if target._moId not in self._objects:
+                continue
+            new = (target._moId, None) not in sent
+            changes = []
+            for prop_spec in spec.propSet:
+                for path in prop_spec.pathSet:
+                    value = self.resolve(target, path)
+                    key = (target._moId, path)
+                    if key not in sent or sent[key] != value:
+                        sent[key] = value
+                        changes.append(vmodl.query.PropertyCollector.Change(name=path, op='assign',
+                                                                           val=_typed(value)))
+            sent[(target._moId, None)] = True
+            if changes:
+                kind = 'enter' if new else 'modify'
+                updates.append(vmodl.query.PropertyCollector.ObjectUpdate(kind=kind, obj=target,
+                                                                          changeSet=changes))
+        return updates
+
+    def _CreateContainerView(self, mo, container, vimtypes, recursive):
+        if recursive:
+            candidates = self.descendants(container)
+        else:
+            candidates = self._objects[container._moId].get('childEntity', [])
+        view = [x for x in candidates if isinstance(x, tuple(vimtypes))]
+        return self.add(vim.view.ContainerView, 'session', view=view)
+
+    def _DestroyView(self, mo):
+        self.remove(mo)
+
+    def _AcquireCloneTicket(self, mo):
+        return 'cst-VCT-{}'.format(next(self._ids))
+
+    def _Logout(self, mo):
+        return None
+
+
+def _typed(value):
+    """SOAP values are typed; plain lists need to become an ArrayOf<type>
+
+    :Returns: Object
+    """
+    if isinstance(value, list) and not hasattr(value, 'Item'):
+        return type(value[0]).Array(value) if value else None
+    return value
+
+
+class FakeVcenter(vCenter):
+    """Quacks like ``vlab_inf_common.vmware.vCenter``, but is backed by ``FakeStub``.
+
+    The inventory looks like ``<datacenter>/vm/<base_dir>/<username>/<VMs>``,
+    which is how vLab lays out a user's virtual machines.
+
+    :param latency: How many seconds each round trip to vCenter takes
+    :type latency: Float
+
+    :param base_dir: The folder that holds every user's folder
+    :type base_dir: String
+
+    :param task_latency: How many seconds a task (i.e. power on) takes
+    :type task_latency: Float
+    """
+    def __init__(self, latency=0.0, base_dir='vlab', task_latency=0.0):
+        self.stub = FakeStub(latency=latency, task_latency=task_latency)
+        self._base_dir = base_dir
+        self._net_cache = None
+        self.cert = make_cert()
+        stub = self.stub
+        self.vm_folder = stub.add(vim.Folder, 'group-v', name='vm', childEntity=[])
+        self.network_folder = stub.add(vim.Folder, 'group-n', name='network', childEntity=[])
+        self.datacenter = stub.add(vim.Datacenter, 'datacenter', name='Datacenter',
+                                   vmFolder=self.vm_folder, networkFolder=self.network_folder)
+        root_folder = stub.add(vim.Folder, 'group-d', name='Datacenters', childEntity=[self.datacenter])
+        self.base_folder = self.add_folder(self.vm_folder, base_dir)
+        settings = stub.add(vim.option.OptionManager, 'VpxSettings',
+                            setting=[vim.option.OptionValue(key='VirtualCenter.FQDN', value='fake-vcenter.local')])
+        stub.content = vim.ServiceInstanceContent(rootFolder=root_folder,
+                                                  propertyCollector=stub.add(vmodl.query.PropertyCollector, 'propertyCollector'),
+                                                  viewManager=stub.add(vim.view.ViewManager, 'ViewManager'),
+                                                  searchIndex=stub.add(vim.SearchIndex, 'SearchIndex'),
+                                                  sessionManager=stub.add(vim.SessionManager, 'SessionManager',
+                                                                          currentSession=vim.UserSession(key='fake')),
+                                                  setting=settings,
+                                                  about=vim.AboutInfo(instanceUuid='fake-vcenter-uuid'))
+        self._conn = stub.add(vim.ServiceInstance, 'ServiceInstance')
+
+    def login(self):
+        """Log into the (fake) vCenter server; a ``SessionPool`` factory
+
+        Every session shares the same inventory, so this just accounts for
+        the round trips of a real login (the ServiceContent, then the login).
+
+        :Returns: FakeVcenter
+        """
+        self.stub.round_trip('RetrieveServiceContent')
+        self.stub.round_trip('Login')
+        return self
+
+    def close(self):
+        """Terminate the session to the (fake) vCenter server"""
+        self.stub.round_trip('Logout')
+
+    def get_by_type(self, vimtype, root=None):
+        """Same as ``vCenter.get_by_type``, but doesn't depend on ``collections.Iterable``"""
+        if not isinstance(vimtype, (list, tuple)):
+            vimtype = [vimtype]
+        if root is None:
+            folder = self.content.rootFolder
+        else:
+            folder = self.get_vm_folder(path=self._base_dir)
+        entity = self.content.viewManager.CreateContainerView(container=folder,
+                                                              type=vimtype,
+                                                              recursive=True)
+        answer = entity.view
+        entity.DestroyView()
+        return answer
+
+    def add_folder(self, parent, name):
+        """Create a VM folder
+
+        :Returns: vim.Folder
+        """
+        folder = self.stub.add(vim.Folder, 'group-v', name=name, childEntity=[], parent=parent)
+        self.stub.props(parent)['childEntity'].append(folder)
+        return folder
+
+    def add_network(self, name):
+        """Create a network that VMs can connect to
+
+        :Returns: vim.Network
+        """
+        network = self.stub.add(vim.Network, 'network', name=name, vm=[])
+        self.stub.props(self.network_folder)['childEntity'].append(network)
+        return network
+
+    def add_vm(self, folder, name, meta=None, network=None, power_state='poweredOn', ip='192.168.1.10'):
+        """Create a virtual machine
+
+        :Returns: vim.VirtualMachine
+        """
+        annotation = ujson.dumps(meta) if meta else ''
+        nic = vim.vm.GuestInfo.NicInfo(ipAddress=[ip, 'fe80::1'])
+        networks = [network] if network else []
+        the_vm = self.stub.add(vim.VirtualMachine, 'vm',
+                               name=name,
+                               parent=folder,
+                               network=networks,
+                               runtime=vim.vm.RuntimeInfo(powerState=power_state),
+                               config=vim.vm.ConfigInfo(annotation=annotation),
+                               guest=vim.vm.GuestInfo(net=[nic]))
+        self.stub.props(folder)['childEntity'].append(the_vm)
+        if network:
+            self.stub.props(network)['vm'].append(the_vm)
+        return the_vm
+
+    def add_user(self, username, vm_count, component='Ecs'):
+        """Create a user's folder and network, along with some VMs
+
+        :Returns: vim.Folder
+        """
+        folder = self.add_folder(self.base_folder, username)
+        network = self.add_network('{}_frontend'.format(username))
+        for idx in range(vm_count):
+            meta = {'component': component,
+                    'created': 1234,
+                    'version': '3.2.2',
+                    'configured': False,
+                    'generation': 1}
+            self.add_vm(folder, '{}{}'.format(component, idx), meta=meta, network=network,
+                        ip='192.168.1.{}'.format(idx % 250 + 2))
+        return folder
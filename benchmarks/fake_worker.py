@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+"""
+Runs a Celery worker for every ECS queue, backed by the fake vCenter and the
+fake SSH server instead of real infrastructure; the backend for ``loadtest.py``.
+
+The user (``alice``) starts out with ``--vms`` ECS VMs named ``ecs0``,
+``ecs1``, etc., so there's something to list and configure. Every ``ecs.config``
+should use ``127.0.0.1`` as the gateway, and ``--ssh-port`` as the SSH port.
+
+Usage::
+
+    VLAB_MESSAGE_BROKER=pyamqp://localhost python -m benchmarks.fake_worker --vms 500
+"""
+import logging
+import argparse
+
+from vlab_ecs_api.lib import celery_config
+from vlab_ecs_api.lib.worker import tasks
+from benchmarks.suite import Backend
+from benchmarks.fake_ssh import FakeSSHServer, ecs_replies
+
+
+def main(args):
+    """Serve tasks until the worker is stopped (i.e. CTRL+C)"""
+    queues = ','.join(sorted({x['queue'] for x in celery_config.TASK_ROUTES.values()}))
+    replies = ecs_replies(args.config_lines, args.config_seconds)
+    with Backend(args) as backend, FakeSSHServer(replies, port=args.ssh_port) as server:
+        backend.add_vms(args.vms, 'ecs')
+        print('Fake vCenter has {} VMs; fake ECS SSH on 127.0.0.1:{}'.format(args.vms, server.port))
+        # Threads, so every task shares the one fake vCenter
+        tasks.app.worker_main(['worker', '-Q', queues, '-P', 'threads', '-c', str(args.workers),
+                               '--loglevel', args.loglevel])
+        print('Fake vCenter answered {} round trips'.format(backend.vcenter.stub.round_trips))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vms', type=int, default=500,
+                        help='How many ECS VMs the user starts out with')
+    parser.add_argument('--workers', type=int, default=16,
+                        help='How many tasks run at once')
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='Seconds each round trip to the fake vCenter takes')
+    parser.add_argument('--task-latency', type=float, default=0.05,
+                        help='Seconds each vCenter task (i.e. power on) runs')
+    parser.add_argument('--deploy-seconds', type=float, default=0.2,
+                        help='Seconds importing an OVA takes')
+    parser.add_argument('--ssh-port', type=int, default=2222,
+                        help='The port the fake ECS VMs listen for SSH on')
+    parser.add_argument('--config-lines', type=int, default=50,
+                        help='Lines of output each step of configuring ECS writes')
+    parser.add_argument('--config-seconds', type=float, default=0.5,
+                        help='Seconds each step of configuring ECS runs')
+    parser.add_argument('--loglevel', default='WARNING',
+                        help='How much the worker logs')
+    logging.basicConfig(level=logging.WARNING)
+    main(parser.parse_args())
@@ -0,0 +1,279 @@
+# -*- coding: UTF-8 -*-
+"""
+Load tests the ECS API end to end, from the HTTP request until the task is done.
+
+Requests to ``/api/2/inf/ecs``, ``/image`` and ``/config`` are sent at
+``--rate`` per second (or as fast as ``--concurrency`` allows, with a rate of
+0), in the proportions of ``--mix``. Every response with a ``Link: <...>;
+rel=status`` header is then polled until the task finishes. Two latencies are
+reported for each end point:
+
+- accept: until the API answered the request
+- completion: until the task finished (the same as accept when there's no task)
+
+To plan capacity offline, run the API and a local broker as usual, and use
+``fake_worker.py`` as the worker::
+
+    VLAB_MESSAGE_BROKER=pyamqp://localhost python -m benchmarks.fake_worker --vms 500
+    python -m benchmarks.loadtest --url http://localhost:5000 --rate 20 --requests 1000
+"""
+import re
+import ssl
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+from collections import defaultdict
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from benchmarks.suite import percentile
+
+BASE_PATH = '/api/2/inf/ecs'
+STATUS_LINK = re.compile(r'<([^>]+)>;\s*rel=status')
+
+
+class Client:
+    """Sends requests to the API, keeping one connection open per thread
+
+    :param url: Where the API is, i.e. ``http://localhost:5000``
+    :type url: String
+
+    :param token: The auth token to send with every request
+    :type token: String
+
+    :param timeout: Seconds to wait on any one response
+    :type timeout: Float
+    """
+    def __init__(self, url, token, timeout):
+        parts = urlsplit(url)
+        self._https = parts.scheme == 'https'
+        self._netloc = parts.netloc
+        self._token = token
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self._https:
+                conn = http.client.HTTPSConnection(self._netloc, timeout=self._timeout,
+                                                   context=ssl._create_unverified_context())
+            else:
+                conn = http.client.HTTPConnection(self._netloc, timeout=self._timeout)
+            self._local.conn = conn
+        return conn
+
+    def request(self, method, path, txn_id, body=None):
+        """Send a request, reconnecting once if the kept-alive connection was closed
+
+        :Returns: Tuple (status, headers, body)
+        """
+        headers = {'X-Auth': self._token, 'X-REQUEST-ID': txn_id}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                return resp.status, resp.headers, resp.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self._local.conn = None
+                if attempt == 2:
+                    raise
+
+
+class Endpoints:
+    """The requests the load test can make
+
+    :param args: The parsed command line
+    :type args: argparse.Namespace
+    """
+    def __init__(self, args):
+        self._args = args
+        self._configs = 0
+        self._lock = threading.Lock()
+
+    def show(self):
+        return 'GET', BASE_PATH, None
+
+    def image(self):
+        return 'GET', BASE_PATH + '/image', None
+
+    def config(self):
+        # Each VM can only be configured once, so every request uses the next one
+        with self._lock:
+            name = '{}{}'.format(self._args.vm_prefix, self._configs % self._args.vms)
+            self._configs += 1
+        body = {'name': name,
+                'ssh_port': self._args.ssh_port,
+                'gateway_ip': self._args.gateway_ip,
+                'ecs_ip': '192.168.1.2'}
+        return 'POST', BASE_PATH + '/config', body
+
+
+def run_one(client, endpoints, name, txn_id, args):
+    """Make one request, then poll its task until it's done
+
+    :Returns: Dictionary
+    """
+    method, path, body = getattr(endpoints, name)()
+    result = {'endpoint': name, 'error': None, 'accept': None, 'completion': None}
+    start = time.perf_counter()
+    try:
+        status, headers, _ = client.request(method, path, txn_id, body)
+        result['accept'] = time.perf_counter() - start
+        if status >= 400:
+            result['error'] = 'HTTP {} from {}'.format(status, path)
+            return result
+        link = STATUS_LINK.search(headers.get('Link', ''))
+        if link:
+            # The link is for the public URL of the API, which might not be --url
+            status_path = urlsplit(link.group(1)).path
+            deadline = start + args.task_timeout
+            status = 202
+            while status == 202:
+                if time.perf_counter() > deadline:
+                    result['error'] = 'Timed out polling {}'.format(status_path)
+                    return result
+                time.sleep(args.poll_interval)
+                status, _, _ = client.request('GET', status_path, txn_id)
+            if status >= 400:
+                result['error'] = 'HTTP {} from {}'.format(status, status_path)
+                return result
+        result['completion'] = time.perf_counter() - start
+    except Exception as doh:
+        result['error'] = '{}: {}'.format(type(doh).__name__, doh)
+    return result
+
+
+def summarize(results, elapsed):
+    """Reduce the results to counts and percentiles, per end point and overall
+
+    :Returns: Dictionary
+    """
+    grouped = defaultdict(list)
+    for result in results:
+        grouped[result['endpoint']].append(result)
+        grouped['all'].append(result)
+    summary = {}
+    for name, group in grouped.items():
+        accepted = [x['accept'] for x in group if x['accept'] is not None]
+        completed = [x['completion'] for x in group if x['completion'] is not None]
+        summary[name] = {'requests': len(group),
+                         'errors': sum(1 for x in group if x['error']),
+                         'rate': round(len(group) / elapsed, 2) if elapsed else 0}
+        for label, samples in (('accept', accepted), ('completion', completed)):
+            for pct in (50, 95, 99):
+                summary[name]['{}_p{}'.format(label, pct)] = round(percentile(samples, pct), 4)
+    return summary
+
+
+def report(summary):
+    """Print a table of the summary"""
+    print('{:>8} | {:>8} {:>6} {:>8} | {:>8} {:>8} {:>8} | {:>8} {:>8} {:>8}'.format(
+          'endpoint', 'requests', 'errors', 'req/sec', 'acc p50', 'acc p95', 'acc p99', 'done p50', 'done p95', 'done p99'))
+    for name in sorted(summary, key=lambda x: (x == 'all', x)):
+        row = summary[name]
+        print('{:>8} | {:>8} {:>6} {:>8} | {:>8} {:>8} {:>8} | {:>8} {:>8} {:>8}'.format(
+              name, row['requests'], row['errors'], row['rate'],
+              row['accept_p50'], row['accept_p95'], row['accept_p99'],
+              row['completion_p50'], row['completion_p95'], row['completion_p99']))
+
+
+def parse_mix(mix):
+    """Turn ``show=8,image=1`` into the names and weights of the end points
+
+    :Returns: Tuple (names, weights)
+    """
+    names, weights = [], []
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        if not hasattr(Endpoints, name):
+            raise ValueError('No such end point: {}'.format(name))
+        names.append(name)
+        weights.append(float(weight))
+    return names, weights
+
+
+def main(args):
+    """Send the load, then report (and optionally save) the latencies
+
+    :Returns: Integer (the exit code)
+    """
+    rng = random.Random(args.seed)
+    names, weights = parse_mix(args.mix)
+    token = args.token or generate_v2_test_token(username=args.username).decode()
+    client = Client(args.url, token, args.http_timeout)
+    endpoints = Endpoints(args)
+    futures = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for idx in range(args.requests):
+            if args.rate:
+                # Open loop; a slow API doesn't slow down the arrival of requests
+                delay = start + idx / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            name = rng.choices(names, weights)[0]
+            txn_id = 'loadtest-{}'.format(idx)
+            futures.append(executor.submit(run_one, client, endpoints, name, txn_id, args))
+        results = [x.result() for x in futures]
+    elapsed = time.perf_counter() - start
+    summary = summarize(results, elapsed)
+    report(summary)
+    errors = [x['error'] for x in results if x['error']]
+    if errors:
+        print('First error: {}'.format(errors[0]))
+    if args.output:
+        with open(args.output, 'w') as the_file:
+            json.dump({'settings': {k: v for k, v in vars(args).items() if k not in ('token', 'output')},
+                       'seconds': round(elapsed, 4),
+                       'summary': summary}, the_file, indent=2, sort_keys=True)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000',
+                        help='Where the API is')
+    parser.add_argument('--token',
+                        help='The auth token to use; defaults to a test token for --username')
+    parser.add_argument('--username', default='alice',
+                        help='Who the test token is for')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='How many requests to send')
+    parser.add_argument('--rate', type=float, default=10,
+                        help='Requests per second to send; 0 sends as fast as --concurrency allows')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='The most requests (including polling their task) at once')
+    parser.add_argument('--mix', default='show=8,image=1,config=1',
+                        help='The end points to call, and how often relative to each other')
+    parser.add_argument('--poll-interval', type=float, default=0.25,
+                        help='Seconds between checks of a task')
+    parser.add_argument('--task-timeout', type=float, default=600,
+                        help='Seconds to wait on a task before counting it as an error')
+    parser.add_argument('--http-timeout', type=float, default=30,
+                        help='Seconds to wait on any one response')
+    parser.add_argument('--vms', type=int, default=500,
+                        help='How many VMs (see fake_worker.py) there are to configure')
+    parser.add_argument('--vm-prefix', default='ecs',
+                        help='The names of the VMs to configure, without the number')
+    parser.add_argument('--ssh-port', type=int, default=2222,
+                        help='The SSH port sent to /config')
+    parser.add_argument('--gateway-ip', default='127.0.0.1',
+                        help='The gateway IP sent to /config')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seeds the choice of end point for each request')
+    parser.add_argument('--output',
+                        help='Write the summary to this JSON file')
+    sys.exit(main(parser.parse_args()))
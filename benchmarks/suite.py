@@ -0,0 +1,310 @@
+# -*- coding: UTF-8 -*-
+"""
+Runs repeatable throughput and latency scenarios against a fake vCenter and a
+fake SSH server, saves the results as JSON, and flags regressions.
+
+Nothing leaves the local machine; vCenter is ``fake_vcenter.FakeVcenter`` (with
+an artificial latency per round trip and per task) and the ECS VM is
+``fake_ssh.FakeSSHServer`` (with scripted, delayed output). The scenarios are:
+
+- ``show``: many threads listing a user's folder of ``--vms`` VMs
+- ``create``: concurrent calls to ``create_ecs``
+- ``delete``: concurrent calls to ``delete_ecs``
+- ``bulk_delete``: one call to ``bulk_delete_ecs`` for a whole folder
+- ``config``: complete runs of ``setup_ecs.configure``
+
+Usage::
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --baseline before.json --output after.json
+
+When a baseline is supplied, the exit code is 1 if any scenario got slower (or
+made more round trips to vCenter) by more than ``--tolerance``.
+"""
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+
+from vlab_inf_common.vmware import virtual_machine
+
+from vlab_ecs_api.lib.worker import vmware, setup_ecs, image_catalog
+from vlab_ecs_api.lib.worker.session_pool import SessionPool
+from benchmarks.fake_vcenter import FakeVcenter
+from benchmarks.fake_ssh import FakeSSHServer, ecs_replies
+from benchmarks.bench_create_ecs import make_ova
+
+USERNAME = 'alice'
+NETWORK = 'alice_frontend'
+VERSION = '3.2.2'
+# For each metric, True if a bigger number is a regression
+METRICS = {'p50': True, 'p95': True, 'p99': True, 'throughput': False, 'round_trips_per_op': True}
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(samples, pct):
+    """The value below which ``pct`` percent of the samples fall (nearest rank)
+
+    :Returns: Float
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return float('nan')
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def measure(func, items, workers, vcenter=None):
+    """Call ``func`` with every item, ``workers`` at a time, timing each call
+
+    :Returns: Dictionary
+    """
+    latencies = []
+    errors = []
+
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            func(item)
+        except Exception as doh:
+            errors.append(str(doh))
+        latencies.append(time.perf_counter() - start)
+
+    if vcenter:
+        vcenter.stub.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(timed, items))
+    elapsed = time.perf_counter() - start
+    ops = len(latencies)
+    result = {'ops': ops,
+              'workers': workers,
+              'seconds': round(elapsed, 4),
+              'throughput': round(ops / elapsed, 2) if elapsed else 0,
+              'p50': round(percentile(latencies, 50), 4),
+              'p95': round(percentile(latencies, 95), 4),
+              'p99': round(percentile(latencies, 99), 4),
+              'max': round(max(latencies), 4) if latencies else 0,
+              'errors': len(errors),
+             }
+    if vcenter:
+        result['round_trips_per_op'] = round(vcenter.stub.round_trips / ops, 2) if ops else 0
+    if errors:
+        logger.warning('%s of %s calls failed, i.e. %s', len(errors), ops, errors[0])
+    return result
+
+
+class Backend:
+    """Points ``vmware.py`` at a fake vCenter, through a real session pool
+
+    :param args: The parsed command line
+    :type args: argparse.Namespace
+    """
+    def __init__(self, args):
+        self.vcenter = FakeVcenter(latency=args.latency, task_latency=args.task_latency)
+        self.folder = self.vcenter.add_user(USERNAME, 0)
+        self.network = self.vcenter.networks[NETWORK]
+        self.deploy_seconds = args.deploy_seconds
+        self._pool = SessionPool(factory=self.vcenter.login,
+                                 max_size=args.workers,
+                                 idle_timeout=300,
+                                 check_interval=30)
+        self._images_dir = None
+        self._patches = []
+
+    def __enter__(self):
+        self._images_dir = tempfile.mkdtemp()
+        make_ova(self._images_dir, VERSION, disk_mb=1, disk_count=1)
+        image_catalog.CATALOG.clear()
+        self._patches = [patch('ssl.get_server_certificate', return_value=self.vcenter.cert),
+                         patch.object(vmware, 'vcenter_session', self._pool.session),
+                         patch.object(image_catalog.CATALOG, '_images_dir', self._images_dir),
+                         patch.object(virtual_machine, 'deploy_from_ova', self.deploy_from_ova)]
+        for the_patch in self._patches:
+            the_patch.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, the_traceback):
+        for the_patch in reversed(self._patches):
+            the_patch.stop()
+        self._pool.close()
+        image_catalog.CATALOG.clear()
+        shutil.rmtree(self._images_dir)
+
+    def deploy_from_ova(self, vcenter, ova, network_map, username, machine_name, logger, power_on=True):
+        """Stands in for uploading the OVA; it's a single (long) round trip"""
+        self.vcenter.stub.round_trip('ImportVApp')
+        time.sleep(self.deploy_seconds)
+        power_state = 'poweredOn' if power_on else 'poweredOff'
+        return self.vcenter.add_vm(self.folder, machine_name, network=self.network, power_state=power_state)
+
+    def add_vms(self, count, prefix):
+        """Create some of the user's ECS VMs, returning their names
+
+        :Returns: List
+        """
+        names = []
+        for idx in range(count):
+            name = '{}{}'.format(prefix, idx)
+            meta = {'component': 'Ecs', 'created': 1234, 'version': VERSION, 'configured': False, 'generation': 1}
+            self.vcenter.add_vm(self.folder, name, meta=meta, network=self.network,
+                                ip='192.168.1.{}'.format(idx % 250 + 2))
+            names.append(name)
+        return names
+
+
+def scenario_show(args):
+    """Many threads listing a big folder, like a class all refreshing the UI"""
+    with Backend(args) as backend:
+        backend.add_vms(args.vms, 'show')
+        # Warm up the session pool, so logins aren't part of the numbers
+        vmware.show_ecs(USERNAME)
+        return measure(lambda _: vmware.show_ecs(USERNAME), range(args.requests), args.workers, backend.vcenter)
+
+
+def scenario_create(args):
+    """Concurrent creates, each a separate task in production"""
+    with Backend(args) as backend:
+        names = ['create{}'.format(x) for x in range(args.creates)]
+        create = lambda name: vmware.create_ecs(USERNAME, name, VERSION, NETWORK, logger)
+        return measure(create, names, args.workers, backend.vcenter)
+
+
+def scenario_delete(args):
+    """Concurrent deletes, each a separate task in production"""
+    with Backend(args) as backend:
+        names = backend.add_vms(args.creates, 'delete')
+        delete = lambda name: vmware.delete_ecs(USERNAME, name, logger)
+        return measure(delete, names, args.workers, backend.vcenter)
+
+
+def scenario_bulk_delete(args):
+    """Deleting a whole folder with one task"""
+    with Backend(args) as backend:
+        names = backend.add_vms(args.creates, 'bulk')
+        return measure(lambda _: vmware.bulk_delete_ecs(USERNAME, names, logger), [None], 1, backend.vcenter)
+
+
+def scenario_config(args):
+    """Complete runs of configuring ECS over SSH"""
+    with FakeSSHServer(ecs_replies(args.config_lines, args.config_seconds)) as server:
+        configure = lambda _: setup_ecs.configure(server.port, '127.0.0.1', '192.168.1.2', logger)
+        return measure(configure, range(args.config_runs), 1)
+
+
+SCENARIOS = {'show': scenario_show,
+             'create': scenario_create,
+             'delete': scenario_delete,
+             'bulk_delete': scenario_bulk_delete,
+             'config': scenario_config,
+            }
+
+
+def compare(results, baseline, tolerance):
+    """Find every metric that got worse than the baseline by more than ``tolerance``
+
+    :Returns: List of String
+    """
+    if results['settings'] != baseline.get('settings'):
+        print('WARNING: the baseline was run with different settings; the comparison may be meaningless')
+    regressions = []
+    for name, metrics in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        for metric, higher_is_worse in METRICS.items():
+            old, new = before.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if not higher_is_worse:
+                change = -change
+            if change > tolerance:
+                regressions.append('{} {}: {} -> {} ({:+.0%})'.format(name, metric, old, new,
+                                                                      change if higher_is_worse else -change))
+    return regressions
+
+
+def report(results):
+    """Print a table of the results"""
+    print('{:>12} | {:>6} {:>10} {:>9} {:>9} {:>9} {:>12} {:>6}'.format('scenario', 'ops', 'ops/sec', 'p50', 'p95', 'p99',
+                                                                        'trips/op', 'errors'))
+    for name, metrics in results['scenarios'].items():
+        print('{:>12} | {:>6} {:>10} {:>9} {:>9} {:>9} {:>12} {:>6}'.format(name, metrics['ops'], metrics['throughput'],
+                                                                            metrics['p50'], metrics['p95'], metrics['p99'],
+                                                                            metrics.get('round_trips_per_op', '-'),
+                                                                            metrics['errors']))
+
+
+def main(args):
+    """Run the scenarios, then save and check the results
+
+    :Returns: Integer (the exit code)
+    """
+    random.seed(args.seed)
+    settings = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'tolerance', 'scenarios')}
+    results = {'python': platform.python_version(),
+               'created': time.time(),
+               'settings': settings,
+               'scenarios': {}}
+    for name in args.scenarios:
+        results['scenarios'][name] = SCENARIOS[name](args)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as the_file:
+            json.dump(results, the_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as the_file:
+            baseline = json.load(the_file)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        if regressions:
+            return 1
+    if any(x['errors'] for x in results['scenarios'].values()):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help='Which scenarios to run')
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='Seconds each round trip to the fake vCenter takes')
+    parser.add_argument('--task-latency', type=float, default=0.05,
+                        help='Seconds each vCenter task (i.e. power on) runs')
+    parser.add_argument('--deploy-seconds', type=float, default=0.2,
+                        help='Seconds importing an OVA takes')
+    parser.add_argument('--vms', type=int, default=100,
+                        help='How many VMs are in the folder that is listed')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='How many times the folder is listed')
+    parser.add_argument('--creates', type=int, default=16,
+                        help='How many VMs are created, and deleted')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='How many calls run at once')
+    parser.add_argument('--config-runs', type=int, default=3,
+                        help='How many times ECS is configured')
+    parser.add_argument('--config-lines', type=int, default=50,
+                        help='Lines of output each step of configuring ECS writes')
+    parser.add_argument('--config-seconds', type=float, default=0.5,
+                        help='Seconds each step of configuring ECS runs')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seeds the random number generator')
+    parser.add_argument('--output',
+                        help='Write the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='A JSON file of earlier results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='How much worse (0.2 is 20%%) a metric can get before it is a regression')
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main(parser.parse_args()))
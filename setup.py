@@ -10,10 +10,13 @@ setup(name="vlab-ecs-api",
       author="Nicholas Willhite,",
       author_email='willnx84@gmail.com',
       version='2019.07.02',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks']),
       include_package_data=True,
       package_files={'vlab_ecs_api' : ['app.ini']},
       description="ecs",
       install_requires=['flask', 'ldap3', 'pyjwt', 'uwsgi', 'vlab-api-common',
-                        'ujson', 'cryptography', 'vlab-inf-common', 'celery', 'paramiko']
+                        'ujson', 'cryptography', 'vlab-inf-common', 'celery', 'paramiko',
+                        'prometheus_client', 'redis'],
+      # For VLAB_ECS_RESULT_BACKEND=db+sqlite:///...
+      extras_require={'sqlite': ['sqlalchemy']}
       )
@@ -0,0 +1,116 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``cached_ova.py`` module"""
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from vlab_ecs_api.lib.worker import cached_ova, image_catalog
+
+
+class TestMemberReader(unittest.TestCase):
+    """A set of test cases for the ``MemberReader`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.handle = io.BytesIO(b'headerDISKDATAtrailer')
+        self.reader = cached_ova.MemberReader(self.handle, offset=6, size=8)
+
+    def test_read(self):
+        """``MemberReader`` - the 'read' method only returns the member's data"""
+        self.assertEqual(self.reader.read(), b'DISKDATA')
+
+    def test_read_chunks(self):
+        """``MemberReader`` - the 'read' method picks up where the last read stopped"""
+        first = self.reader.read(3)
+        second = self.reader.read(100)
+        third = self.reader.read(1)
+
+        self.assertEqual((first, second, third), (b'DIS', b'KDATA', b''))
+
+    def test_read_shared_handle(self):
+        """``MemberReader`` - reading elsewhere in the file doesn't upset the reader"""
+        self.reader.read(4)
+        self.handle.seek(0)
+        self.handle.read(2)
+
+        self.assertEqual(self.reader.read(), b'DATA')
+
+    def test_seek(self):
+        """``MemberReader`` - the 'seek' method is relative to the start of the member"""
+        self.reader.read()
+        self.reader.seek(0, 0)
+
+        self.assertEqual(self.reader.read(4), b'DISK')
+
+    def test_seek_end(self):
+        """``MemberReader`` - seeking to the end returns the member's size"""
+        self.assertEqual(self.reader.seek(0, 2), 8)
+
+
+class TestCachedOva(unittest.TestCase):
+    """A set of test cases for the ``CachedOva`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.images_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.images_dir, 'ECS-3.2.2.ova')
+        with tarfile.open(self.path, 'w') as the_ova:
+            for name, data in (('ECS.ovf', b'<Network ovf:name="VM Network">'),
+                               ('ECS-disk1.vmdk', b'first disk'),
+                               ('ECS-disk2.vmdk', b'second disk')):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                the_ova.addfile(info, io.BytesIO(data))
+        self.info = image_catalog._read_image(self.path)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.images_dir)
+
+    def test_disks(self):
+        """``CachedOva`` - each disk reads the same data the tarball holds"""
+        ova = cached_ova.CachedOva(self.info)
+        data = {x: ova._disks[x].read() for x in ova.vmdks}
+        ova.close()
+        expected = {'ECS-disk1.vmdk': b'first disk', 'ECS-disk2.vmdk': b'second disk'}
+
+        self.assertEqual(data, expected)
+
+    def test_disk_size(self):
+        """``CachedOva`` - the size of a disk is known without seeking (for Content-Length)"""
+        ova = cached_ova.CachedOva(self.info)
+        size = ova._get_tarfile_size(ova._disks['ECS-disk2.vmdk'])
+        ova.close()
+
+        self.assertEqual(size, len(b'second disk'))
+
+    def test_networks(self):
+        """``CachedOva`` - the 'networks' property comes from the cached details"""
+        ova = cached_ova.CachedOva(self.info)
+        networks = ova.networks
+        ova.close()
+
+        self.assertEqual(networks, ['VM Network'])
+
+    def test_ovf(self):
+        """``CachedOva`` - the 'ovf' property comes from the cached details"""
+        ova = cached_ova.CachedOva(self.info)
+        ovf = ova.ovf
+        ova.close()
+
+        self.assertEqual(ovf, '<Network ovf:name="VM Network">')
+
+    def test_stale(self):
+        """``CachedOva`` - the 'stale' attribute is set if the OVA changed since it was read"""
+        os.utime(self.path, ns=(0, 1))
+        ova = cached_ova.CachedOva(self.info)
+        ova.close()
+
+        self.assertTrue(ova.stale)
+
+
+if __name__ == '__main__':
+    unittest.main()
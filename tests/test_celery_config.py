@@ -0,0 +1,114 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``celery_config.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_ecs_api.lib import celery_config
+
+
+class TestCeleryConfig(unittest.TestCase):
+    """A set of test cases for the ``celery_config.py`` module"""
+
+    def test_configure(self):
+        """``configure`` sets the task routes of the Celery app"""
+        app = MagicMock()
+        celery_config.configure(app)
+
+        self.assertEqual(app.conf.task_routes, celery_config.TASK_ROUTES)
+
+    def test_configure_result_backend(self):
+        """``configure`` sets the result backend, along with how long results are kept"""
+        app = MagicMock()
+        celery_config.configure(app)
+
+        self.assertEqual(app.conf.result_backend, celery_config.const.VLAB_ECS_RESULT_BACKEND)
+        self.assertEqual(app.conf.result_expires, celery_config.const.VLAB_ECS_RESULT_EXPIRES)
+
+    def test_configure_result_extended(self):
+        """``configure`` stores the name of a task with its result, so the API can look it up"""
+        app = MagicMock()
+        celery_config.configure(app)
+
+        self.assertTrue(app.conf.result_extended)
+
+    def test_configure_no_compression(self):
+        """``configure`` doesn't compress results when 'VLAB_ECS_RESULT_COMPRESSION' is empty"""
+        app = MagicMock()
+        with patch.object(celery_config, 'const', celery_config.const._replace(VLAB_ECS_RESULT_COMPRESSION='')):
+            celery_config.configure(app)
+
+        self.assertTrue(app.conf.result_compression is None)
+
+    def test_tasks_result_backend(self):
+        """The worker's Celery app stores results in the configured backend, not 'rpc://'"""
+        from vlab_ecs_api.lib.worker import tasks
+
+        self.assertEqual(tasks.app.conf.result_backend, celery_config.const.VLAB_ECS_RESULT_BACKEND)
+
+    def test_config_queue(self):
+        """``configure`` puts 'ecs.config' on its own queue"""
+        queue = celery_config.TASK_ROUTES['ecs.config']['queue']
+
+        self.assertEqual(queue, celery_config.const.VLAB_ECS_CONFIG_QUEUE)
+
+    def test_tasks_routed(self):
+        """The worker's Celery app routes 'ecs.config' to the config queue"""
+        from vlab_ecs_api.lib.worker import tasks
+        route = tasks.app.amqp.router.route({}, 'ecs.config')
+
+        self.assertEqual(route['queue'].name, celery_config.const.VLAB_ECS_CONFIG_QUEUE)
+
+    def test_read_queue(self):
+        """``queue_for`` puts the cheap lookups on the read queue"""
+        queues = {celery_config.queue_for('ecs.show'), celery_config.queue_for('ecs.image')}
+
+        self.assertEqual(queues, {celery_config.const.VLAB_ECS_READ_QUEUE})
+
+    def test_vcenter_queue(self):
+        """``queue_for`` puts the tasks that change vCenter on the vCenter queue"""
+        queues = {celery_config.queue_for('ecs.create'),
+                  celery_config.queue_for('ecs.delete'),
+                  celery_config.queue_for('ecs.modify_network')}
+
+        self.assertEqual(queues, {celery_config.const.VLAB_ECS_VCENTER_QUEUE})
+
+    def test_beat_schedule(self):
+        """``configure`` only schedules syncing base VMs when cloning ECS"""
+        app = MagicMock()
+        with patch.object(celery_config, 'const', celery_config.const._replace(VLAB_ECS_DEPLOY_MODE='clone')):
+            celery_config.configure(app)
+
+        self.assertEqual(app.conf.beat_schedule, celery_config.BEAT_SCHEDULE)
+
+    def test_beat_schedule_pool(self):
+        """``configure`` schedules refilling the warm pool when it's enabled"""
+        app = MagicMock()
+        with patch.object(celery_config, 'const', celery_config.const._replace(VLAB_ECS_WARM_POOL_SIZE=2)):
+            celery_config.configure(app)
+
+        self.assertEqual(app.conf.beat_schedule, celery_config.POOL_BEAT_SCHEDULE)
+
+    def test_queue_for_unknown(self):
+        """``queue_for`` defaults to the read queue"""
+        output = celery_config.queue_for('ecs.someNewTask')
+
+        self.assertEqual(output, celery_config.const.VLAB_ECS_READ_QUEUE)
+
+    def test_every_task_routed(self):
+        """Every task the worker registers has an explicit route"""
+        from vlab_ecs_api.lib.worker import tasks
+        ecs_tasks = {x for x in tasks.app.tasks.keys() if x.startswith('ecs.')}
+
+        self.assertEqual(ecs_tasks, set(celery_config.TASK_ROUTES.keys()))
+
+    def test_every_queue_consumed(self):
+        """A worker started without '-Q' (the WorkerDockerfile default) consumes the queue of every task"""
+        from vlab_ecs_api.lib.worker import tasks
+        consumed = {x.name for x in tasks.app.conf.task_queues}
+        routed = {x['queue'] for x in celery_config.TASK_ROUTES.values()}
+
+        self.assertEqual(consumed, routed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,7 @@ from vlab_api_common import flask_common
 from vlab_api_common.http_auth import generate_v2_test_token
 
 
+from vlab_ecs_api.lib import shared_store
 from vlab_ecs_api.lib.views import ecs
 
 
@@ -33,6 +34,16 @@ class TestEcsView(unittest.TestCase):
         cls.fake_task = MagicMock()
         cls.fake_task.id = 'asdf-asdf-asdf'
         app.celery_app.send_task.return_value = cls.fake_task
+        ecs.RESPONSE_CACHE.clear()
+        # Without Redis, the cached results would never be good for the current generation
+        cls.generations_patcher = patch.object(ecs.RESPONSE_CACHE, '_generations', shared_store.Generations('memory://'))
+        cls.generations_patcher.start()
+
+    @classmethod
+    def tearDown(cls):
+        """Runs after every test case"""
+        cls.generations_patcher.stop()
+        ecs.SINGLE_FLIGHT.clear()
 
     def test_v1_deprecated(self):
         """EcsView - GET on /api/1/inf/ecs returns an HTTP 404"""
@@ -54,6 +65,16 @@ class TestEcsView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_get_task_queue(self):
+        """EcsView - GET on /api/2/inf/ecs sends the task to the read queue"""
+        self.app.get('/api/2/inf/ecs',
+                     headers={'X-Auth': self.token})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+        expected = ecs.const.VLAB_ECS_READ_QUEUE
+
+        self.assertEqual(the_kwargs['queue'], expected)
+
     def test_get_task_link(self):
         """EcsView - GET on /api/2/inf/ecs sets the Link header"""
         resp = self.app.get('/api/2/inf/ecs',
@@ -77,6 +98,26 @@ class TestEcsView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_post_trace(self):
+        """EcsView - POST on /api/2/inf/ecs asks the worker for timings when the client sends X-VLAB-TRACE"""
+        self.app.post('/api/2/inf/ecs',
+                      headers={'X-Auth': self.token, 'X-VLAB-TRACE': 'true'},
+                      json={'name': "myEcsBox", 'image': "3.2.2", 'network': "someLAN"})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(the_kwargs['headers'], {ecs.celery_config.TRACE_HEADER: True})
+
+    def test_post_no_trace(self):
+        """EcsView - POST on /api/2/inf/ecs doesn't ask the worker for timings by default"""
+        self.app.post('/api/2/inf/ecs',
+                      headers={'X-Auth': self.token},
+                      json={'name': "myEcsBox", 'image': "3.2.2", 'network': "someLAN"})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertTrue(the_kwargs['headers'] is None)
+
     def test_post_task_link(self):
         """EcsView - POST on /api/2/inf/ecs sets the Link header"""
         resp = self.app.post('/api/2/inf/ecs',
@@ -161,5 +202,236 @@ class TestEcsView(unittest.TestCase):
         self.assertEqual(task_id, expected)
 
 
+    @patch.object(ecs, 'chord')
+    def test_bulk_create(self, fake_chord):
+        """EcsView - POST on /api/2/inf/ecs/bulk sends an ``ecs.create`` task for every instance"""
+        fake_chord.return_value.return_value = self.fake_task
+        self.app.post('/api/2/inf/ecs/bulk',
+                      headers={'X-Auth': self.token},
+                      json={'names': ['ecs1', 'ecs2'], 'image': '3.2.2', 'network': "someLAN"})
+
+        signature = self.app.application.celery_app.signature
+        creates = [x for x in signature.call_args_list if x[0][0] == 'ecs.create']
+        sent = [x[1]['args'] for x in creates]
+        expected = [['bob', 'ecs1', '3.2.2', 'bob_someLAN', 'noId'],
+                    ['bob', 'ecs2', '3.2.2', 'bob_someLAN', 'noId']]
+
+        self.assertEqual(sent, expected)
+        self.assertEqual(creates[0][1]['queue'], ecs.const.VLAB_ECS_VCENTER_QUEUE)
+        self.assertEqual(creates[0][1]['kwargs'], {'bulk': True})
+        self.assertEqual(len(fake_chord.call_args[0][0]), 2)
+
+    @patch.object(ecs, 'chord')
+    def test_bulk_create_results(self, fake_chord):
+        """EcsView - POST on /api/2/inf/ecs/bulk returns the task-id of the task that combines every result"""
+        fake_chord.return_value.return_value = self.fake_task
+        resp = self.app.post('/api/2/inf/ecs/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'names': ['ecs1', 'ecs2'], 'image': '3.2.2', 'network': "someLAN"})
+
+        signature = self.app.application.celery_app.signature
+        callback = fake_chord.return_value.call_args[0][0]
+
+        self.assertEqual(resp.json['content']['task-id'], 'asdf-asdf-asdf')
+        self.assertTrue(callback is signature.return_value)
+        signature.assert_called_with('ecs.bulk_results', args=[['ecs1', 'ecs2'], 'noId'],
+                                     queue=ecs.const.VLAB_ECS_READ_QUEUE)
+
+    @patch.object(ecs, 'chord')
+    def test_bulk_create_link(self, fake_chord):
+        """EcsView - POST on /api/2/inf/ecs/bulk sets the Link header"""
+        fake_chord.return_value.return_value = self.fake_task
+        resp = self.app.post('/api/2/inf/ecs/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'names': ['ecs1', 'ecs2'], 'image': '3.2.2', 'network': "someLAN"})
+
+        link = resp.headers['Link']
+        expected = '<https://localhost/api/2/inf/ecs/task/asdf-asdf-asdf>; rel=status'
+
+        self.assertEqual(link, expected)
+
+    def test_bulk_create_no_names(self):
+        """EcsView - POST on /api/2/inf/ecs/bulk requires at least one name"""
+        resp = self.app.post('/api/2/inf/ecs/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'names': [], 'image': '3.2.2', 'network': "someLAN"})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bulk_delete(self):
+        """EcsView - DELETE on /api/2/inf/ecs/bulk returns a task-id"""
+        resp = self.app.delete('/api/2/inf/ecs/bulk',
+                               headers={'X-Auth': self.token},
+                               json={'names': ['ecs1', 'ecs2']})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(resp.json['content']['task-id'], 'asdf-asdf-asdf')
+        self.assertEqual(the_args, ('ecs.bulk_delete', ['bob', ['ecs1', 'ecs2'], 'noId']))
+
+
+    def _complete_task(self, content):
+        """Fetch the result of the task, as a client polling the Link would"""
+        result = self.app.application.celery_app.AsyncResult.return_value
+        result.status = 'SUCCESS'
+        result.result = {'content': content, 'error': None, 'params': {}}
+        return self.app.get('/api/2/inf/ecs/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+    def test_get_cached(self):
+        """EcsView - GET on /api/2/inf/ecs answers from the last result, without sending a task"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self._complete_task({'myEcs': {}})
+
+        resp = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], {'myEcs': {}})
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
+    def test_task_etag(self):
+        """EcsView - GET on /api/2/inf/ecs/task sets the ETag of a cached result"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        resp = self._complete_task({'myEcs': {}})
+
+        self.assertTrue(resp.headers.get('ETag'))
+
+    def test_get_not_modified(self):
+        """EcsView - GET on /api/2/inf/ecs returns HTTP 304 when the ETag matches"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        etag = self._complete_task({'myEcs': {}}).headers['ETag']
+
+        resp = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token, 'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test_get_modified(self):
+        """EcsView - GET on /api/2/inf/ecs returns the content when the ETag doesn't match"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self._complete_task({'myEcs': {}})
+
+        resp = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token, 'If-None-Match': '"nope"'})
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_get_stale(self):
+        """EcsView - GET on /api/2/inf/ecs returns a stale result with the id of one task that refreshes it"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self._complete_task({'myEcs': {}})
+
+        with patch.object(ecs.RESPONSE_CACHE, '_ttl', 0):
+            resp1 = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+            resp2 = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp1.json['content'], {'myEcs': {}})
+        self.assertEqual(resp1.json['refresh-task-id'], 'asdf-asdf-asdf')
+        self.assertEqual(resp2.json['refresh-task-id'], 'asdf-asdf-asdf')
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_post_invalidates(self):
+        """EcsView - POST on /api/2/inf/ecs forgets the user's cached ECS instances"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self._complete_task({})
+        self.app.post('/api/2/inf/ecs',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN", 'name': "myEcsBox", 'image': "someVersion"})
+
+        resp = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_task_done_invalidates(self):
+        """EcsView - a finished task, that changed VMs, forgets the user's cached ECS instances"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self._complete_task({})
+        self.app.application.celery_app.AsyncResult.return_value.name = 'ecs.delete'
+        self._complete_task({})
+
+        resp = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_other_read_done_keeps_cache(self):
+        """EcsView - a finished read, that another API process sent, keeps the user's cached ECS instances"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self._complete_task({})
+        self.app.application.celery_app.AsyncResult.return_value.name = 'ecs.show'
+        self._complete_task({})
+
+        resp = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_modify_network(self):
+        """EcsView - PUT on /api/2/inf/ecs/network sends the task to the vCenter queue"""
+        resp = self.app.put('/api/2/inf/ecs/network',
+                            headers={'X-Auth': self.token},
+                            json={'name': 'myEcsBox', 'new_network': 'someLAN'})
+
+        the_args, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(resp.json['content']['task-id'], 'asdf-asdf-asdf')
+        self.assertEqual(the_args, ('ecs.modify_network', ['bob', 'myEcsBox', 'bob_someLAN', 'noId']))
+        self.assertEqual(the_kwargs['queue'], ecs.const.VLAB_ECS_VCENTER_QUEUE)
+
+    def test_modify_network_invalidates(self):
+        """EcsView - PUT on /api/2/inf/ecs/network forgets the user's cached ECS instances"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self._complete_task({})
+        self.app.put('/api/2/inf/ecs/network',
+                     headers={'X-Auth': self.token},
+                     json={'name': 'myEcsBox', 'new_network': 'someLAN'})
+
+        resp = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_worker_change_invalidates(self):
+        """EcsView - a change a worker made, that this API process never saw, forgets the user's cached ECS instances"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self._complete_task({})
+        ecs.RESPONSE_CACHE._generations.bump('inventory:bob')
+
+        resp = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_image_cached(self):
+        """EcsView - GET on /api/2/inf/ecs/image answers from the last result"""
+        self.app.get('/api/2/inf/ecs/image', headers={'X-Auth': self.token})
+        self._complete_task({'image': ['3.2.2']})
+
+        resp = self.app.get('/api/2/inf/ecs/image', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.json['content'], {'image': ['3.2.2']})
+
+
+    def test_get_coalesced(self):
+        """EcsView - a GET on /api/2/inf/ecs made while the same read is in flight gets the same task"""
+        resp1 = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        resp2 = self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp1.json['content'], resp2.json['content'])
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
+    def test_image_coalesced(self):
+        """EcsView - every user's GET on /api/2/inf/ecs/image shares the task in flight"""
+        other_token = generate_v2_test_token(username='alice')
+        self.app.get('/api/2/inf/ecs/image', headers={'X-Auth': self.token})
+        self.app.get('/api/2/inf/ecs/image', headers={'X-Auth': other_token})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
+    def test_post_not_coalesced(self):
+        """EcsView - a GET on /api/2/inf/ecs after a POST doesn't join a read sent before the POST"""
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+        self.app.post('/api/2/inf/ecs',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN", 'name': "myEcsBox", 'image': "someVersion"})
+        self.app.get('/api/2/inf/ecs', headers={'X-Auth': self.token})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 3)
+
+
 if __name__ == '__main__':
     unittest.main()
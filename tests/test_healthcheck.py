@@ -3,6 +3,7 @@
 A suite of tests for the healthcheck API end point
 """
 import unittest
+from unittest.mock import patch, MagicMock
 
 from flask import Flask
 
@@ -19,6 +20,11 @@ class TestHealthView(unittest.TestCase):
         healthcheck.HealthView.register(app)
         app.config['TESTING'] = True
         cls.app = app.test_client()
+        app.celery_app = MagicMock()
+        cls.celery_app = app.celery_app
+        cls.celery_app.control.ping.return_value = [{'worker1': {'ok': 'pong'}}]
+        cls.celery_app.send_task.return_value.get.return_value = {'content': {}, 'error': None, 'params': {}}
+        healthcheck.DEEP_CHECK.clear()
 
     def test_health_check(self):
         """A simple test to verify the /api/1/inf/ecs/healthcheck end point works"""
@@ -28,6 +34,70 @@ class TestHealthView(unittest.TestCase):
 
         self.assertEqual(expected, resp.status_code)
 
+    def test_version(self):
+        """The healthcheck returns the version that was looked up when the module loaded"""
+        resp = self.app.get('/api/1/inf/ecs/healthcheck')
+
+        self.assertEqual(resp.json['version'], healthcheck.VERSION)
+
+    def test_shallow(self):
+        """The healthcheck doesn't probe any dependencies unless asked to"""
+        resp = self.app.get('/api/1/inf/ecs/healthcheck')
+
+        self.assertFalse('dependencies' in resp.json)
+        self.assertFalse(self.celery_app.control.ping.called)
+
+    def test_deep(self):
+        """The deep healthcheck reports the state, and latency, of every dependency"""
+        resp = self.app.get('/api/1/inf/ecs/healthcheck?deep=true')
+        dependencies = resp.json['dependencies']
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(set(dependencies.keys()), {'broker', 'workers', 'vcenter'})
+        self.assertTrue(all(x['ok'] for x in dependencies.values()))
+        self.assertTrue(all('latency' in x for x in dependencies.values()))
+
+    def test_deep_no_workers(self):
+        """The deep healthcheck returns HTTP 503 when no worker replies"""
+        self.celery_app.control.ping.return_value = []
+
+        resp = self.app.get('/api/1/inf/ecs/healthcheck?deep=true')
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertFalse(resp.json['dependencies']['workers']['ok'])
+
+    def test_deep_vcenter_error(self):
+        """The deep healthcheck reports the error of a worker that cannot reach vCenter"""
+        self.celery_app.send_task.return_value.get.return_value = {'content': {}, 'error': 'testing', 'params': {}}
+
+        resp = self.app.get('/api/1/inf/ecs/healthcheck?deep=true')
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.json['dependencies']['vcenter']['error'], 'testing')
+
+    def test_deep_broker_down(self):
+        """The deep healthcheck reports a broker it cannot connect to"""
+        self.celery_app.connection_for_write.side_effect = ConnectionRefusedError('testing')
+
+        resp = self.app.get('/api/1/inf/ecs/healthcheck?deep=true')
+
+        self.assertFalse(resp.json['dependencies']['broker']['ok'])
+
+    def test_deep_cached(self):
+        """The deep healthcheck reuses the results of recent probes"""
+        self.app.get('/api/1/inf/ecs/healthcheck?deep=true')
+        self.app.get('/api/1/inf/ecs/healthcheck?deep=true')
+
+        self.assertEqual(self.celery_app.control.ping.call_count, 1)
+
+    def test_deep_expires(self):
+        """The deep healthcheck probes again once the results are older than the TTL"""
+        with patch.object(healthcheck.DEEP_CHECK, '_ttl', 0):
+            self.app.get('/api/1/inf/ecs/healthcheck?deep=true')
+            self.app.get('/api/1/inf/ecs/healthcheck?deep=true')
+
+        self.assertEqual(self.celery_app.control.ping.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``image_catalog.py`` module"""
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_ecs_api.lib.worker import image_catalog
+
+OVF = '<NetworkSection><Network ovf:name="VM Network"></Network></NetworkSection>'
+MANIFEST = 'SHA256(ECS.ovf)= ABCDEF0123\nSHA1(ECS-disk1.vmdk)= 4567\n'
+
+
+def make_ova(path, ovf=OVF, manifest=MANIFEST):
+    """Write a tiny OVA (tarball) with an OVF, manifest and "disk" """
+    with tarfile.open(path, 'w') as the_ova:
+        for name, data in (('ECS.ovf', ovf), ('ECS.mf', manifest), ('ECS-disk1.vmdk', 'not a disk')):
+            data = data.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            the_ova.addfile(info, io.BytesIO(data))
+
+
+class TestImageCatalog(unittest.TestCase):
+    """A set of test cases for the ``ImageCatalog`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.images_dir = tempfile.mkdtemp()
+        make_ova(os.path.join(self.images_dir, 'ECS-3.2.2.ova'))
+        self.catalog = image_catalog.ImageCatalog(self.images_dir, check_interval=0)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.images_dir)
+
+    def test_names(self):
+        """``ImageCatalog`` - the 'names' method returns the file name of every image"""
+        make_ova(os.path.join(self.images_dir, 'ECS-3.1.0.ova'))
+        output = self.catalog.names()
+        expected = ['ECS-3.1.0.ova', 'ECS-3.2.2.ova']
+
+        self.assertEqual(output, expected)
+
+    def test_names_cached(self):
+        """``ImageCatalog`` - the 'names' method doesn't re-read an unchanged directory"""
+        self.catalog.names()
+        with patch.object(image_catalog.os, 'scandir') as fake_scandir:
+            self.catalog.names()
+
+        self.assertFalse(fake_scandir.called)
+
+    def test_names_changed(self):
+        """``ImageCatalog`` - the 'names' method notices when the directory changes"""
+        self.catalog.names()
+        make_ova(os.path.join(self.images_dir, 'ECS-3.3.0.ova'))
+        # Some file systems only track mtime to the second
+        os.utime(self.images_dir, ns=(0, 1))
+        output = self.catalog.names()
+
+        self.assertTrue('ECS-3.3.0.ova' in output)
+
+    def test_check_interval(self):
+        """``ImageCatalog`` - the directory isn't even checked until 'check_interval' passes"""
+        catalog = image_catalog.ImageCatalog(self.images_dir, check_interval=600)
+        catalog.names()
+        with patch.object(image_catalog.os, 'stat') as fake_stat:
+            catalog.names()
+
+        self.assertFalse(fake_stat.called)
+
+    def test_get(self):
+        """``ImageCatalog`` - the 'get' method returns the details of an image"""
+        info = self.catalog.get('ECS-3.2.2.ova')
+
+        self.assertEqual(info.networks, ['VM Network'])
+        self.assertEqual(info.checksums['ECS.ovf'], ('SHA256', 'abcdef0123'))
+        self.assertEqual(info.path, os.path.join(self.images_dir, 'ECS-3.2.2.ova'))
+        self.assertTrue(info.size > 0)
+
+    def test_get_cached(self):
+        """``ImageCatalog`` - the 'get' method only reads an OVA once"""
+        self.catalog.get('ECS-3.2.2.ova')
+        with patch.object(image_catalog.tarfile, 'open') as fake_open:
+            self.catalog.get('ECS-3.2.2.ova')
+
+        self.assertFalse(fake_open.called)
+
+    def test_get_replaced(self):
+        """``ImageCatalog`` - the 'get' method re-reads an OVA that's been replaced"""
+        self.catalog.get('ECS-3.2.2.ova')
+        path = os.path.join(self.images_dir, 'ECS-3.2.2.ova')
+        make_ova(path, ovf='<Network ovf:name="Other"></Network>')
+        os.utime(path, ns=(0, 1))
+        os.utime(self.images_dir, ns=(0, 2))
+        info = self.catalog.get('ECS-3.2.2.ova')
+
+        self.assertEqual(info.networks, ['Other'])
+
+    def test_get_missing(self):
+        """``ImageCatalog`` - the 'get' method raises KeyError for an unknown image"""
+        with self.assertRaises(KeyError):
+            self.catalog.get('ECS-0.0.1.ova')
+
+    def test_open(self):
+        """``ImageCatalog`` - the 'open' method returns an OVA ready to deploy"""
+        ova = self.catalog.open('ECS-3.2.2.ova')
+        disk = ova._disks['ECS-disk1.vmdk'].read()
+        ova.close()
+
+        self.assertEqual(disk, b'not a disk')
+
+    def test_open_stale(self):
+        """``ImageCatalog`` - the 'open' method re-reads an OVA that changed since it was cached"""
+        self.catalog.get('ECS-3.2.2.ova')
+        path = os.path.join(self.images_dir, 'ECS-3.2.2.ova')
+        make_ova(path, ovf='<Network ovf:name="Other"></Network>')
+        os.utime(path, ns=(0, 1))
+        ova = self.catalog.open('ECS-3.2.2.ova')
+        ova.close()
+
+        self.assertEqual(ova.networks, ['Other'])
+        self.assertFalse(ova.stale)
+
+    def test_clear(self):
+        """``ImageCatalog`` - the 'clear' method forces the directory to be re-read"""
+        self.catalog.names()
+        self.catalog.clear()
+        with patch.object(image_catalog.os, 'scandir') as fake_scandir:
+            fake_scandir.return_value.__enter__.return_value = []
+            self.catalog.names()
+
+        self.assertTrue(fake_scandir.called)
+
+    def test_parse_manifest(self):
+        """``_parse_manifest`` ignores lines that aren't checksums"""
+        output = image_catalog._parse_manifest('garbage\nSHA1(a.vmdk)= 01\n')
+        expected = {'a.vmdk': ('SHA1', '01')}
+
+        self.assertEqual(output, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``inventory_cache.py`` module"""
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_ecs_api.lib import shared_store
+from vlab_ecs_api.lib.worker import inventory_cache
+
+
+class TestInventoryCache(unittest.TestCase):
+    """A set of test cases for the ``InventoryCache`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.generations = shared_store.Generations('memory://')
+        self.cache = inventory_cache.InventoryCache(ttl=30, generations=self.generations)
+        self.loader = MagicMock()
+        self.loader.return_value = {'myEcs': {'meta': {'component': 'Ecs'}}}
+
+    def test_get(self):
+        """``InventoryCache`` - the 'get' method returns what the loader returns"""
+        output = self.cache.get('alice', self.loader)
+        expected = {'myEcs': {'meta': {'component': 'Ecs'}}}
+
+        self.assertEqual(output, expected)
+
+    def test_get_cached(self):
+        """``InventoryCache`` - the 'get' method only calls the loader on a miss"""
+        self.cache.get('alice', self.loader)
+        self.cache.get('alice', self.loader)
+
+        self.assertEqual(self.loader.call_count, 1)
+
+    def test_get_per_user(self):
+        """``InventoryCache`` - entries are kept per user"""
+        self.cache.get('alice', self.loader)
+        self.cache.get('bob', self.loader)
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_get_copy(self):
+        """``InventoryCache`` - changing a returned inventory does not change the cached one"""
+        first = self.cache.get('alice', self.loader)
+        first['myEcs']['meta']['component'] = 'changed'
+        second = self.cache.get('alice', self.loader)
+
+        self.assertEqual(second['myEcs']['meta']['component'], 'Ecs')
+
+    def test_ttl(self):
+        """``InventoryCache`` - entries expire after the TTL"""
+        self.cache._ttl = 0
+        self.cache.get('alice', self.loader)
+        time.sleep(0.01)
+        self.cache.get('alice', self.loader)
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_invalidate(self):
+        """``InventoryCache`` - the 'invalidate' method forces the next 'get' to call the loader"""
+        self.cache.get('alice', self.loader)
+        self.cache.invalidate('alice')
+        self.cache.get('alice', self.loader)
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_invalidate_other_process(self):
+        """``InventoryCache`` - an invalidation by another process forces the next 'get' to call the loader"""
+        other = inventory_cache.InventoryCache(ttl=30, generations=self.generations)
+        self.cache.get('alice', self.loader)
+        other.invalidate('alice')
+        self.cache.get('alice', self.loader)
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_generation_unknown(self):
+        """``InventoryCache`` - nothing is cached while the generation cannot be read"""
+        with patch.object(self.generations, 'get', return_value=None):
+            self.cache.get('alice', self.loader)
+            self.cache.get('alice', self.loader)
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_invalidate_during_load(self):
+        """``InventoryCache`` - an inventory loaded while being invalidated is not cached"""
+        def loader(username):
+            self.cache.invalidate(username)
+            return {}
+        self.cache.get('alice', loader)
+        self.cache.get('alice', self.loader)
+
+        self.assertTrue(self.loader.called)
+
+    def test_clear_during_load(self):
+        """``InventoryCache`` - an inventory loaded while the cache is cleared is not cached"""
+        def loader(username):
+            self.cache.clear()
+            return {}
+        self.cache.get('alice', loader)
+        self.cache.get('alice', self.loader)
+
+        self.assertTrue(self.loader.called)
+
+    def test_clear(self):
+        """``InventoryCache`` - the 'clear' method forgets every user"""
+        self.cache.get('alice', self.loader)
+        self.cache.get('bob', self.loader)
+        self.cache.clear()
+
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_loader_error(self):
+        """``InventoryCache`` - errors from the loader are not cached"""
+        self.loader.side_effect = [ValueError('testing'), {}]
+        with self.assertRaises(ValueError):
+            self.cache.get('alice', self.loader)
+        output = self.cache.get('alice', self.loader)
+
+        self.assertEqual(output, {})
+
+    def test_stats(self):
+        """``InventoryCache`` - the 'stats' method reports hits and misses"""
+        self.cache.get('alice', self.loader)
+        self.cache.get('alice', self.loader)
+
+        stats = self.cache.stats()
+
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+
+class TestInventoryWatcher(unittest.TestCase):
+    """A set of test cases for the ``InventoryWatcher`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache = MagicMock()
+        self.watcher = inventory_cache.InventoryWatcher(cache=self.cache, login=MagicMock())
+
+    def _make_update(self, kind='modify', parent=None):
+        update = MagicMock()
+        update.kind = kind
+        update.obj._moId = 'vm-1'
+        change = MagicMock()
+        if parent:
+            change.name = 'parent'
+            change.val = parent
+        else:
+            change.name = 'runtime.powerState'
+            change.val = 'poweredOff'
+        update.changeSet = [change]
+        return update
+
+    def test_handle(self):
+        """``InventoryWatcher`` - invalidates the inventory of the user who owns the VM"""
+        folder = MagicMock()
+        folder.name = 'alice'
+        self.watcher._handle(self._make_update(kind='enter', parent=folder))
+        self.cache.reset_mock()
+        self.watcher._handle(self._make_update())
+
+        self.cache.invalidate.assert_called_with('alice')
+
+    def test_handle_unknown(self):
+        """``InventoryWatcher`` - clears the whole cache when the owner of a VM is unknown"""
+        self.watcher._handle(self._make_update())
+
+        self.assertTrue(self.cache.clear.called)
+
+    def test_handle_move(self):
+        """``InventoryWatcher`` - a VM that moves invalidates the old and new owner"""
+        alice = MagicMock()
+        alice._moId = 'group-v1'
+        alice.name = 'alice'
+        bob = MagicMock()
+        bob._moId = 'group-v2'
+        bob.name = 'bob'
+        self.watcher._handle(self._make_update(kind='enter', parent=alice))
+        self.cache.reset_mock()
+        self.watcher._handle(self._make_update(parent=bob))
+
+        invalidated = [x[0][0] for x in self.cache.invalidate.call_args_list]
+
+        self.assertEqual(set(invalidated), {'alice', 'bob'})
+
+    def test_handle_leave(self):
+        """``InventoryWatcher`` - forgets the owner of a deleted VM"""
+        folder = MagicMock()
+        folder.name = 'alice'
+        self.watcher._handle(self._make_update(kind='enter', parent=folder))
+        self.watcher._handle(self._make_update(kind='leave'))
+
+        self.assertEqual(self.watcher._owners, {})
+
+    @patch.object(inventory_cache.session_pool, 'logout')
+    @patch.object(inventory_cache.InventoryWatcher, '_make_filter')
+    def test_watch(self, fake_make_filter, fake_logout):
+        """``InventoryWatcher`` - handles every update returned by WaitForUpdatesEx"""
+        fake_collector = MagicMock()
+        fake_make_filter.return_value = (fake_collector, MagicMock())
+        update_set = MagicMock()
+        update_set.version = '1'
+        filter_set = MagicMock()
+        filter_set.objectSet = [self._make_update()]
+        update_set.filterSet = [filter_set]
+
+        def wait(version, options):
+            self.watcher.stop()
+            return update_set
+        fake_collector.WaitForUpdatesEx.side_effect = wait
+
+        self.watcher._watch()
+
+        self.assertTrue(self.cache.clear.called)
+        self.assertTrue(fake_logout.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``metrics.py`` module"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_ecs_api.lib import metrics
+
+
+def _sample(name, **labels):
+    """Read the current value of a metric, or zero if it's never been recorded"""
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(unittest.TestCase):
+    """A set of test cases for the ``metrics.py`` module"""
+
+    def test_timed(self):
+        """``timed`` records how long each call takes"""
+        @metrics.timed
+        def some_func(a, b=2):
+            return a + b
+        before = _sample('vlab_ecs_vcenter_call_seconds_count', function='some_func')
+
+        output = some_func(1, b=3)
+        after = _sample('vlab_ecs_vcenter_call_seconds_count', function='some_func')
+
+        self.assertEqual(output, 4)
+        self.assertEqual(after - before, 1)
+
+    def test_timed_errors(self):
+        """``timed`` counts the exceptions raised, by type"""
+        @metrics.timed
+        def broken_func():
+            raise ValueError('testing')
+        before = _sample('vlab_ecs_errors_total', where='broken_func', exception='ValueError')
+
+        with self.assertRaises(ValueError):
+            broken_func()
+        after = _sample('vlab_ecs_errors_total', where='broken_func', exception='ValueError')
+
+        self.assertEqual(after - before, 1)
+
+    def test_timed_name(self):
+        """``timed`` doesn't change the name (or docstring) of the function"""
+        @metrics.timed
+        def some_func():
+            """some docs"""
+
+        self.assertEqual(some_func.__name__, 'some_func')
+        self.assertEqual(some_func.__doc__, 'some docs')
+
+    def test_stamp_sent_at(self):
+        """Sending a task adds the time it was sent to the headers"""
+        headers = {}
+
+        metrics._stamp_sent_at(sender='ecs.show', headers=headers)
+
+        self.assertTrue(metrics.SENT_AT_HEADER in headers)
+
+    @patch.object(metrics.time, 'time')
+    def test_task_timing(self, fake_time):
+        """The duration of a task, and how long it was queued, are recorded"""
+        fake_time.return_value = 110
+        task = MagicMock()
+        task.name = 'ecs.timing_test'
+        setattr(task.request, metrics.SENT_AT_HEADER, 100)
+
+        metrics._task_started(task_id='task-1', task=task)
+        metrics._task_finished(task_id='task-1', task=task, retval={'error': None})
+
+        self.assertEqual(_sample('vlab_ecs_task_duration_seconds_count', task='ecs.timing_test'), 1)
+        self.assertEqual(_sample('vlab_ecs_task_queue_wait_seconds_sum', task='ecs.timing_test'), 10)
+
+    def test_task_error(self):
+        """A task that returns an error is counted"""
+        task = MagicMock()
+        task.name = 'ecs.error_test'
+
+        metrics._task_started(task_id='task-2', task=task)
+        metrics._task_finished(task_id='task-2', task=task, retval={'error': 'testing'})
+
+        self.assertEqual(_sample('vlab_ecs_errors_total', where='ecs.error_test', exception='TaskError'), 1)
+
+    def test_task_failure(self):
+        """An exception a task doesn't catch is counted by type"""
+        task = MagicMock()
+        task.name = 'ecs.failure_test'
+
+        metrics._task_failed(sender=task, exception=KeyError('testing'))
+
+        self.assertEqual(_sample('vlab_ecs_errors_total', where='ecs.failure_test', exception='KeyError'), 1)
+
+    @patch.object(metrics, 'start_http_server')
+    def test_start_worker_server(self, fake_start_http_server):
+        """``start_worker_server`` listens on the supplied port"""
+        with patch.dict(os.environ, {}, clear=False):
+            os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+            metrics.start_worker_server(9102)
+
+        the_args, the_kwargs = fake_start_http_server.call_args
+        self.assertEqual(the_args, (9102,))
+        self.assertTrue(the_kwargs['registry'] is metrics.REGISTRY)
+
+    @patch.object(metrics, 'start_http_server')
+    def test_start_worker_server_multiproc(self, fake_start_http_server):
+        """``start_worker_server`` removes the metrics of a previous run of a prefork worker"""
+        with tempfile.TemporaryDirectory() as multiproc_dir:
+            stale = os.path.join(multiproc_dir, 'histogram_123.db')
+            open(stale, 'w').close()
+            with patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': multiproc_dir}):
+                metrics.start_worker_server(9102)
+
+            self.assertFalse(os.path.exists(stale))
+
+
+if __name__ == '__main__':
+    unittest.main()
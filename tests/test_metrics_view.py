@@ -0,0 +1,33 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the metrics API end point
+"""
+import unittest
+
+from flask import Flask
+
+from vlab_ecs_api.lib.views import metrics
+
+
+class TestMetricsView(unittest.TestCase):
+    """A set of test cases for the MetricsView object"""
+
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        metrics.MetricsView.register(app)
+        app.config['TESTING'] = True
+        cls.app = app.test_client()
+
+    def test_metrics(self):
+        """GET on /metrics returns the metrics in the Prometheus text format"""
+        resp = self.app.get('/metrics')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers['Content-Type'].startswith('text/plain'))
+        self.assertTrue(b'vlab_ecs_tasks_sent_total' in resp.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
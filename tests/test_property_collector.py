@@ -0,0 +1,164 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``property_collector.py`` module"""
+import unittest
+from unittest.mock import MagicMock
+
+from vlab_ecs_api.lib.worker import property_collector
+
+
+class TestPropertyCollector(unittest.TestCase):
+    """A set of test cases for the ``property_collector.py`` module"""
+
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        cls.vcenter = MagicMock()
+        cls.fake_vm = MagicMock()
+        fake_prop = MagicMock()
+        fake_prop.name = 'runtime.powerState'
+        fake_prop.val = 'poweredOn'
+        fake_content = MagicMock()
+        fake_content.obj = cls.fake_vm
+        fake_content.propSet = [fake_prop]
+        cls.vcenter.content.propertyCollector.RetrieveContents.return_value = [fake_content]
+
+    def test_retrieve_children(self):
+        """``retrieve_children`` returns the object, and a dictionary of its properties"""
+        folder = property_collector.vim.Folder('group-v1')
+        output = property_collector.retrieve_children(self.vcenter, folder, ['runtime.powerState'])
+        expected = [(self.fake_vm, {'runtime.powerState': 'poweredOn'})]
+
+        self.assertEqual(output, expected)
+
+    def test_retrieve_children_one_call(self):
+        """``retrieve_children`` obtains every property in a single call to vCenter"""
+        folder = property_collector.vim.Folder('group-v1')
+        property_collector.retrieve_children(self.vcenter, folder, ['name', 'runtime.powerState'])
+
+        self.assertEqual(self.vcenter.content.propertyCollector.RetrieveContents.call_count, 1)
+
+    def test_retrieve(self):
+        """``retrieve`` returns a dictionary of the properties of one object"""
+        output = property_collector.retrieve(self.vcenter, property_collector.vim.VirtualMachine('vm-1'), ['runtime.powerState'])
+
+        self.assertEqual(output, {'runtime.powerState': 'poweredOn'})
+
+    def test_retrieve_many(self):
+        """``retrieve_many`` returns the properties of every object, from a single call"""
+        vms = [property_collector.vim.VirtualMachine('vm-1'), property_collector.vim.VirtualMachine('vm-2')]
+        output = property_collector.retrieve_many(self.vcenter, vms, ['runtime.powerState'])
+        filter_spec = self.vcenter.content.propertyCollector.RetrieveContents.call_args[0][0][0]
+
+        self.assertEqual(output, {self.fake_vm: {'runtime.powerState': 'poweredOn'}})
+        self.assertEqual(len(filter_spec.objectSet), 2)
+
+    def test_retrieve_many_none(self):
+        """``retrieve_many`` doesn't call vCenter when there are no objects"""
+        output = property_collector.retrieve_many(self.vcenter, [], ['runtime.powerState'])
+
+        self.assertEqual(output, {})
+        self.assertFalse(self.vcenter.content.propertyCollector.RetrieveContents.called)
+
+    def test_retrieve_by_type(self):
+        """``retrieve_by_type`` returns the object, and a dictionary of its properties"""
+        fake_view = MagicMock(spec=property_collector.vim.view.ContainerView('session-1'))
+        self.vcenter.content.viewManager.CreateContainerView.return_value = fake_view
+        output = property_collector.retrieve_by_type(self.vcenter, ['runtime.powerState'], property_collector.vim.VirtualMachine)
+        expected = [(self.fake_vm, {'runtime.powerState': 'poweredOn'})]
+
+        self.assertEqual(output, expected)
+
+    def test_retrieve_by_type_destroys_view(self):
+        """``retrieve_by_type`` cleans up the ContainerView it creates"""
+        fake_view = MagicMock(spec=property_collector.vim.view.ContainerView('session-1'))
+        self.vcenter.content.viewManager.CreateContainerView.return_value = fake_view
+        self.vcenter.content.propertyCollector.RetrieveContents.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            property_collector.retrieve_by_type(self.vcenter, ['name'], property_collector.vim.Network)
+
+        self.assertTrue(fake_view.DestroyView.called)
+
+
+class TestWaitFor(unittest.TestCase):
+    """A set of test cases for the ``wait_for`` function"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.vcenter = MagicMock()
+        self.collector = self.vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        self.the_vm = property_collector.vim.VirtualMachine('vm-1')
+
+    def _make_update(self, value, obj=None, name='guest.net'):
+        change = MagicMock()
+        change.name = name
+        change.val = value
+        object_update = MagicMock()
+        object_update.obj = obj or self.the_vm
+        object_update.changeSet = [change]
+        filter_set = MagicMock()
+        filter_set.objectSet = [object_update]
+        update = MagicMock()
+        update.filterSet = [filter_set]
+        return update
+
+    def test_wait_for(self):
+        """``wait_for`` returns the properties once they satisfy the condition"""
+        self.collector.WaitForUpdatesEx.side_effect = [self._make_update([]), None, self._make_update(['192.168.1.2'])]
+
+        output = property_collector.wait_for(self.vcenter, self.the_vm, ['guest.net'], lambda x: x['guest.net'], 10)
+
+        self.assertEqual(output, {'guest.net': ['192.168.1.2']})
+        self.assertEqual(self.collector.WaitForUpdatesEx.call_count, 3)
+
+    def test_wait_for_timeout(self):
+        """``wait_for`` raises RuntimeError if the condition isn't met in time"""
+        with self.assertRaises(RuntimeError):
+            property_collector.wait_for(self.vcenter, self.the_vm, ['guest.net'], lambda x: True, 0)
+
+    def test_wait_for_cleanup(self):
+        """``wait_for`` destroys the PropertyCollector it creates"""
+        self.collector.WaitForUpdatesEx.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            property_collector.wait_for(self.vcenter, self.the_vm, ['guest.net'], lambda x: True, 10)
+
+        self.assertTrue(self.collector.DestroyPropertyCollector.called)
+
+    def test_wait_for_many(self):
+        """``wait_for_many`` waits until every object satisfies the condition"""
+        other_vm = property_collector.vim.VirtualMachine('vm-2')
+        self.collector.WaitForUpdatesEx.side_effect = [self._make_update(['192.168.1.2']),
+                                                       self._make_update(['192.168.1.3'], obj=other_vm)]
+
+        output = property_collector.wait_for_many(self.vcenter, [self.the_vm, other_vm], ['guest.net'],
+                                                  lambda x: x.get('guest.net'), 10)
+        expected = {self.the_vm: {'guest.net': ['192.168.1.2']}, other_vm: {'guest.net': ['192.168.1.3']}}
+
+        self.assertEqual(output, expected)
+        self.assertEqual(self.vcenter.content.propertyCollector.CreatePropertyCollector.call_count, 1)
+
+    def test_wait_for_many_timeout(self):
+        """``wait_for_many`` names the objects it gave up on"""
+        with self.assertRaises(RuntimeError) as cm:
+            property_collector.wait_for_many(self.vcenter, [self.the_vm], ['guest.net'], lambda x: True, 0)
+
+        self.assertTrue('vm-1' in str(cm.exception))
+
+    def test_wait_for_tasks(self):
+        """``wait_for_tasks`` returns once every task has succeeded or failed"""
+        task1 = property_collector.vim.Task('task-1')
+        task2 = property_collector.vim.Task('task-2')
+        self.collector.WaitForUpdatesEx.side_effect = [self._make_update('running', obj=task1, name='info.state'),
+                                                       self._make_update('success', obj=task1, name='info.state'),
+                                                       self._make_update('error', obj=task2, name='info.state')]
+
+        output = property_collector.wait_for_tasks(self.vcenter, [task1, task2], 10)
+
+        self.assertEqual(output[task1]['info.state'], 'success')
+        self.assertEqual(output[task2]['info.state'], 'error')
+        self.assertEqual(self.collector.WaitForUpdatesEx.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,102 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit tests for the ``remote_shell.py`` module"""
+import time
+import socket
 import unittest
+import threading
+import collections
 from unittest.mock import patch, MagicMock
 
 from vlab_ecs_api.lib.worker import remote_shell
 
 
+class FakeChannel:
+    """Mimics how a paramiko Channel signals its pipe: set while there's buffered
+    output (or once the channel is closed), and cleared once the output is read.
+
+    :param stdout: The chunks of output the "remote command" writes, in order
+    :type stdout: List
+
+    :param stderr: The chunks of error output the "remote command" writes
+    :type stderr: List
+
+    :param delay: How many seconds to wait between writing each chunk
+    :type delay: Float
+
+    :param exit_code: The exit status of the "remote command"
+    :type exit_code: Integer
+    """
+    def __init__(self, stdout=(), stderr=(), delay=0, exit_code=0):
+        self._reader, self._writer = socket.socketpair()
+        self._lock = threading.Lock()
+        self._buffers = {'stdout': collections.deque(), 'stderr': collections.deque()}
+        self._signaled = False
+        self._exit_code = None
+        self.closed = False
+        self.exit_status_checks = 0
+        script = [('stdout', x) for x in stdout] + [('stderr', x) for x in stderr]
+        self._runner = threading.Thread(target=self._run, args=(script, delay, exit_code))
+        self._runner.start()
+
+    def _run(self, script, delay, exit_code):
+        for name, chunk in script:
+            time.sleep(delay)
+            with self._lock:
+                self._buffers[name].append(chunk)
+                self._signal()
+        time.sleep(delay)
+        with self._lock:
+            self._exit_code = exit_code
+        time.sleep(delay)
+        with self._lock:
+            self.closed = True
+            self._signal()
+
+    def _signal(self):
+        if not self._signaled:
+            self._writer.send(b'x')
+            self._signaled = True
+
+    def _read(self, name):
+        with self._lock:
+            data = self._buffers[name].popleft()
+            if not (self.closed or self._buffers['stdout'] or self._buffers['stderr']):
+                self._reader.recv(1)
+                self._signaled = False
+        return data
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def recv_ready(self):
+        with self._lock:
+            return bool(self._buffers['stdout'])
+
+    def recv_stderr_ready(self):
+        with self._lock:
+            return bool(self._buffers['stderr'])
+
+    def recv(self, size):
+        return self._read('stdout')
+
+    def recv_stderr(self, size):
+        return self._read('stderr')
+
+    def exit_status_ready(self):
+        self.exit_status_checks += 1
+        with self._lock:
+            return self._exit_code is not None
+
+    def recv_exit_status(self):
+        self._runner.join()
+        return self._exit_code
+
+    def close(self):
+        self._runner.join()
+        self._reader.close()
+        self._writer.close()
+
+
 class TestSSHClient(unittest.TestCase):
     """"A suite of test cases for the ``SSHClient`` class"""
     def _config_patching(self, fake_SSHClient):
@@ -75,29 +166,158 @@ class TestSSHClient(unittest.TestCase):
 
     def test_block_on_command(self):
         """``SSHClient`` - the '_block_on_command' method blocks until an exit code is ready"""
-        fake_channel = MagicMock()
-        fake_channel.exit_status_ready.return_value = True
-        fake_channel.recv.return_value = b'some output'
-        fake_channel.recv_stderr.return_value = b'some stderr output'
-        fake_channel.recv_exit_status.return_value = 0
-
-        remote_shell.SSHClient._block_on_command(fake_channel)
+        fake_channel = FakeChannel(stdout=[b'some output'], delay=0.01, exit_code=3)
 
-        self.assertTrue(fake_channel.exit_status_ready.called)
+        output = remote_shell.SSHClient._block_on_command(fake_channel)
+        fake_channel.close()
 
+        self.assertEqual(output[2], 3)
 
     def test_block_on_command_reads(self):
         """``SSHClient`` - the '_block_on_command' method reads the stderr and stdout buffers while the command runs"""
-        fake_channel = MagicMock()
-        fake_channel.exit_status_ready.return_value = True
-        fake_channel.recv.return_value = b'some output'
-        fake_channel.recv_stderr.return_value = b'some stderr output'
-        fake_channel.recv_exit_status.return_value = 0
+        fake_channel = FakeChannel(stdout=[b'some ', b'output'], stderr=[b'some stderr output'], delay=0.01)
+
+        output = remote_shell.SSHClient._block_on_command(fake_channel)
+        fake_channel.close()
+        expected = ('some output', 'some stderr output', 0)
+
+        self.assertEqual(output, expected)
+
+    def test_block_on_command_large_output(self):
+        """``SSHClient`` - the '_block_on_command' method collects every chunk of a large output"""
+        chunks = [bytes([65 + (x % 26)]) * 1024 for x in range(2000)]
+        fake_channel = FakeChannel(stdout=chunks)
+
+        stdout, _, _ = remote_shell.SSHClient._block_on_command(fake_channel)
+        fake_channel.close()
 
+        self.assertEqual(stdout, b''.join(chunks).decode())
+
+    def test_block_on_command_cpu(self):
+        """``SSHClient`` - the '_block_on_command' method sleeps instead of spinning while waiting on output"""
+        fake_channel = FakeChannel(stdout=[b'a', b'b', b'c', b'd', b'e'], delay=0.1)
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
         remote_shell.SSHClient._block_on_command(fake_channel)
+        cpu_used = time.process_time() - cpu_start
+        wall_time = time.perf_counter() - wall_start
+        fake_channel.close()
+
+        # A busy-wait would burn CPU for (nearly) the whole run
+        self.assertTrue(wall_time > 0.5)
+        self.assertTrue(cpu_used < wall_time * 0.2)
+        self.assertTrue(fake_channel.exit_status_checks < 50)
+
+    def test_block_on_command_closed(self):
+        """``SSHClient`` - the '_block_on_command' method returns if the channel closes without an exit status"""
+        fake_channel = FakeChannel(stdout=[b'some output'], exit_code=-1)
+        fake_channel.exit_status_ready = lambda: False
+
+        output = remote_shell.SSHClient._block_on_command(fake_channel, poll_interval=5)
+        fake_channel.close()
+
+        self.assertEqual(output[0], 'some output')
+
+    @patch.object(remote_shell.SSHClient, '_stream_command')
+    @patch.object(remote_shell.paramiko.client, 'SSHClient')
+    def test_stream_command(self, fake_SSHClient, fake_stream_command):
+        """``SSHClient`` - the 'stream_command' method returns a Tuple of stdout, stderr, and the exit code"""
+        self._config_patching(fake_SSHClient)
+        fake_stream_command.return_value = ('stdout', 'stderr', 0)
+        ssh = remote_shell.SSHClient(hostname='some.server.io',
+                                     port=22,
+                                     username='pat',
+                                     password='iLoveKats!')
+
+        output = ssh.stream_command('/some/shell/command', callback=MagicMock())
+        expected = ('stdout', 'stderr', 0)
+
+        self.assertEqual(output, expected)
+
+    def test_stream_command_lines(self):
+        """``SSHClient`` - the '_stream_command' method calls back with every line of output"""
+        fake_channel = FakeChannel(stdout=[b'line one\r\nline ', b'two\r', b'\nline three'],
+                                   stderr=[b'oops\n'])
+        callback = MagicMock()
+
+        remote_shell.SSHClient._stream_command(fake_channel, callback)
+        fake_channel.close()
+        # stdout and stderr are read as they arrive, so they can interleave
+        lines = sorted(x[0][0] for x in callback.call_args_list)
+        expected = ['line one', 'line three', 'line two', 'oops']
+
+        self.assertEqual(lines, expected)
+
+    def test_stream_command_tail(self):
+        """``SSHClient`` - the '_stream_command' method only returns the end of the output"""
+        chunks = [b'x' * 1000 for _ in range(100)] + [b'the end']
+        fake_channel = FakeChannel(stdout=chunks, exit_code=2)
+
+        stdout, stderr, exit_code = remote_shell.SSHClient._stream_command(fake_channel, MagicMock(), tail_size=100)
+        fake_channel.close()
+
+        self.assertEqual(len(stdout), 100)
+        self.assertTrue(stdout.endswith('the end'))
+        self.assertEqual(stderr, '')
+        self.assertEqual(exit_code, 2)
+
+
+class TestTailBuffer(unittest.TestCase):
+    """A set of test cases for the ``TailBuffer`` object"""
+
+    def test_tail(self):
+        """``TailBuffer`` - keeps only the most recent bytes"""
+        tail = remote_shell.TailBuffer(5)
+        tail.write(b'abc')
+        tail.write(b'defg')
+
+        self.assertEqual(tail.getvalue(), 'cdefg')
+
+    def test_big_write(self):
+        """``TailBuffer`` - a single write bigger than the buffer keeps its end"""
+        tail = remote_shell.TailBuffer(3)
+        tail.write(b'abcdefg')
+
+        self.assertEqual(tail.getvalue(), 'efg')
+
+
+class TestLineSplitter(unittest.TestCase):
+    """A set of test cases for the ``LineSplitter`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.lines = []
+        self.splitter = remote_shell.LineSplitter(self.lines.append, max_line=10)
+
+    def test_split_character(self):
+        """``LineSplitter`` - a multi-byte character split across chunks is decoded"""
+        data = 'caf\u00e9\n'.encode()
+        self.splitter.feed(data[:4])
+        self.splitter.feed(data[4:])
+
+        self.assertEqual(self.lines, ['caf\u00e9'])
+
+    def test_carriage_return(self):
+        """``LineSplitter`` - a bare carriage return (i.e. progress bar) ends a line"""
+        self.splitter.feed(b'10%\r20%\r')
+        self.splitter.flush()
+
+        self.assertEqual(self.lines, ['10%', '20%'])
+
+    def test_long_line(self):
+        """``LineSplitter`` - a line without a line break doesn't grow past 'max_line'"""
+        self.splitter.feed(b'a' * 25)
+
+        self.assertEqual(self.lines, ['a' * 10, 'a' * 10])
+        self.assertEqual(self.splitter._partial, 'a' * 5)
+
+    def test_flush(self):
+        """``LineSplitter`` - the 'flush' method calls back with the last, unterminated line"""
+        self.splitter.feed(b'done')
+        self.splitter.flush()
 
-        self.assertTrue(fake_channel.recv.called)
-        self.assertTrue(fake_channel.recv_stderr.called)
+        self.assertEqual(self.lines, ['done'])
 
 
 if __name__ == '__main__':
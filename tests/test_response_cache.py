@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``response_cache.py`` module"""
+import unittest
+from unittest.mock import patch
+
+from vlab_ecs_api.lib import shared_store
+from vlab_ecs_api.lib.views import response_cache
+
+
+class TestResponseCache(unittest.TestCase):
+    """A set of test cases for the ``ResponseCache`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.generations = shared_store.Generations('memory://')
+        self.cache = response_cache.ResponseCache(ttl=10, max_stale=60, generations=self.generations)
+
+    def test_lookup_miss(self):
+        """``ResponseCache`` - 'lookup' returns None when nothing is cached"""
+        self.assertEqual(self.cache.lookup(('ecs.show', 'bob')), None)
+
+    def test_complete(self):
+        """``ResponseCache`` - the result of an expected task is cached"""
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        etag = self.cache.complete('task-1', {'myEcs': {}})
+
+        entry = self.cache.lookup(('ecs.show', 'bob'))
+
+        self.assertEqual(entry, response_cache.Entry({'myEcs': {}}, etag, True))
+
+    def test_complete_unexpected(self):
+        """``ResponseCache`` - the result of a task that wasn't sent for a read isn't cached"""
+        output = self.cache.complete('task-1', {'myEcs': {}})
+
+        self.assertEqual(output, None)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    @patch.object(response_cache.time, 'time')
+    def test_stale(self, fake_time):
+        """``ResponseCache`` - a result older than the TTL isn't fresh"""
+        fake_time.return_value = 100
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        self.cache.complete('task-1', {})
+        fake_time.return_value = 120
+
+        entry = self.cache.lookup(('ecs.show', 'bob'))
+
+        self.assertFalse(entry.fresh)
+
+    @patch.object(response_cache.time, 'time')
+    def test_too_old(self, fake_time):
+        """``ResponseCache`` - a result older than 'max_stale' isn't returned"""
+        fake_time.return_value = 100
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        self.cache.complete('task-1', {})
+        fake_time.return_value = 200
+
+        self.assertEqual(self.cache.lookup(('ecs.show', 'bob')), None)
+
+    @patch.object(response_cache.time, 'time')
+    def test_expect_prunes(self, fake_time):
+        """``ResponseCache`` - a task whose result nobody fetched is eventually forgotten"""
+        fake_time.return_value = 100
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        fake_time.return_value = 200
+        self.cache.expect(('ecs.show', 'alice'), 'task-2')
+
+        self.assertEqual(self.cache.complete('task-1', {}), None)
+
+    def test_invalidate(self):
+        """``ResponseCache`` - 'invalidate' forgets the result, and the refresh that's running"""
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        self.cache.complete('task-1', {})
+        self.cache.expect(('ecs.show', 'bob'), 'task-2')
+
+        self.cache.invalidate(('ecs.show', 'bob'))
+
+        self.assertEqual(self.cache.lookup(('ecs.show', 'bob')), None)
+        self.assertEqual(self.cache.complete('task-2', {}), None)
+
+    def test_invalidate_other_process(self):
+        """``ResponseCache`` - 'invalidate' in one API process stops another from serving its result"""
+        other = response_cache.ResponseCache(ttl=10, max_stale=60, generations=self.generations)
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        self.cache.complete('task-1', {})
+
+        other.invalidate(('ecs.show', 'bob'))
+
+        self.assertEqual(self.cache.lookup(('ecs.show', 'bob')), None)
+
+    def test_worker_changed(self):
+        """``ResponseCache`` - a user's ``ecs.show`` isn't served after a worker changes their inventory"""
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        self.cache.complete('task-1', {})
+
+        self.generations.bump('inventory:bob')
+
+        self.assertEqual(self.cache.lookup(('ecs.show', 'bob')), None)
+
+    def test_complete_changed(self):
+        """``ResponseCache`` - the result of a refresh that ran while something changed isn't cached"""
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        self.generations.bump('inventory:bob')
+
+        self.assertEqual(self.cache.complete('task-1', {}), None)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_generation_unknown(self):
+        """``ResponseCache`` - nothing is served, or cached, while the generation cannot be read"""
+        self.cache.expect(('ecs.show', 'bob'), 'task-1')
+        self.cache.complete('task-1', {})
+        with patch.object(self.generations, 'get', return_value=None):
+            self.assertEqual(self.cache.lookup(('ecs.show', 'bob')), None)
+            self.cache.expect(('ecs.show', 'bob'), 'task-2')
+
+        self.assertEqual(self.cache.complete('task-2', {}), None)
+
+    def test_generation_name(self):
+        """``generation_name`` gives ``ecs.show`` the generation of the user's inventory"""
+        names = [response_cache.generation_name(('ecs.show', 'bob')),
+                 response_cache.generation_name(('ecs.image',))]
+
+        self.assertEqual(names, ['inventory:bob', 'response:ecs.image'])
+
+    def test_make_etag(self):
+        """``make_etag`` is the same for equal content, regardless of key order"""
+        etag1 = response_cache.make_etag({'a': 1, 'b': 2})
+        etag2 = response_cache.make_etag({'b': 2, 'a': 1})
+
+        self.assertEqual(etag1, etag2)
+        self.assertNotEqual(etag1, response_cache.make_etag({'a': 1}))
+
+
+if __name__ == '__main__':
+    unittest.main()
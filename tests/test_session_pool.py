@@ -0,0 +1,201 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``session_pool.py`` module"""
+import time
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_ecs_api.lib.worker import session_pool
+
+
+class TestSessionPool(unittest.TestCase):
+    """A set of test cases for the ``SessionPool`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.factory = MagicMock()
+        self.factory.side_effect = lambda: MagicMock()
+        self.pool = session_pool.SessionPool(factory=self.factory,
+                                             max_size=2,
+                                             idle_timeout=600,
+                                             check_interval=60)
+
+    def test_session(self):
+        """``SessionPool`` - the 'session' method yields a logged in vCenter session"""
+        with self.pool.session() as vcenter:
+            pass
+
+        self.assertEqual(self.factory.call_count, 1)
+
+    def test_session_reused(self):
+        """``SessionPool`` - sessions are reused instead of logging in again"""
+        with self.pool.session() as first:
+            pass
+        with self.pool.session() as second:
+            pass
+
+        self.assertTrue(first is second)
+        self.assertEqual(self.factory.call_count, 1)
+
+    def test_session_network_cache(self):
+        """``SessionPool`` - a reused session does not return a stale list of networks"""
+        with self.pool.session() as vcenter:
+            vcenter._net_cache = {'someLAN': MagicMock()}
+        with self.pool.session() as vcenter:
+            pass
+
+        self.assertTrue(vcenter._net_cache is None)
+
+    def test_session_not_logged_out(self):
+        """``SessionPool`` - returning a session to the pool does not log it out"""
+        with self.pool.session() as vcenter:
+            pass
+
+        self.assertFalse(vcenter.close.called)
+
+    def test_stats(self):
+        """``SessionPool`` - the 'stats' method reports hits and logins"""
+        with self.pool.session():
+            pass
+        with self.pool.session():
+            pass
+
+        stats = self.pool.stats()
+
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['logins'], 1)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_concurrent_sessions(self):
+        """``SessionPool`` - a session in use is not handed out twice"""
+        with self.pool.session() as first:
+            with self.pool.session() as second:
+                pass
+
+        self.assertFalse(first is second)
+
+    def test_idle_expiry(self):
+        """``SessionPool`` - sessions idle longer than 'idle_timeout' are logged out"""
+        self.pool._idle_timeout = 0
+        with self.pool.session() as first:
+            pass
+        time.sleep(0.01)
+        with self.pool.session() as second:
+            pass
+
+        self.assertTrue(first.close.called)
+        self.assertFalse(first is second)
+        self.assertEqual(self.pool.stats()['expired'], 1)
+
+    def test_relogin(self):
+        """``SessionPool`` - a timed out session is transparently replaced"""
+        self.pool._check_interval = 0
+        with self.pool.session() as first:
+            pass
+        first.content.sessionManager.currentSession = None
+        time.sleep(0.01)
+        with self.pool.session() as second:
+            pass
+
+        self.assertFalse(first is second)
+        self.assertEqual(self.pool.stats()['relogins'], 1)
+
+    def test_health_check(self):
+        """``SessionPool`` - a session that's still logged in is kept after the health check"""
+        self.pool._check_interval = 0
+        with self.pool.session() as first:
+            pass
+        time.sleep(0.01)
+        with self.pool.session() as second:
+            pass
+
+        self.assertTrue(first is second)
+        self.assertEqual(self.pool.stats()['relogins'], 0)
+
+    def test_not_authenticated(self):
+        """``SessionPool`` - a session that raises NotAuthenticated is discarded"""
+        with self.assertRaises(session_pool.vim.fault.NotAuthenticated):
+            with self.pool.session() as vcenter:
+                raise session_pool.vim.fault.NotAuthenticated()
+
+        self.assertTrue(vcenter.close.called)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_error_forces_check(self):
+        """``SessionPool`` - an error while using a session forces a health check on the next use"""
+        with self.assertRaises(RuntimeError):
+            with self.pool.session() as vcenter:
+                raise RuntimeError('testing')
+
+        self.assertEqual(self.pool._idle[0][2], 0)
+
+    def test_login_failure(self):
+        """``SessionPool`` - a failed login does not leak a slot in the pool"""
+        self.factory.side_effect = RuntimeError('testing')
+        with self.assertRaises(RuntimeError):
+            with self.pool.session():
+                pass
+
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_wait(self):
+        """``SessionPool`` - blocks until a session is returned when the pool is exhausted"""
+        self.pool._max_size = 1
+        got = []
+
+        def borrow():
+            with self.pool.session() as vcenter:
+                got.append(vcenter)
+
+        with self.pool.session() as first:
+            waiter = threading.Thread(target=borrow)
+            waiter.start()
+            time.sleep(0.05)
+            self.assertEqual(got, [])
+        waiter.join(timeout=5)
+
+        self.assertTrue(got[0] is first)
+        self.assertEqual(self.pool.stats()['waits'], 1)
+        self.assertTrue(self.pool.stats()['wait_time'] > 0)
+
+    @patch.object(session_pool.os, 'getpid')
+    def test_fork(self, fake_getpid):
+        """``SessionPool`` - sessions opened by a parent process are not used in a forked child"""
+        fake_getpid.return_value = 1
+        self.pool._pid = 1
+        with self.pool.session() as parent:
+            pass
+        fake_getpid.return_value = 2
+        with self.pool.session() as child:
+            pass
+
+        self.assertFalse(parent is child)
+        self.assertFalse(parent.close.called)
+
+    def test_close(self):
+        """``SessionPool`` - the 'close' method logs out idle sessions"""
+        with self.pool.session() as vcenter:
+            pass
+        self.pool.close()
+
+        self.assertTrue(vcenter.close.called)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+
+class TestVcenterSession(unittest.TestCase):
+    """A set of test cases for the ``vcenter_session`` function"""
+
+    @patch.object(session_pool, 'vCenter')
+    def test_vcenter_session(self, fake_vCenter):
+        """``vcenter_session`` borrows a session from the process-wide pool"""
+        session_pool.POOL._reset()
+        with session_pool.vcenter_session() as vcenter:
+            pass
+        session_pool.POOL._reset()
+
+        self.assertTrue(vcenter is fake_vCenter.return_value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,31 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit tests for the ``setup_ecs.py`` module"""
+import os
+import shutil
+import tempfile
 import unittest
+import subprocess
 from unittest.mock import patch, MagicMock
 
 from vlab_ecs_api.lib.worker import setup_ecs
 
+# The parts of deploy.yml that ``update_config`` edits
+DEPLOY_YML = """licensing:
+  license_accepted: false
+facts:
+  install_node: 192.168.2.200
+  dns_servers:
+    - 192.168.2.2
+  ntp_servers:
+    - 192.168.2.2
+  storage_pools:
+    - members:
+        - 192.168.2.200
+      options:
+        ecs_block_devices:
+          - /dev/vda
+"""
+
 
 class TestSetupECS(unittest.TestCase):
     """A set of test cases for the ``setup_ecs.py`` module"""
@@ -15,145 +36,261 @@ class TestSetupECS(unittest.TestCase):
         cls.logger = MagicMock()
         cls.ssh_client = MagicMock()
         cls.ssh_client.exec_command.return_value = ('stdout', 'stderr', 0)
+        cls.ssh_client.stream_command.return_value = ('stdout', 'stderr', 0)
 
     @patch.object(setup_ecs, 'SSHClient')
-    @patch.object(setup_ecs, '_accept_license')
-    @patch.object(setup_ecs, '_update_ip')
-    @patch.object(setup_ecs, '_update_disk')
-    @patch.object(setup_ecs, '_update_dns_and_ntp')
+    @patch.object(setup_ecs, '_edit_config')
     @patch.object(setup_ecs, '_run_update_deploy')
     @patch.object(setup_ecs, '_run_step1')
     @patch.object(setup_ecs, '_run_step2')
     def test_configure(self, fake_run_step2, fake_run_step1, fake_run_update_deploy,
-                       fake_update_dns_and_ntp, fake_update_disk, fake_update_ip,
-                       fake_accept_license, fake_SSHClient):
+                       fake_edit_config, fake_SSHClient):
         """``configure`` is a simple wrapper to configure *all the things* for ECS"""
         setup_ecs.configure(ssh_port=50022,
                             gateway_ip='10.1.1.1',
                             ecs_ip='192.168.1.56',
                             logger=self.logger)
 
-        self.assertTrue(fake_accept_license.called)
-        self.assertTrue(fake_update_ip.called)
-        self.assertTrue(fake_update_disk.called)
-        self.assertTrue(fake_update_dns_and_ntp.called)
+        self.assertTrue(fake_edit_config.called)
         self.assertTrue(fake_run_update_deploy.called)
         self.assertTrue(fake_run_step1.called)
         self.assertTrue(fake_run_step2.called)
 
-    def test_accept_license(self):
-        """``_accept_license`` runs the expected command"""
-        config_file = '/some/path/deploy.yml'
-        setup_ecs._accept_license(self.ssh_client, config_file, self.logger)
+    @patch.object(setup_ecs, 'SSHClient')
+    @patch.object(setup_ecs, '_edit_config')
+    @patch.object(setup_ecs, '_run_update_deploy')
+    @patch.object(setup_ecs, '_run_step1')
+    @patch.object(setup_ecs, '_run_step2')
+    def test_configure_metrics(self, fake_run_step2, fake_run_step1, fake_run_update_deploy,
+                               fake_edit_config, fake_SSHClient):
+        """``configure`` records how long each stage takes"""
+        def count(stage):
+            return setup_ecs.metrics.REGISTRY.get_sample_value('vlab_ecs_ssh_stage_seconds_count', {'stage': stage}) or 0
+        before = [count(x) for x in setup_ecs.STAGES]
 
-        the_args, _  = self.ssh_client.exec_command.call_args
-        cli_cmd = the_args[0]
-        expected = "/usr/bin/sed  -i -e 's/license_accepted: false/license_accepted: true/g' /some/path/deploy.yml"
+        setup_ecs.configure(ssh_port=50022,
+                            gateway_ip='10.1.1.1',
+                            ecs_ip='192.168.1.56',
+                            logger=self.logger)
+        after = [count(x) for x in setup_ecs.STAGES]
 
-        self.assertEqual(expected, cli_cmd)
+        self.assertEqual([y - x for x, y in zip(before, after)], [1, 1, 1, 1])
 
-    def test_accept_license_error(self):
-        """``_accept_license`` raises RuntimeError if the command has a non-zero exit code"""
-        self.ssh_client.exec_command.return_value = ('stdout', 'stderr', 1)
-        config_file = '/some/path/deploy.yml'
-        with self.assertRaises(RuntimeError):
-            setup_ecs._accept_license(self.ssh_client, config_file, self.logger)
+    @patch.object(setup_ecs, 'SSHClient')
+    @patch.object(setup_ecs, '_edit_config')
+    @patch.object(setup_ecs, '_run_update_deploy')
+    @patch.object(setup_ecs, '_run_step1')
+    @patch.object(setup_ecs, '_run_step2')
+    def test_configure_resumes(self, fake_run_step2, fake_run_step1, fake_run_update_deploy,
+                               fake_edit_config, fake_SSHClient):
+        """``configure`` skips the stages a previous attempt completed"""
+        setup_ecs.configure(ssh_port=50022,
+                            gateway_ip='10.1.1.1',
+                            ecs_ip='192.168.1.56',
+                            logger=self.logger,
+                            completed=['update_config', 'update_deploy'])
 
-    def test_update_ip(self):
-        """``_update_ip`` runs the expected command"""
-        config_file = '/some/path/deploy.yml'
-        ecs_ip = '192.168.1.56'
-        setup_ecs._update_ip(self.ssh_client, ecs_ip, config_file, self.logger)
+        self.assertFalse(fake_edit_config.called)
+        self.assertFalse(fake_run_update_deploy.called)
+        self.assertTrue(fake_run_step1.called)
+        self.assertTrue(fake_run_step2.called)
 
-        the_args, _  = self.ssh_client.exec_command.call_args
-        cli_cmd = the_args[0]
-        expected = "/usr/bin/sed  -i -e 's/192.168.2.200/192.168.1.56/g' /some/path/deploy.yml"
+    @patch.object(setup_ecs, 'SSHClient')
+    @patch.object(setup_ecs, '_edit_config')
+    @patch.object(setup_ecs, '_run_update_deploy')
+    @patch.object(setup_ecs, '_run_step1')
+    @patch.object(setup_ecs, '_run_step2')
+    def test_configure_checkpoint(self, fake_run_step2, fake_run_step1, fake_run_update_deploy,
+                                  fake_edit_config, fake_SSHClient):
+        """``configure`` calls the checkpoint function after each stage, in order"""
+        checkpoint = MagicMock()
+        setup_ecs.configure(ssh_port=50022,
+                            gateway_ip='10.1.1.1',
+                            ecs_ip='192.168.1.56',
+                            logger=self.logger,
+                            checkpoint=checkpoint)
+        stages = [x[0][0] for x in checkpoint.call_args_list]
 
-        self.assertEqual(expected, cli_cmd)
+        self.assertEqual(stages, list(setup_ecs.STAGES))
 
-    def test_update_ip_error(self):
-        """``_update_ip`` raises RuntimeError if the command has a non-zero exit code"""
-        self.ssh_client.exec_command.return_value = ('stdout', 'stderr', 1)
-        config_file = '/some/path/deploy.yml'
-        ecs_ip = '192.168.1.56'
+    @patch.object(setup_ecs, 'SSHClient')
+    @patch.object(setup_ecs, '_edit_config')
+    @patch.object(setup_ecs, '_run_update_deploy')
+    @patch.object(setup_ecs, '_run_step1')
+    @patch.object(setup_ecs, '_run_step2')
+    def test_configure_checkpoint_failure(self, fake_run_step2, fake_run_step1, fake_run_update_deploy,
+                                          fake_edit_config, fake_SSHClient):
+        """``configure`` does not checkpoint a stage that fails"""
+        fake_run_step1.side_effect = RuntimeError('testing')
+        checkpoint = MagicMock()
         with self.assertRaises(RuntimeError):
-            setup_ecs._update_ip(self.ssh_client, ecs_ip, config_file, self.logger)
+            setup_ecs.configure(ssh_port=50022,
+                                gateway_ip='10.1.1.1',
+                                ecs_ip='192.168.1.56',
+                                logger=self.logger,
+                                checkpoint=checkpoint)
+        stages = [x[0][0] for x in checkpoint.call_args_list]
 
-    def test_update_disk(self):
-        """``_update_disk`` runs the expected command"""
-        config_file = '/some/path/deploy.yml'
-        setup_ecs._update_disk(self.ssh_client, config_file, self.logger)
+        self.assertEqual(stages, ['update_config', 'update_deploy'])
 
-        the_args, _  = self.ssh_client.exec_command.call_args
-        cli_cmd = the_args[0]
-        expected = "/usr/bin/sed  -i -e 's/\\/dev\\/vda/\\/dev\\/sdb/g' /some/path/deploy.yml"
+    @patch.object(setup_ecs, 'SSHClient')
+    def test_configure_nothing_to_do(self, fake_SSHClient):
+        """``configure`` doesn't connect to the VM if every stage is already done"""
+        setup_ecs.configure(ssh_port=50022,
+                            gateway_ip='10.1.1.1',
+                            ecs_ip='192.168.1.56',
+                            logger=self.logger,
+                            completed=list(setup_ecs.STAGES))
 
-        self.assertEqual(expected, cli_cmd)
+        self.assertFalse(fake_SSHClient.called)
 
-    def test_update_disk_error(self):
-        """``_update_disk`` raises RuntimeError if the command has a non-zero exit code"""
-        self.ssh_client.exec_command.return_value = ('stdout', 'stderr', 1)
-        config_file = '/some/path/deploy.yml'
-        with self.assertRaises(RuntimeError):
-            setup_ecs._update_disk(self.ssh_client, config_file, self.logger)
+    def test_stages(self):
+        """``_stages`` has a stage for every name in STAGES, in the same order"""
+        names = tuple(x.name for x in setup_ecs._stages('192.168.1.56'))
+
+        self.assertEqual(names, setup_ecs.STAGES)
+
+    def test_edit_config(self):
+        """``_edit_config`` makes every edit with a single remote command"""
+        edits = setup_ecs._config_edits('192.168.1.56')
+        setup_ecs._edit_config(self.ssh_client, edits, '/some/path/deploy.yml', self.logger)
 
-    def test_update_dns_and_ntp(self):
-        """``_update_dns_and_ntp`` runs the expected command"""
-        config_file = '/some/path/deploy.yml'
-        setup_ecs._update_dns_and_ntp(self.ssh_client, config_file, self.logger)
+        self.assertEqual(self.ssh_client.exec_command.call_count, 1)
+
+    def test_edit_config_command(self):
+        """``_edit_config`` runs one sed with an expression per edit"""
+        edits = [setup_ecs.ConfigEdit('change a thing', 'old.value', '/new/value')]
+        setup_ecs._edit_config(self.ssh_client, edits, '/some/path/deploy.yml', self.logger)
 
         the_args, _  = self.ssh_client.exec_command.call_args
         cli_cmd = the_args[0]
-        expected = "/usr/bin/sed  -i -e 's/192.168.2.2/192.168.1.1/g' /some/path/deploy.yml"
-        self.assertEqual(expected, cli_cmd)
+        expected = "/usr/bin/sed -i -e 's/\\bold\\.value\\b/\\/new\\/value/g' /some/path/deploy.yml && "
+
+        self.assertTrue(cli_cmd.startswith(expected))
+
+    def test_config_edits(self):
+        """``_config_edits`` sets the ECS IP supplied"""
+        edits = setup_ecs._config_edits('192.168.1.56')
+        new_values = [x.new for x in edits]
+
+        self.assertTrue('192.168.1.56' in new_values)
+
+    def _run_edits(self, *edit_lists):
+        """Make each list of edits to a sample deploy.yml, running the command locally instead of via SSH"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        config_file = os.path.join(tmp_dir, 'deploy.yml')
+        with open(config_file, 'w') as the_file:
+            the_file.write(DEPLOY_YML)
+        def exec_command(command):
+            proc = subprocess.run(['/bin/bash', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return proc.stdout.decode(), proc.stderr.decode(), proc.returncode
+        self.ssh_client.exec_command.side_effect = exec_command
+        for edits in edit_lists:
+            setup_ecs._edit_config(self.ssh_client, edits, config_file, self.logger)
+        return config_file
 
-    def test_update_dns_and_ntp_error(self):
-        """``_update_dns_and_ntp`` raises RuntimeError if the command has a non-zero exit code"""
+    @unittest.skipUnless(os.path.exists(setup_ecs.SED_COMMAND) and os.path.exists(setup_ecs.GREP_COMMAND),
+                         'needs sed and grep')
+    def test_edit_config_new_ip(self):
+        """``_edit_config`` changes the IP a previous attempt set, when configuring again with a new IP"""
+        config_file = self._run_edits(setup_ecs._config_edits('192.168.1.56'),
+                                      setup_ecs._config_edits('192.168.1.57', config_ip='192.168.1.56'))
+        with open(config_file) as the_file:
+            config = the_file.read()
+
+        self.assertEqual(config.count('192.168.1.57'), 2)
+        self.assertFalse('192.168.1.56' in config)
+
+    @unittest.skipUnless(os.path.exists(setup_ecs.SED_COMMAND) and os.path.exists(setup_ecs.GREP_COMMAND),
+                         'needs sed and grep')
+    def test_edit_config_prefix_ip(self):
+        """``_edit_config`` works when the ECS IP starts with the default DNS/NTP IP"""
+        config_file = self._run_edits(setup_ecs._config_edits('192.168.2.25'))
+        with open(config_file) as the_file:
+            config = the_file.read()
+
+        self.assertEqual(config.count('192.168.2.25'), 2)
+        self.assertEqual(config.count('192.168.1.1\n'), 2)
+
+    def test_value_pattern(self):
+        """``_value_pattern`` only puts a word boundary next to a word character"""
+        patterns = [setup_ecs._value_pattern('192.168.2.2'), setup_ecs._value_pattern('/dev/vda')]
+
+        self.assertEqual(patterns, [r'\b192\.168\.2\.2\b', r'\/dev\/vda\b'])
+
+    def test_edit_config_error(self):
+        """``_edit_config`` raises RuntimeError if the command has a non-zero exit code"""
         self.ssh_client.exec_command.return_value = ('stdout', 'stderr', 1)
-        config_file = '/some/path/deploy.yml'
+        edits = setup_ecs._config_edits('192.168.1.56')
         with self.assertRaises(RuntimeError):
-            setup_ecs._update_dns_and_ntp(self.ssh_client, config_file, self.logger)
+            setup_ecs._edit_config(self.ssh_client, edits, '/some/path/deploy.yml', self.logger)
+
+    def test_edit_config_failed_edits(self):
+        """``_edit_config`` raises RuntimeError naming every edit that didn't take"""
+        stdout = 'EDIT FAILED: change a thing\r\nEDIT FAILED: change another thing\r\n'
+        self.ssh_client.exec_command.return_value = (stdout, '', 0)
+        edits = [setup_ecs.ConfigEdit('change a thing', 'a', 'b'),
+                 setup_ecs.ConfigEdit('change another thing', 'c', 'd')]
+        with self.assertRaises(RuntimeError) as err:
+            setup_ecs._edit_config(self.ssh_client, edits, '/some/path/deploy.yml', self.logger)
+
+        self.assertTrue('change a thing, change another thing' in str(err.exception))
+
+    def test_sed_escape(self):
+        """``_sed_escape`` escapes regex characters, so the text is matched literally"""
+        output = setup_ecs._sed_escape('192.168.2.2')
+        expected = '192\\.168\\.2\\.2'
+
+        self.assertEqual(output, expected)
+
+    def test_sed_escape_replacement(self):
+        """``_sed_escape`` only escapes what's special in the replacement of an 's' command"""
+        output = setup_ecs._sed_escape('/dev/sdb & more.', replacement=True)
+        expected = '\\/dev\\/sdb \\& more.'
+
+        self.assertEqual(output, expected)
 
     def test_run_update_deploy(self):
         """``_run_update_deploy`` runs the expected command"""
         setup_ecs._run_update_deploy(self.ssh_client, self.logger)
 
-        the_args, _  = self.ssh_client.exec_command.call_args
+        the_args, _  = self.ssh_client.stream_command.call_args
         cli_cmd = the_args[0]
-        expected = ". .profile ; /bin/echo ChangeMe | /usr/bin/sudo -Si /usr/bin/date && /home/admin/bin/update_deploy 2>&1 >> /home/admin/auto_config.log"
+        expected = "set -o pipefail ; . .profile ; /bin/echo ChangeMe | /usr/bin/sudo -Si /usr/bin/date && /home/admin/bin/update_deploy 2>&1 | /usr/bin/tee -a /home/admin/auto_config.log"
         self.assertEqual(expected, cli_cmd)
 
     def test_run_update_deploy_error(self):
         """``_run_update_deploy`` raises RuntimeError if the command has a non-zero exit code"""
-        self.ssh_client.exec_command.return_value = ('stdout', 'stderr', 1)
+        self.ssh_client.stream_command.return_value = ('stdout', 'stderr', 1)
         with self.assertRaises(RuntimeError):
             setup_ecs._run_update_deploy(self.ssh_client, self.logger)
 
     def test_run_step1(self):
         """``_run_step1`` runs the expected command"""
         setup_ecs._run_step1(self.ssh_client, self.logger)
-        the_args, _  = self.ssh_client.exec_command.call_args
+        the_args, _  = self.ssh_client.stream_command.call_args
         cli_cmd = the_args[0]
-        expected = ". .profile ; /bin/echo ChangeMe | /usr/bin/sudo -Si /usr/bin/date && /home/admin/bin/ova-step1 2>&1 >> /home/admin/auto_config.log"
+        expected = "set -o pipefail ; . .profile ; /bin/echo ChangeMe | /usr/bin/sudo -Si /usr/bin/date && /home/admin/bin/ova-step1 2>&1 | /usr/bin/tee -a /home/admin/auto_config.log"
         self.assertEqual(expected, cli_cmd)
 
     def test_run_step1_error(self):
         """``_run_step1`` raises RuntimeError if the command has a non-zero exit code"""
-        self.ssh_client.exec_command.return_value = ('stdout', 'stderr', 1)
+        self.ssh_client.stream_command.return_value = ('stdout', 'stderr', 1)
         with self.assertRaises(RuntimeError):
             setup_ecs._run_step1(self.ssh_client, self.logger)
 
     def test_run_step2(self):
         """``_run_step2`` runs the expected command"""
         setup_ecs._run_step2(self.ssh_client, self.logger)
-        the_args, _  = self.ssh_client.exec_command.call_args
+        the_args, _  = self.ssh_client.stream_command.call_args
         cli_cmd = the_args[0]
-        expected = ". .profile ; /bin/echo ChangeMe | /usr/bin/sudo -Si /usr/bin/date && /home/admin/bin/ova-step2 2>&1 >> /home/admin/auto_config.log"
+        expected = "set -o pipefail ; . .profile ; /bin/echo ChangeMe | /usr/bin/sudo -Si /usr/bin/date && /home/admin/bin/ova-step2 2>&1 | /usr/bin/tee -a /home/admin/auto_config.log"
         self.assertEqual(expected, cli_cmd)
 
     def test_run_step2_error(self):
         """``_run_step2`` raises RuntimeError if the command has a non-zero exit code"""
-        self.ssh_client.exec_command.return_value = ('stdout', 'stderr', 1)
+        self.ssh_client.stream_command.return_value = ('stdout', 'stderr', 1)
         with self.assertRaises(RuntimeError):
             setup_ecs._run_step2(self.ssh_client, self.logger)
 
@@ -0,0 +1,90 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``shared_store.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import redis
+
+from vlab_ecs_api.lib import shared_store
+
+
+class TestGenerations(unittest.TestCase):
+    """A set of test cases for the ``Generations`` object"""
+
+    def test_local(self):
+        """``Generations`` - without Redis, the counters are kept in the process"""
+        generations = shared_store.Generations('file:///tmp/results')
+        generations.bump('inventory:alice')
+        generations.bump('inventory:alice')
+
+        self.assertEqual(generations.get('inventory:alice'), 2)
+        self.assertEqual(generations.get('inventory:bob'), 0)
+
+    def test_shared(self):
+        """``Generations`` - the counters are only shared when they're kept in Redis"""
+        self.assertTrue(shared_store.Generations('redis://ecs-results:6379/0').shared)
+        self.assertFalse(shared_store.Generations('file:///tmp/results').shared)
+
+    @patch.object(shared_store.redis.Redis, 'from_url')
+    def test_get(self, fake_from_url):
+        """``Generations`` - the 'get' method reads the counter from Redis"""
+        fake_from_url.return_value.get.return_value = b'3'
+        generations = shared_store.Generations('redis://ecs-results:6379/0')
+
+        output = generations.get('inventory:alice')
+
+        self.assertEqual(output, 3)
+        fake_from_url.return_value.get.assert_called_with('vlab-ecs:generation:inventory:alice')
+
+    @patch.object(shared_store.redis.Redis, 'from_url')
+    def test_get_missing(self, fake_from_url):
+        """``Generations`` - a counter that's not in Redis is zero"""
+        fake_from_url.return_value.get.return_value = None
+        generations = shared_store.Generations('redis://ecs-results:6379/0')
+
+        self.assertEqual(generations.get('inventory:alice'), 0)
+
+    @patch.object(shared_store.redis.Redis, 'from_url')
+    def test_get_error(self, fake_from_url):
+        """``Generations`` - the 'get' method returns None when Redis cannot be read"""
+        fake_from_url.return_value.get.side_effect = redis.ConnectionError('testing')
+        generations = shared_store.Generations('redis://ecs-results:6379/0')
+
+        self.assertTrue(generations.get('inventory:alice') is None)
+
+    @patch.object(shared_store.redis.Redis, 'from_url')
+    def test_bump(self, fake_from_url):
+        """``Generations`` - the 'bump' method increments the counter in Redis, and sets it to expire"""
+        fake_pipe = MagicMock()
+        fake_from_url.return_value.pipeline.return_value = fake_pipe
+        generations = shared_store.Generations('redis://ecs-results:6379/0')
+
+        generations.bump('inventory:alice')
+
+        fake_pipe.incr.assert_called_with('vlab-ecs:generation:inventory:alice')
+        fake_pipe.expire.assert_called_with('vlab-ecs:generation:inventory:alice', shared_store.EXPIRES)
+        self.assertTrue(fake_pipe.execute.called)
+
+    @patch.object(shared_store.redis.Redis, 'from_url')
+    def test_bump_error(self, fake_from_url):
+        """``Generations`` - the 'bump' method does not raise when Redis is down"""
+        fake_from_url.return_value.pipeline.return_value.execute.side_effect = redis.ConnectionError('testing')
+        generations = shared_store.Generations('redis://ecs-results:6379/0')
+
+        generations.bump('inventory:alice')
+
+    @patch.object(shared_store.os, 'getpid')
+    @patch.object(shared_store.redis.Redis, 'from_url')
+    def test_fork(self, fake_from_url, fake_getpid):
+        """``Generations`` - a forked process does not share the parent's connection"""
+        fake_getpid.return_value = 1
+        generations = shared_store.Generations('redis://ecs-results:6379/0')
+        generations.get('inventory:alice')
+        fake_getpid.return_value = 2
+        generations.get('inventory:alice')
+
+        self.assertEqual(fake_from_url.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
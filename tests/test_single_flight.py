@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``single_flight.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_ecs_api.lib.views import single_flight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """A set of test cases for the ``SingleFlight`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.single_flight = single_flight.SingleFlight(window=30)
+        self.celery_app = MagicMock()
+        self.celery_app.send_task.side_effect = lambda *args, **kwargs: MagicMock(id='task-{}'.format(self.celery_app.send_task.call_count))
+
+    def test_send(self):
+        """``SingleFlight`` - 'send' appends the txn_id, and uses the queue of the task"""
+        self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'myId')
+
+        self.celery_app.send_task.assert_called_with('ecs.show', ['bob', 'myId'],
+                                                     queue=single_flight.const.VLAB_ECS_READ_QUEUE,
+                                                     headers=None)
+
+    def test_traced_not_coalesced(self):
+        """``SingleFlight`` - a traced request doesn't join an untraced task"""
+        task_id1 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id1')
+        task_id2 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id2', headers={'vlab_trace': True})
+
+        self.assertNotEqual(task_id1, task_id2)
+
+    def test_coalesce(self):
+        """``SingleFlight`` - an identical request, made while a task is in flight, gets the same task id"""
+        task_id1 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id1')
+        task_id2 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id2')
+
+        self.assertEqual(task_id1, task_id2)
+        self.assertEqual(self.celery_app.send_task.call_count, 1)
+        self.assertEqual(self.single_flight.stats()['coalesced'], 1)
+
+    def test_different_args(self):
+        """``SingleFlight`` - requests with different arguments aren't coalesced"""
+        task_id1 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id1')
+        task_id2 = self.single_flight.send(self.celery_app, 'ecs.show', ['alice'], 'id2')
+
+        self.assertNotEqual(task_id1, task_id2)
+
+    def test_done(self):
+        """``SingleFlight`` - once a task is done, a request sends a new task"""
+        task_id1 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id1')
+        self.single_flight.done(task_id1)
+        task_id2 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id2')
+
+        self.assertNotEqual(task_id1, task_id2)
+
+    def test_forget(self):
+        """``SingleFlight`` - after 'forget', a request sends a new task"""
+        task_id1 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id1')
+        self.single_flight.forget('ecs.show', ['bob'])
+        task_id2 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id2')
+
+        self.assertNotEqual(task_id1, task_id2)
+
+    def test_forget_traced(self):
+        """``SingleFlight`` - 'forget' also stops coalescing onto a traced task"""
+        task_id1 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id1', headers={'vlab_trace': True})
+        self.single_flight.forget('ecs.show', ['bob'])
+        task_id2 = self.single_flight.send(self.celery_app, 'ecs.show', ['bob'], 'id2', headers={'vlab_trace': True})
+
+        self.assertNotEqual(task_id1, task_id2)
+
+    @patch.object(single_flight.time, 'time')
+    def test_window(self, fake_time):
+        """``SingleFlight`` - a task stops being in flight after the window passes"""
+        fake_time.return_value = 100
+        task_id1 = self.single_flight.send(self.celery_app, 'ecs.image', [], 'id1')
+        fake_time.return_value = 131
+        task_id2 = self.single_flight.send(self.celery_app, 'ecs.image', [], 'id2')
+
+        self.assertNotEqual(task_id1, task_id2)
+
+
+if __name__ == '__main__':
+    unittest.main()
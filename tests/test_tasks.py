@@ -5,31 +5,293 @@ A suite of tests for the functions in tasks.py
 import unittest
 from unittest.mock import patch, MagicMock
 
+from vlab_ecs_api.lib import shared_store
 from vlab_ecs_api.lib.worker import tasks
 
 
 class TestTasks(unittest.TestCase):
     """A set of test cases for tasks.py"""
+    def setUp(self):
+        """Runs before every test case"""
+        generations = patch.object(tasks.inventory_cache.INVENTORY, '_generations',
+                                   shared_store.Generations('memory://'))
+        generations.start()
+        self.addCleanup(generations.stop)
+        tasks.inventory_cache.INVENTORY.clear()
+
     @patch.object(tasks, 'vmware')
     def test_show_ok(self, fake_vmware):
         """``show`` returns a dictionary when everything works as expected"""
         fake_vmware.show_ecs.return_value = {'worked': True}
 
         output = tasks.show(username='bob', txn_id='myId')
+        output['params'].pop('inventory_cache')
         expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_show_no_trace(self, fake_vmware):
+        """``show`` only returns the timings of each phase when the sender asks for them"""
+        fake_vmware.show_ecs.return_value = {'worked': True}
+
+        output = tasks.show(username='bob', txn_id='myId')
+
+        self.assertFalse('timings' in output['params'])
+
+    @patch.object(tasks, 'vmware')
+    def test_show_trace(self, fake_vmware):
+        """``show`` returns the timings of each phase when the message has the trace header"""
+        def show_ecs(*args, **kwargs):
+            with tasks.timing.phase('folder_lookup'):
+                return {'worked': True}
+        fake_vmware.show_ecs.side_effect = show_ecs
+
+        tasks.show.push_request(**{tasks.celery_config.TRACE_HEADER: True})
+        try:
+            output = tasks.show(username='bob', txn_id='myId')
+        finally:
+            tasks.show.pop_request()
+        phases = [x['name'] for x in output['params']['timings']['phases']]
+
+        self.assertEqual(phases, ['folder_lookup'])
+
     @patch.object(tasks, 'vmware')
     def test_show_value_error(self, fake_vmware):
         """``show`` sets the error in the dictionary to the ValueError message"""
         fake_vmware.show_ecs.side_effect = [ValueError("testing")]
 
         output = tasks.show(username='bob', txn_id='myId')
+        output['params'].pop('inventory_cache')
         expected = {'content' : {}, 'error': 'testing', 'params': {}}
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_show_cached(self, fake_vmware):
+        """``show`` does not look up the inventory again while it's cached"""
+        fake_vmware.show_ecs.return_value = {'worked': True}
+
+        tasks.show(username='bob', txn_id='myId')
+        output = tasks.show(username='bob', txn_id='myId')
+
+        self.assertEqual(fake_vmware.show_ecs.call_count, 1)
+        self.assertEqual(output['content'], {'worked': True})
+
+    @patch.object(tasks, 'vmware')
+    def test_show_cache_params(self, fake_vmware):
+        """``show`` reports the inventory cache hit/miss counters in the 'params'"""
+        fake_vmware.show_ecs.return_value = {'worked': True}
+
+        first = tasks.show(username='bob', txn_id='myId')
+        second = tasks.show(username='bob', txn_id='myId')
+        hits = second['params']['inventory_cache']['hits'] - first['params']['inventory_cache']['hits']
+        misses = second['params']['inventory_cache']['misses'] - first['params']['inventory_cache']['misses']
+
+        self.assertEqual(hits, 1)
+        self.assertEqual(misses, 0)
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_create_invalidates(self, fake_vmware, fake_inventory_cache):
+        """``create`` invalidates the user's cached inventory"""
+        tasks.create(username='bob',
+                     machine_name='ecsBox',
+                     image='0.0.1',
+                     network='someLAN',
+                     txn_id='myId')
+
+        fake_inventory_cache.INVENTORY.invalidate.assert_called_with('bob')
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_delete_invalidates(self, fake_vmware, fake_inventory_cache):
+        """``delete`` invalidates the user's cached inventory"""
+        tasks.delete(username='bob', machine_name='ecsBox', txn_id='myId')
+
+        fake_inventory_cache.INVENTORY.invalidate.assert_called_with('bob')
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_modify_network_invalidates(self, fake_vmware, fake_inventory_cache):
+        """``modify_network`` invalidates the user's cached inventory"""
+        fake_vmware.update_network.side_effect = ValueError('some bad input')
+        tasks.modify_network(username='pat',
+                             machine_name='myEcs',
+                             new_network='wootTown',
+                             txn_id='someTransactionID')
+
+        fake_inventory_cache.INVENTORY.invalidate.assert_called_with('pat')
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    @patch.object(tasks, 'setup_ecs')
+    def test_config_invalidates(self, fake_setup_ecs, fake_vmware, fake_inventory_cache):
+        """``config`` invalidates the user's cached inventory"""
+        fake_vmware.show_ecs.return_value = {'myECSbox' : {'meta': {'configured' : False}}}
+        tasks.config(username='alice',
+                     machine_name='myECSbox',
+                     ssh_port=50022,
+                     gateway_ip='10.8.6.1',
+                     ecs_ip='192.168.1.65',
+                     txn_id='aabbcc')
+
+        fake_inventory_cache.INVENTORY.invalidate.assert_called_with('alice')
+
+    @patch.object(tasks, 'vmware')
+    @patch.object(tasks, 'setup_ecs')
+    def test_config_resumes(self, fake_setup_ecs, fake_vmware):
+        """``config`` passes along the stages a previous attempt completed"""
+        meta = {'configured' : False,
+                'config_stages': {'ecs_ip': '192.168.1.65', 'completed': ['update_config']}}
+        fake_vmware.show_ecs.return_value = {'myECSbox' : {'meta': meta}}
+        tasks.config(username='alice',
+                     machine_name='myECSbox',
+                     ssh_port=50022,
+                     gateway_ip='10.8.6.1',
+                     ecs_ip='192.168.1.65',
+                     txn_id='aabbcc')
+
+        _, the_kwargs = fake_setup_ecs.configure.call_args
+
+        self.assertEqual(the_kwargs['completed'], ['update_config'])
+
+    @patch.object(tasks, 'vmware')
+    @patch.object(tasks, 'setup_ecs')
+    def test_config_resume_new_ip(self, fake_setup_ecs, fake_vmware):
+        """``config`` starts over if the previous attempt was for a different IP"""
+        meta = {'configured' : False,
+                'config_stages': {'ecs_ip': '192.168.1.99', 'completed': ['update_config']}}
+        fake_vmware.show_ecs.return_value = {'myECSbox' : {'meta': meta}}
+        tasks.config(username='alice',
+                     machine_name='myECSbox',
+                     ssh_port=50022,
+                     gateway_ip='10.8.6.1',
+                     ecs_ip='192.168.1.65',
+                     txn_id='aabbcc')
+
+        _, the_kwargs = fake_setup_ecs.configure.call_args
+
+        self.assertEqual(the_kwargs['completed'], [])
+
+    @patch.object(tasks, 'vmware')
+    @patch.object(tasks, 'setup_ecs')
+    def test_config_resume_new_ip_config_ip(self, fake_setup_ecs, fake_vmware):
+        """``config`` changes the IP the previous attempt put in deploy.yml, when retrying with a different IP"""
+        meta = {'configured' : False,
+                'config_stages': {'ecs_ip': '192.168.1.99', 'completed': ['update_config'], 'config_ip': '192.168.1.99'}}
+        fake_vmware.show_ecs.return_value = {'myECSbox' : {'meta': meta}}
+        tasks.config(username='alice',
+                     machine_name='myECSbox',
+                     ssh_port=50022,
+                     gateway_ip='10.8.6.1',
+                     ecs_ip='192.168.1.65',
+                     txn_id='aabbcc')
+
+        _, the_kwargs = fake_setup_ecs.configure.call_args
+
+        self.assertEqual(the_kwargs['config_ip'], '192.168.1.99')
+
+    @patch.object(tasks, 'vmware')
+    @patch.object(tasks, 'setup_ecs')
+    def test_config_checkpoint(self, fake_setup_ecs, fake_vmware):
+        """``config`` saves each completed stage in the VM meta data"""
+        fake_vmware.show_ecs.return_value = {'myECSbox' : {'meta': {'configured' : False}}}
+        def configure(*args, **kwargs):
+            kwargs['checkpoint']('update_config')
+            raise RuntimeError('testing')
+        fake_setup_ecs.configure.side_effect = configure
+        tasks.config(username='alice',
+                     machine_name='myECSbox',
+                     ssh_port=50022,
+                     gateway_ip='10.8.6.1',
+                     ecs_ip='192.168.1.65',
+                     txn_id='aabbcc')
+
+        the_args, _ = fake_vmware.set_meta.call_args
+        meta = the_args[2]
+        expected = {'ecs_ip': '192.168.1.65', 'completed': ['update_config'], 'config_ip': '192.168.1.65'}
+
+        self.assertEqual(meta['config_stages'], expected)
+        self.assertFalse(meta['configured'])
+
+    @patch.object(tasks, 'vmware')
+    @patch.object(tasks, 'setup_ecs')
+    @patch.object(tasks, '_report_progress')
+    def test_config_progress(self, fake_report_progress, fake_setup_ecs, fake_vmware):
+        """``config`` reports progress after each completed stage"""
+        fake_vmware.show_ecs.return_value = {'myECSbox' : {'meta': {'configured' : False}}}
+        fake_setup_ecs.configure.side_effect = lambda *args, **kwargs: kwargs['checkpoint']('update_config')
+        tasks.config(username='alice',
+                     machine_name='myECSbox',
+                     ssh_port=50022,
+                     gateway_ip='10.8.6.1',
+                     ecs_ip='192.168.1.65',
+                     txn_id='aabbcc')
+
+        _, the_kwargs = fake_report_progress.call_args
+
+        self.assertEqual(the_kwargs['completed'], ['update_config'])
+
+    def test_report_progress(self):
+        """``_report_progress`` sets the PROGRESS state of a task"""
+        fake_task = MagicMock()
+        tasks._report_progress(fake_task, stage='step1')
+
+        fake_task.update_state.assert_called_with(state='PROGRESS', meta={'stage': 'step1'})
+
+    def test_report_progress_no_id(self):
+        """``_report_progress`` does nothing for a task that wasn't sent via the broker"""
+        fake_task = MagicMock()
+        fake_task.request.id = None
+        tasks._report_progress(fake_task, stage='step1')
+
+        self.assertFalse(fake_task.update_state.called)
+
+    @patch.object(tasks, 'inventory_cache')
+    def test_inventory_watcher(self, fake_inventory_cache):
+        """``_start_inventory_watcher`` does nothing unless VLAB_ECS_INVENTORY_WATCH is set"""
+        tasks._start_inventory_watcher()
+
+        self.assertFalse(fake_inventory_cache.start_watcher.called)
+
+    @patch.object(tasks, 'const', tasks.const._replace(VLAB_ECS_INVENTORY_WATCH=True))
+    @patch.object(tasks, 'inventory_cache')
+    def test_inventory_watcher_shared(self, fake_inventory_cache):
+        """With shared generations, only the main worker process starts a watcher"""
+        fake_inventory_cache.INVENTORY.shared = True
+        tasks._start_inventory_watcher()
+        tasks._start_process_inventory_watcher()
+
+        self.assertEqual(fake_inventory_cache.start_watcher.call_count, 1)
+
+    @patch.object(tasks, 'const', tasks.const._replace(VLAB_ECS_INVENTORY_WATCH=True))
+    @patch.object(tasks, 'inventory_cache')
+    def test_inventory_watcher_local(self, fake_inventory_cache):
+        """Without shared generations, every worker process starts its own watcher"""
+        fake_inventory_cache.INVENTORY.shared = False
+        tasks._start_inventory_watcher()
+        self.assertFalse(fake_inventory_cache.start_watcher.called)
+
+        tasks._start_process_inventory_watcher()
+
+        self.assertTrue(fake_inventory_cache.start_watcher.called)
+
+    @patch.object(tasks, 'metrics')
+    def test_metrics_server(self, fake_metrics):
+        """``_start_metrics_server`` serves the worker's metrics on VLAB_ECS_METRICS_PORT"""
+        tasks._start_metrics_server()
+
+        fake_metrics.start_worker_server.assert_called_with(tasks.const.VLAB_ECS_METRICS_PORT)
+
+    @patch.object(tasks, 'const', tasks.const._replace(VLAB_ECS_METRICS_PORT=0))
+    @patch.object(tasks, 'metrics')
+    def test_metrics_server_disabled(self, fake_metrics):
+        """``_start_metrics_server`` does nothing when VLAB_ECS_METRICS_PORT is zero"""
+        tasks._start_metrics_server()
+
+        self.assertFalse(fake_metrics.start_worker_server.called)
+
     @patch.object(tasks, 'vmware')
     def test_create_ok(self, fake_vmware):
         """``create`` returns a dictionary when everything works as expected"""
@@ -44,6 +306,34 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'const', tasks.const._replace(VLAB_ECS_WARM_POOL_SIZE=2))
+    @patch.object(tasks.refill_pool, 'apply_async')
+    @patch.object(tasks, 'vmware')
+    def test_create_refills_pool(self, fake_vmware, fake_apply_async):
+        """``create`` refills the warm pool of the version, and reports the pool stats"""
+        fake_vmware.create_ecs.return_value = {'worked': True}
+
+        output = tasks.create(username='bob',
+                              machine_name='ecsBox',
+                              image='0.0.1',
+                              network='someLAN',
+                              txn_id='myId')
+
+        fake_apply_async.assert_called_with(kwargs={'txn_id': 'myId', 'version': '0.0.1'})
+        self.assertTrue('warm_pool' in output['params'])
+
+    @patch.object(tasks.refill_pool, 'apply_async')
+    @patch.object(tasks, 'vmware')
+    def test_create_no_pool(self, fake_vmware, fake_apply_async):
+        """``create`` doesn't refill the warm pool when it's disabled"""
+        tasks.create(username='bob',
+                     machine_name='ecsBox',
+                     image='0.0.1',
+                     network='someLAN',
+                     txn_id='myId')
+
+        self.assertFalse(fake_apply_async.called)
+
     @patch.object(tasks, 'vmware')
     def test_create_value_error(self, fake_vmware):
         """``create`` sets the error in the dictionary to the ValueError message"""
@@ -58,6 +348,33 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_create_bulk_error(self, fake_vmware):
+        """``create`` sets the error in the dictionary to any failure, when it's part of a bulk create"""
+        fake_vmware.create_ecs.side_effect = [RuntimeError("testing")]
+
+        output = tasks.create(username='bob',
+                              machine_name='ecsBox',
+                              image='0.0.1',
+                              network='someLAN',
+                              txn_id='myId',
+                              bulk=True)
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_create_runtime_error(self, fake_vmware):
+        """``create`` raises any failure, other than ValueError, when it isn't part of a bulk create"""
+        fake_vmware.create_ecs.side_effect = [RuntimeError("testing")]
+
+        with self.assertRaises(RuntimeError):
+            tasks.create(username='bob',
+                         machine_name='ecsBox',
+                         image='0.0.1',
+                         network='someLAN',
+                         txn_id='myId')
+
     @patch.object(tasks, 'vmware')
     def test_delete_ok(self, fake_vmware):
         """``delete`` returns a dictionary when everything works as expected"""
@@ -78,6 +395,43 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    def test_bulk_results(self):
+        """``bulk_results`` returns the result of every new instance of Ecs, keyed by its name"""
+        results = [{'content': {'ecs1': {'worked': True}}, 'error': None, 'params': {}},
+                   {'content': {}, 'error': 'testing', 'params': {}}]
+
+        output = tasks.bulk_results(results, machine_names=['ecs1', 'ecs2'], txn_id='myId')
+        expected = {'content' : {'ecs1': {'content': {'worked': True}, 'error': None},
+                                 'ecs2': {'content': {}, 'error': 'testing'}},
+                    'error': None,
+                    'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_bulk_delete(self, fake_vmware, fake_inventory_cache):
+        """``bulk_delete`` returns the result of every instance, and invalidates the user's inventory"""
+        fake_vmware.bulk_delete_ecs.return_value = {'ecs1': {'content': {}, 'error': None}}
+
+        output = tasks.bulk_delete(username='bob', machine_names=['ecs1'], txn_id='myId')
+        expected = {'content' : {'ecs1': {'content': {}, 'error': None}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        fake_inventory_cache.INVENTORY.invalidate.assert_called_with('bob')
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_bulk_delete_value_error(self, fake_vmware, fake_inventory_cache):
+        """``bulk_delete`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.bulk_delete_ecs.side_effect = [ValueError("testing")]
+
+        output = tasks.bulk_delete(username='bob', machine_names=['ecs1'], txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+        fake_inventory_cache.INVENTORY.invalidate.assert_called_with('bob')
+
     @patch.object(tasks, 'vmware')
     def test_image(self, fake_vmware):
         """``image`` returns a dictionary when everything works as expected"""
@@ -88,6 +442,83 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_healthcheck(self, fake_vmware):
+        """``healthcheck`` returns no error when vCenter is reachable"""
+        output = tasks.healthcheck(txn_id='myId')
+        expected = {'content' : {}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_healthcheck_error(self, fake_vmware):
+        """``healthcheck`` sets the error when vCenter isn't reachable"""
+        fake_vmware.ping_vcenter.side_effect = OSError('testing')
+
+        output = tasks.healthcheck(txn_id='myId')
+
+        self.assertEqual(output['error'], 'testing')
+
+    @patch.object(tasks, 'vmware')
+    def test_sync_templates(self, fake_vmware):
+        """``sync_templates`` returns which base VMs were removed and kept"""
+        fake_vmware.sync_templates.return_value = {'removed': ['ECS-3.1.0-base-1'], 'kept': []}
+
+        output = tasks.sync_templates(txn_id='myId')
+        expected = {'content' : {'removed': ['ECS-3.1.0-base-1'], 'kept': []}, 'error': None, 'params' : {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks.add_to_pool, 'apply_async')
+    @patch.object(tasks, 'vmware')
+    def test_refill_pool(self, fake_vmware, fake_apply_async):
+        """``refill_pool`` returns how many VMs of each version are in the pool"""
+        fake_vmware.refill_pool.return_value = {'3.2.2': {'ready': 2, 'deploying': 0, 'missing': 0}}
+
+        output = tasks.refill_pool(txn_id='myId', version='3.2.2')
+
+        self.assertEqual(output['content'], {'3.2.2': {'ready': 2, 'deploying': 0, 'missing': 0}})
+        self.assertTrue('warm_pool' in output['params'])
+        self.assertFalse(fake_apply_async.called)
+
+    @patch.object(tasks.add_to_pool, 'apply_async')
+    @patch.object(tasks, 'vmware')
+    def test_refill_pool_fan_out(self, fake_vmware, fake_apply_async):
+        """``refill_pool`` queues one 'add_to_pool' task per missing VM"""
+        fake_vmware.refill_pool.return_value = {'3.2.2': {'ready': 0, 'deploying': 1, 'missing': 2}}
+
+        tasks.refill_pool(txn_id='myId')
+
+        self.assertEqual(fake_apply_async.call_count, 2)
+        fake_apply_async.assert_called_with(kwargs={'txn_id': 'myId', 'version': '3.2.2'})
+
+    @patch.object(tasks, 'vmware')
+    def test_add_to_pool(self, fake_vmware):
+        """``add_to_pool`` returns the name of the VM it added"""
+        fake_vmware.add_to_pool.return_value = 'ECS-3.2.2-pool-1-abc'
+
+        output = tasks.add_to_pool(txn_id='myId', version='3.2.2')
+
+        self.assertEqual(output['content'], {'added': 'ECS-3.2.2-pool-1-abc'})
+
+    @patch.object(tasks, 'vmware')
+    def test_add_to_pool_value_error(self, fake_vmware):
+        """``add_to_pool`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.add_to_pool.side_effect = ValueError('No such network named vlab-ecs-pool')
+
+        output = tasks.add_to_pool(txn_id='myId', version='3.2.2')
+
+        self.assertEqual(output['error'], 'No such network named vlab-ecs-pool')
+
+    @patch.object(tasks, 'vmware')
+    def test_refill_pool_value_error(self, fake_vmware):
+        """``refill_pool`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.refill_pool.side_effect = ValueError('No such network named vlab-ecs-pool')
+
+        output = tasks.refill_pool(txn_id='myId')
+
+        self.assertEqual(output['error'], 'No such network named vlab-ecs-pool')
+
     @patch.object(tasks, 'vmware')
     def test_modify_network(self, fake_vmware):
         """``modify_network`` returns an empty content dictionary upon success"""
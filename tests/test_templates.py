@@ -0,0 +1,197 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``templates.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_ecs_api.lib.worker import templates
+
+
+class TestTemplates(unittest.TestCase):
+    """A set of test cases for the ``templates.py`` module"""
+
+    def test_template_name(self):
+        """``template_name`` includes the version and the mtime of the OVA"""
+        output = templates.template_name('3.2.2', 1234)
+        expected = 'ECS-3.2.2-base-1234'
+
+        self.assertEqual(output, expected)
+
+    def test_template_name_valid(self):
+        """``template_name`` makes a valid machine name"""
+        name = templates.template_name('3.2.2', 1551223591123456789)
+
+        self.assertTrue(templates.MACHINE_NAME_REGEX.match(name))
+
+    def test_service_folder(self):
+        """``service_folder`` creates the folder if it doesn't exist"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_vm_folder.side_effect = [FileNotFoundError('testing'), 'someFolder']
+
+        output = templates.service_folder(fake_vcenter, 'someFolder')
+
+        self.assertEqual(output, 'someFolder')
+        self.assertTrue(fake_vcenter.create_vm_folder.called)
+
+    @patch.object(templates, 'template_folder')
+    @patch.object(templates, 'property_collector')
+    def test_find_templates(self, fake_property_collector, fake_template_folder):
+        """``find_templates`` only returns base VMs that are done being made"""
+        done = MagicMock()
+        building = MagicMock()
+        other = MagicMock()
+        fake_property_collector.retrieve_children.return_value = [
+            (done, {'name': 'a', 'config.annotation': '{"component": "EcsTemplate", "version": "3.2.2"}'}),
+            (building, {'name': 'b', 'config.annotation': ''}),
+            (other, {'name': 'c', 'config.annotation': '{"component": "Ecs", "version": "3.2.2"}'}),
+        ]
+
+        output = templates.find_templates(MagicMock())
+        expected = [(done, {'component': 'EcsTemplate', 'version': '3.2.2'})]
+
+        self.assertEqual(output, expected)
+
+    @patch.object(templates, 'find_templates')
+    def test_get_template(self, fake_find_templates):
+        """``get_template`` returns the base VM made from the current OVA"""
+        old = MagicMock()
+        new = MagicMock()
+        fake_find_templates.return_value = [(old, {'version': '3.2.2', 'image_mtime': 1}),
+                                            (new, {'version': '3.2.2', 'image_mtime': 2})]
+
+        output = templates.get_template(MagicMock(), '3.2.2', 2)
+
+        self.assertTrue(output is new)
+
+    @patch.object(templates, 'find_templates')
+    def test_get_template_none(self, fake_find_templates):
+        """``get_template`` returns None if there's no base VM for the OVA"""
+        fake_find_templates.return_value = [(MagicMock(), {'version': '3.2.2', 'image_mtime': 1})]
+
+        output = templates.get_template(MagicMock(), '3.2.2', 2)
+
+        self.assertTrue(output is None)
+
+    @patch.object(templates, 'consume_task')
+    @patch.object(templates, 'template_folder')
+    @patch.object(templates, 'virtual_machine')
+    def test_create_template(self, fake_virtual_machine, fake_template_folder, fake_consume_task):
+        """``create_template`` snapshots the base VM, and sets its meta data last"""
+        fake_vm = fake_virtual_machine.deploy_from_ova.return_value
+        calls = []
+        fake_vm.CreateSnapshot_Task.side_effect = lambda **kwargs: calls.append('snapshot')
+        fake_virtual_machine.set_meta.side_effect = lambda vm, meta: calls.append('meta')
+
+        output = templates.create_template(vcenter=MagicMock(), ova=MagicMock(), network_map=[],
+                                           version='3.2.2', image_mtime=1234, mb_of_ram=16384,
+                                           logger=MagicMock())
+        meta = fake_virtual_machine.set_meta.call_args[0][1]
+
+        self.assertTrue(output is fake_vm)
+        self.assertEqual(calls, ['snapshot', 'meta'])
+        self.assertEqual(meta['component'], templates.TEMPLATE_COMPONENT)
+        self.assertEqual(meta['image_mtime'], 1234)
+
+    @patch.object(templates, 'consume_task')
+    @patch.object(templates, 'template_folder')
+    @patch.object(templates, 'virtual_machine')
+    def test_create_template_cleanup(self, fake_virtual_machine, fake_template_folder, fake_consume_task):
+        """``create_template`` destroys the base VM if it can't finish making it"""
+        fake_vm = fake_virtual_machine.deploy_from_ova.return_value
+        fake_virtual_machine.adjust_ram.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            templates.create_template(vcenter=MagicMock(), ova=MagicMock(), network_map=[],
+                                      version='3.2.2', image_mtime=1234, mb_of_ram=16384,
+                                      logger=MagicMock())
+
+        self.assertTrue(fake_vm.Destroy_Task.called)
+
+    def _make_disk(self, *files):
+        """A virtual disk; each file is the parent of the one before it"""
+        backing = None
+        for file_name in reversed(files):
+            backing = templates.vim.vm.device.VirtualDisk.FlatVer2BackingInfo(fileName=file_name, parent=backing)
+        return templates.vim.vm.device.VirtualDisk(backing=backing)
+
+    @patch.object(templates, 'property_collector')
+    def test_users(self, fake_property_collector):
+        """``users`` finds the VMs whose disks are children of the base VM's disks"""
+        base = templates.vim.VirtualMachine('vm-1')
+        linked = templates.vim.VirtualMachine('vm-2')
+        full = templates.vim.VirtualMachine('vm-3')
+        base_disks = ['[ds] base/base-000001.vmdk', '[ds] base/base.vmdk']
+        fake_property_collector.retrieve_by_type.return_value = [
+            (base, {'name': 'base', 'config.hardware.device': [self._make_disk(*base_disks)]}),
+            (linked, {'name': 'linked', 'config.hardware.device': [self._make_disk('[ds] linked/linked.vmdk', '[ds] base/base.vmdk')]}),
+            (full, {'name': 'full', 'config.hardware.device': [self._make_disk('[ds] full/full.vmdk')]}),
+        ]
+
+        output = templates.users(MagicMock(), [base])
+
+        self.assertEqual(output, {base: ['linked']})
+
+    @patch.object(templates, 'property_collector')
+    def test_users_no_devices(self, fake_property_collector):
+        """``users`` ignores VMs whose hardware isn't set yet (i.e. still being deployed)"""
+        base = templates.vim.VirtualMachine('vm-1')
+        building = templates.vim.VirtualMachine('vm-2')
+        fake_property_collector.retrieve_by_type.return_value = [
+            (base, {'name': 'base', 'config.hardware.device': [self._make_disk('[ds] base/base.vmdk')]}),
+            (building, {'name': 'building'}),
+        ]
+
+        output = templates.users(MagicMock(), [base])
+
+        self.assertEqual(output, {base: []})
+
+    @patch.object(templates, 'property_collector')
+    def test_users_nothing_to_check(self, fake_property_collector):
+        """``users`` doesn't read every VM when there are no base VMs to check"""
+        output = templates.users(MagicMock(), [])
+
+        self.assertEqual(output, {})
+        self.assertFalse(fake_property_collector.retrieve_by_type.called)
+
+    @patch.object(templates, 'consume_task')
+    def test_clone_linked(self, fake_consume_task):
+        """``clone`` makes a linked clone by default"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.resource_pools = {templates.const.INF_VCENTER_RESORUCE_POOL: templates.vim.ResourcePool('resgroup-1')}
+        fake_template = MagicMock()
+        fake_template.snapshot.currentSnapshot = templates.vim.vm.Snapshot('snapshot-1')
+
+        templates.clone(fake_vcenter, fake_template, 'alice', 'myEcs')
+        spec = fake_template.CloneVM_Task.call_args[1]['spec']
+
+        self.assertEqual(spec.location.diskMoveType, 'createNewChildDiskBacking')
+        self.assertTrue(spec.snapshot is fake_template.snapshot.currentSnapshot)
+        self.assertFalse(spec.powerOn)
+
+    @patch.object(templates, 'const', templates.const._replace(VLAB_ECS_FULL_CLONE=True))
+    @patch.object(templates, 'consume_task')
+    def test_clone_full(self, fake_consume_task):
+        """``clone`` copies the disks when VLAB_ECS_FULL_CLONE is set"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.resource_pools = {templates.const.INF_VCENTER_RESORUCE_POOL: templates.vim.ResourcePool('resgroup-1')}
+        fake_template = MagicMock()
+        fake_template.snapshot.currentSnapshot = templates.vim.vm.Snapshot('snapshot-1')
+
+        templates.clone(fake_vcenter, fake_template, 'alice', 'myEcs')
+        spec = fake_template.CloneVM_Task.call_args[1]['spec']
+
+        self.assertEqual(spec.location.diskMoveType, None)
+        self.assertEqual(spec.snapshot, None)
+
+    @patch.object(templates, 'consume_task')
+    def test_clone_bad_name(self, fake_consume_task):
+        """``clone`` raises ValueError for an invalid machine name"""
+        fake_template = MagicMock()
+
+        with self.assertRaises(ValueError):
+            templates.clone(MagicMock(), fake_template, 'alice', 'my_ecs!')
+
+        self.assertFalse(fake_template.CloneVM_Task.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
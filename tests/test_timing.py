@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``timing.py`` module"""
+import unittest
+import threading
+from unittest.mock import patch, MagicMock
+
+from vlab_ecs_api.lib.worker import timing
+
+
+class TestPhaseTimer(unittest.TestCase):
+    """A set of test cases for the ``PhaseTimer`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.logger = MagicMock()
+        self.timer = timing.PhaseTimer(self.logger)
+
+    @patch.object(timing.time, 'perf_counter')
+    def test_timings(self, fake_perf_counter):
+        """``PhaseTimer`` - records how long each phase took, summing repeats"""
+        fake_perf_counter.side_effect = [0, 2, 10, 13, 20, 21]
+        with self.timer.phase('deploy'):
+            pass
+        with self.timer.phase('power_on'):
+            pass
+        with self.timer.phase('deploy'):
+            pass
+
+        self.assertEqual(self.timer.timings(), {'deploy': 3, 'power_on': 3})
+
+    def test_phase_error(self):
+        """``PhaseTimer`` - records a phase that raises"""
+        with self.assertRaises(RuntimeError):
+            with self.timer.phase('deploy'):
+                raise RuntimeError('testing')
+
+        self.assertTrue('deploy' in self.timer.timings())
+
+    @patch.object(timing.time, 'perf_counter')
+    def test_log(self, fake_perf_counter):
+        """``PhaseTimer`` - the 'log' method reports every phase on one line"""
+        fake_perf_counter.side_effect = [0, 2, 10, 13]
+        with self.timer.phase('deploy'):
+            pass
+        with self.timer.phase('power_on'):
+            pass
+        self.timer.log()
+
+        self.logger.info.assert_called_with('Timings: deploy=2.00s, power_on=3.00s (total 5.00s)')
+
+    @patch.object(timing.time, 'perf_counter')
+    def test_trace(self, fake_perf_counter):
+        """``PhaseTimer`` - the 'trace' method lists every phase in order, with the total"""
+        fake_perf_counter.side_effect = [0, 2, 10, 13]
+        with self.timer.phase('deploy'):
+            pass
+        with self.timer.phase('power_on'):
+            pass
+
+        expected = {'phases': [{'name': 'deploy', 'seconds': 2}, {'name': 'power_on', 'seconds': 3}],
+                    'total': 5}
+
+        self.assertEqual(self.timer.trace(), expected)
+
+
+class TestTrace(unittest.TestCase):
+    """A set of test cases for the module level ``trace`` and ``phase`` functions"""
+
+    def test_phase(self):
+        """``phase`` records onto the timer of the active trace"""
+        with timing.trace() as timer:
+            with timing.phase('folder_lookup'):
+                pass
+
+        self.assertEqual(list(timer.timings().keys()), ['folder_lookup'])
+
+    def test_phase_no_trace(self):
+        """``phase`` does nothing outside of a trace"""
+        with timing.phase('folder_lookup'):
+            pass
+
+        self.assertTrue(timing.active() is None)
+
+    def test_trace_restores(self):
+        """``trace`` makes the outer timer active again once a nested trace ends"""
+        with timing.trace() as outer:
+            with timing.trace() as inner:
+                self.assertTrue(timing.active() is inner)
+            self.assertTrue(timing.active() is outer)
+
+        self.assertTrue(timing.active() is None)
+
+    def test_trace_per_thread(self):
+        """``trace`` only makes a timer active for the thread that started it"""
+        seen = []
+        with timing.trace():
+            thread = threading.Thread(target=lambda: seen.append(timing.active()))
+            thread.start()
+            thread.join()
+
+        self.assertEqual(seen, [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``vm_spec.py`` module"""
+import unittest
+from unittest.mock import MagicMock
+
+import ujson
+
+from vlab_ecs_api.lib.worker import vm_spec
+
+
+class TestVmSpec(unittest.TestCase):
+    """A set of test cases for the ``vm_spec.py`` module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.meta = {'component': 'Ecs', 'created': 1234, 'version': '3.2.2', 'generation': 1, 'configured': False}
+
+    def test_config_spec(self):
+        """``config_spec`` combines the RAM, meta data and name into one spec"""
+        spec = vm_spec.config_spec(mb_of_ram=16384, meta_data=self.meta, name='myEcs')
+
+        self.assertEqual(spec.memoryMB, 16384)
+        self.assertEqual(ujson.loads(spec.annotation), self.meta)
+        self.assertEqual(spec.name, 'myEcs')
+
+    def test_config_spec_partial(self):
+        """``config_spec`` leaves out the changes that aren't supplied"""
+        spec = vm_spec.config_spec(mb_of_ram=16384)
+
+        self.assertEqual(spec.annotation, None)
+        self.assertEqual(spec.name, None)
+        self.assertEqual(spec.deviceChange, [])
+
+    def test_config_spec_bad_meta(self):
+        """``config_spec`` raises ValueError when the meta data is missing keys"""
+        with self.assertRaises(ValueError):
+            vm_spec.config_spec(meta_data={'component': 'Ecs'})
+
+    def test_nic_change(self):
+        """``nic_change`` connects the network adapter to the distributed port group"""
+        nic = vm_spec.vim.vm.device.VirtualVmxnet3()
+        nic.deviceInfo = vm_spec.vim.Description(label='Network adapter 1', summary='')
+        network = MagicMock()
+        network.key = 'dvportgroup-1'
+        network.config.distributedVirtualSwitch.uuid = 'some-uuid'
+
+        spec = vm_spec.nic_change([nic], network)
+
+        self.assertEqual(spec.device.backing.port.portgroupKey, 'dvportgroup-1')
+        self.assertTrue(spec.device.connectable.startConnected)
+
+    def test_nic_change_no_nic(self):
+        """``nic_change`` raises RuntimeError if the VM has no such network adapter"""
+        with self.assertRaises(RuntimeError):
+            vm_spec.nic_change([], MagicMock())
+
+
+if __name__ == '__main__':
+    unittest.main()
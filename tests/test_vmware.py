@@ -5,30 +5,39 @@ A suite of tests for the functions in vmware.py
 import unittest
 from unittest.mock import patch, MagicMock
 
-from vlab_ecs_api.lib.worker import vmware
+from vlab_ecs_api.lib.worker import vmware, warm_pool
 
 
 class TestVMware(unittest.TestCase):
     """A set of test cases for the vmware.py module"""
 
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_show_ecs(self, fake_vCenter, fake_consume_task, fake_get_info):
+    @patch.object(vmware, '_console_url_maker')
+    @patch.object(vmware, 'property_collector')
+    @patch.object(vmware, 'vcenter_session')
+    def test_show_ecs(self, fake_vcenter_session, fake_property_collector, fake_console_url_maker):
         """``ecs`` returns a dictionary when everything works as expected"""
         fake_vm = MagicMock()
-        fake_vm.name = 'Ecs'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta' : {'component': 'Ecs',
-                                                'created': 1234,
-                                                'version': '1.12',
-                                                'configured': False,
-                                                'generation': 1}}
+        fake_vm._moId = 'vm-1'
+        fake_nic = MagicMock()
+        fake_nic.ipAddress = ['192.168.1.2', 'fe80::1']
+        fake_network = MagicMock()
+        fake_network._moId = 'network-1'
+        props = {'name': 'Ecs',
+                 'runtime.powerState': 'poweredOn',
+                 'config.annotation': '{"component": "Ecs", "created": 1234, "version": "1.12", "configured": false, "generation": 1}',
+                 'guest.net': [fake_nic],
+                 'network': [fake_network]}
+        fake_property_collector.retrieve_children.return_value = [(fake_vm, props)]
+        fake_property_collector.retrieve_by_type.return_value = [(fake_network, {'name': 'alice_frontend'})]
+        fake_console_url_maker.return_value = lambda the_vm, name: 'https://some-console-url'
 
         output = vmware.show_ecs(username='alice')
-        expected = {'Ecs': {'meta' : {'component': 'Ecs',
+        expected = {'Ecs': {'state': 'poweredOn',
+                            'console': 'https://some-console-url',
+                            'ips': ['192.168.1.2'],
+                            'networks': ['frontend'],
+                            'moid': 'vm-1',
+                            'meta' : {'component': 'Ecs',
                                       'created': 1234,
                                       'version': '1.12',
                                       'configured': False,
@@ -36,60 +45,243 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'power')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_delete_ecs(self, fake_vCenter, fake_consume_task, fake_power, fake_get_info):
+    @patch.object(vmware, '_console_url_maker')
+    @patch.object(vmware, 'property_collector')
+    @patch.object(vmware, 'vcenter_session')
+    def test_show_ecs_filters(self, fake_vcenter_session, fake_property_collector, fake_console_url_maker):
+        """``ecs`` only returns VMs that are a component of Ecs"""
+        fake_vm = MagicMock()
+        props = {'name': 'myOtherBox',
+                 'runtime.powerState': 'poweredOn',
+                 'config.annotation': '{"component": "OneFS", "created": 1234, "version": "1.12", "configured": false, "generation": 1}'}
+        fake_property_collector.retrieve_children.return_value = [(fake_vm, props)]
+
+        output = vmware.show_ecs(username='alice')
+
+        self.assertEqual(output, {})
+        self.assertFalse(fake_console_url_maker.called)
+
+    def test_parse_meta(self):
+        """``_parse_meta`` returns default meta data when the VM has no notes"""
+        output = vmware._parse_meta({'name': 'someVM'})
+        expected = {'component': 'Unknown',
+                    'created': 0,
+                    'version': "Unknown",
+                    'generation': 0,
+                    'configured': False
+                   }
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware.ssl, 'get_server_certificate')
+    @patch.object(vmware.ssl, 'PEM_cert_to_DER_cert')
+    def test_console_url_maker(self, fake_PEM_cert_to_DER_cert, fake_get_server_certificate):
+        """``_console_url_maker`` returns a function that makes an HTML5 console URL, with a new ticket per VM"""
+        fake_PEM_cert_to_DER_cert.return_value = b'someCert'
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.about.instanceUuid = 'someGuid'
+        fake_vcenter.content.sessionManager.AcquireCloneTicket.side_effect = ['ticket1', 'ticket2']
+        fake_vm = MagicMock()
+        fake_vm._moId = 'vm-1'
+
+        console_url = vmware._console_url_maker(fake_vcenter)
+        first = console_url(fake_vm, 'myEcs')
+        second = console_url(fake_vm, 'myEcs')
+
+        self.assertTrue('sessionTicket=ticket1' in first)
+        self.assertTrue('sessionTicket=ticket2' in second)
+        self.assertTrue('serverGuid=someGuid' in first)
+
+    @patch.object(vmware, 'vcenter_session')
+    def test_ping_vcenter(self, fake_vcenter_session):
+        """``ping_vcenter`` raises RuntimeError if the session isn't logged in"""
+        fake_vcenter = fake_vcenter_session.return_value.__enter__.return_value
+        fake_vcenter.content.sessionManager.currentSession = None
+
+        with self.assertRaises(RuntimeError):
+            vmware.ping_vcenter()
+
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_ecs(self, fake_vcenter_session, fake_find_ecs, fake_destroy_vms):
         """``delete_ecs`` returns None when everything works as expected"""
         fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'EcsBox'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta' : {'component': 'Ecs',
-                                                'created': 1234,
-                                                'version': '1.12',
-                                                'configured': False,
-                                                'generation': 1}}
+        fake_destroy_vms.return_value = {fake_find_ecs.return_value: None}
 
         output = vmware.delete_ecs(username='bob', machine_name='EcsBox', logger=fake_logger)
         expected = None
 
         self.assertEqual(output, expected)
+        the_args, _ = fake_destroy_vms.call_args
+        self.assertEqual(the_args[1], [fake_find_ecs.return_value])
 
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'power')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_delete_ecs_value_error(self, fake_vCenter, fake_consume_task, fake_power, fake_get_info):
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_ecs_value_error(self, fake_vcenter_session, fake_find_ecs, fake_destroy_vms):
         """``delete_ecs`` raises ValueError when unable to find requested vm for deletion"""
         fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'win10'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'note' : 'Ecs=1.0.0'}
+        fake_find_ecs.return_value = None
 
         with self.assertRaises(ValueError):
             vmware.delete_ecs(username='bob', machine_name='myOtherEcsBox', logger=fake_logger)
 
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_ecs_runtime_error(self, fake_vcenter_session, fake_find_ecs, fake_destroy_vms):
+        """``delete_ecs`` raises RuntimeError when the VM cannot be destroyed"""
+        fake_destroy_vms.return_value = {fake_find_ecs.return_value: 'testing'}
+
+        with self.assertRaises(RuntimeError):
+            vmware.delete_ecs(username='bob', machine_name='EcsBox', logger=MagicMock())
+
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_bulk_delete_ecs(self, fake_vcenter_session, fake_find_ecs, fake_destroy_vms):
+        """``bulk_delete_ecs`` destroys every VM together, and reports each VM on its own"""
+        vm1 = MagicMock()
+        fake_find_ecs.side_effect = lambda vcenter, username, machine_name: vm1 if machine_name == 'ecs1' else None
+        fake_destroy_vms.return_value = {vm1: None}
+
+        output = vmware.bulk_delete_ecs('bob', ['ecs1', 'ecs2'], MagicMock())
+        expected = {'ecs1': {'content': {}, 'error': None},
+                    'ecs2': {'content': {}, 'error': 'No ecs named ecs2 found'}}
+
+        self.assertEqual(output, expected)
+        self.assertEqual(fake_vcenter_session.call_count, 1)
+        self.assertEqual(fake_destroy_vms.call_count, 1)
+
+    def _fake_tasks(self, vms, failed=()):
+        """Make each VM return a task, and a ``wait_for_tasks`` result for those tasks"""
+        results = {}
+        for the_vm in vms:
+            for method in (the_vm.PowerOffVM_Task, the_vm.Destroy_Task):
+                task = MagicMock()
+                method.return_value = task
+                state = 'error' if method in failed else 'success'
+                results[task] = {'info.state': state, 'info.error': MagicMock(msg='testing')}
+        return lambda vcenter, tasks, timeout: {x: results[x] for x in tasks}
+
+    @patch.object(vmware.property_collector, 'wait_for_tasks')
+    @patch.object(vmware.property_collector, 'retrieve_many')
+    def test_destroy_vms(self, fake_retrieve_many, fake_wait_for_tasks):
+        """``_destroy_vms`` waits on all the power off, then all the destroy, tasks at once"""
+        vms = [MagicMock(), MagicMock()]
+        fake_retrieve_many.return_value = {x: {'runtime.powerState': 'poweredOn'} for x in vms}
+        fake_wait_for_tasks.side_effect = self._fake_tasks(vms)
+
+        output = vmware._destroy_vms(MagicMock(), vms, MagicMock())
+
+        self.assertEqual(output, {x: None for x in vms})
+        self.assertEqual(fake_wait_for_tasks.call_count, 2)
+        self.assertTrue(all(x.Destroy_Task.called for x in vms))
+
+    @patch.object(vmware.property_collector, 'wait_for_tasks')
+    @patch.object(vmware.property_collector, 'retrieve_many')
+    def test_destroy_vms_already_off(self, fake_retrieve_many, fake_wait_for_tasks):
+        """``_destroy_vms`` doesn't power off VMs that are already off"""
+        vm1, vm2 = MagicMock(), MagicMock()
+        fake_retrieve_many.return_value = {vm1: {'runtime.powerState': 'poweredOff'},
+                                           vm2: {'runtime.powerState': 'poweredOn'}}
+        fake_wait_for_tasks.side_effect = self._fake_tasks([vm1, vm2])
+
+        vmware._destroy_vms(MagicMock(), [vm1, vm2], MagicMock())
+
+        self.assertFalse(vm1.PowerOffVM_Task.called)
+        self.assertTrue(vm2.PowerOffVM_Task.called)
+        self.assertTrue(vm1.Destroy_Task.called)
+
+    @patch.object(vmware.property_collector, 'wait_for_tasks')
+    @patch.object(vmware.property_collector, 'retrieve_many')
+    def test_destroy_vms_power_off_fails(self, fake_retrieve_many, fake_wait_for_tasks):
+        """``_destroy_vms`` doesn't destroy a VM that failed to power off, and returns the error"""
+        vm1, vm2 = MagicMock(), MagicMock()
+        fake_retrieve_many.return_value = {x: {'runtime.powerState': 'poweredOn'} for x in (vm1, vm2)}
+        fake_wait_for_tasks.side_effect = self._fake_tasks([vm1, vm2], failed=[vm1.PowerOffVM_Task])
+
+        output = vmware._destroy_vms(MagicMock(), [vm1, vm2], MagicMock())
+
+        self.assertEqual(output, {vm1: 'testing', vm2: None})
+        self.assertFalse(vm1.Destroy_Task.called)
+        self.assertTrue(vm2.Destroy_Task.called)
+
+    def _fake_vcenter(self, the_vm, annotation):
+        """Make a vCenter that has a folder, containing the supplied VM"""
+        fake_vcenter = MagicMock()
+        fake_folder = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.side_effect = lambda entity, name: fake_folder if name == 'bob' else the_vm
+        prop = MagicMock()
+        prop.name = 'config.annotation'
+        prop.val = annotation
+        content = MagicMock()
+        content.propSet = [prop]
+        fake_vcenter.content.propertyCollector.RetrieveContents.return_value = [content]
+        return fake_vcenter
+
+    def test_find_ecs(self):
+        """``_find_ecs`` looks up the VM by name, and checks its notes say it's ECS"""
+        the_vm = vmware.vim.VirtualMachine('vm-1')
+        fake_vcenter = self._fake_vcenter(the_vm, '{"component": "Ecs"}')
+
+        output = vmware._find_ecs(fake_vcenter, 'bob', 'myEcs')
+
+        self.assertTrue(output is the_vm)
+        # No walking the folder, or reading every property of the VM
+        self.assertEqual(fake_vcenter.content.propertyCollector.RetrieveContents.call_count, 1)
+        self.assertFalse(fake_vcenter.get_by_name.called)
+
+    def test_find_ecs_not_ecs(self):
+        """``_find_ecs`` returns None if the VM isn't ECS"""
+        the_vm = vmware.vim.VirtualMachine('vm-1')
+        fake_vcenter = self._fake_vcenter(the_vm, '{"component": "OneFS"}')
+
+        output = vmware._find_ecs(fake_vcenter, 'bob', 'myEcs')
+
+        self.assertTrue(output is None)
+
+    def test_find_ecs_no_vm(self):
+        """``_find_ecs`` returns None if the user has nothing by that name"""
+        fake_vcenter = self._fake_vcenter(None, '{"component": "Ecs"}')
+
+        output = vmware._find_ecs(fake_vcenter, 'bob', 'myEcs')
+
+        self.assertTrue(output is None)
+
+    def test_find_ecs_folder_not_vm(self):
+        """``_find_ecs`` returns None if the name is a folder, not a VM"""
+        fake_vcenter = self._fake_vcenter(vmware.vim.Folder('group-v2'), '{"component": "Ecs"}')
+
+        output = vmware._find_ecs(fake_vcenter, 'bob', 'myEcs')
+
+        self.assertTrue(output is None)
+
+    def test_user_folder_fallback(self):
+        """``_user_folder`` searches the whole base folder if the user's folder isn't a direct child"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
+
+        output = vmware._user_folder(fake_vcenter, 'bob')
+
+        self.assertTrue(output is fake_vcenter.get_by_name.return_value)
+
+    @patch.object(vmware.property_collector, 'wait_for')
     @patch.object(vmware.virtual_machine, 'adjust_ram')
     @patch.object(vmware.virtual_machine, 'set_meta')
-    @patch.object(vmware, 'Ova')
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_ecs(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta, fake_adjust_ram):
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs(self, fake_image_catalog, fake_vcenter_session, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_set_meta, fake_adjust_ram, fake_wait_for):
         """``create_ecs`` returns a dictionary upon success"""
         fake_logger = MagicMock()
         fake_deploy_from_ova.return_value.name = 'EcsBox'
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.return_value.networks = ['someLAN']
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_image_catalog.CATALOG.open.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         output = vmware.create_ecs(username='alice',
                                    machine_name='EcsBox',
@@ -100,43 +292,45 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(vmware.property_collector, 'wait_for')
     @patch.object(vmware.virtual_machine, 'adjust_ram')
     @patch.object(vmware.virtual_machine, 'set_meta')
-    @patch.object(vmware, 'Ova')
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_ecs_ram(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta, fake_adjust_ram):
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_ram(self, fake_image_catalog, fake_vcenter_session, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_set_meta, fake_adjust_ram, fake_wait_for):
         """``create_ecs`` Sets the RAM of the new VM to 16GB"""
         fake_logger = MagicMock()
         fake_deploy_from_ova.return_value.name = 'EcsBox'
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.return_value.networks = ['someLAN']
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_image_catalog.CATALOG.open.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         vmware.create_ecs(username='alice',
                           machine_name='EcsBox',
                           image='1.0.0',
                           network='someLAN',
                           logger=fake_logger)
-        _, the_kwargs = fake_adjust_ram.call_args
-        ram_value = the_kwargs['mb_of_ram']
+        _, the_kwargs = fake_deploy_from_ova.return_value.ReconfigVM_Task.call_args
+        ram_value = the_kwargs['spec'].memoryMB
         expected_ram = 16384
 
         self.assertEqual(ram_value, expected_ram)
 
-    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.property_collector, 'wait_for')
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_ecs_invalid_network(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova):
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_invalid_network(self, fake_image_catalog, fake_vcenter_session, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_wait_for):
         """``create_ecs`` raises ValueError if supplied with a non-existing network"""
         fake_logger = MagicMock()
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.return_value.networks = ['someLAN']
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_image_catalog.CATALOG.open.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         with self.assertRaises(ValueError):
             vmware.create_ecs(username='alice',
@@ -145,17 +339,18 @@ class TestVMware(unittest.TestCase):
                                   network='someOtherLAN',
                                   logger=fake_logger)
 
-    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.property_collector, 'wait_for')
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_ecs_bad_image(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova):
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_bad_image(self, fake_image_catalog, fake_vcenter_session, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_wait_for):
         """``create_ecs`` raises ValueError if supplied with a non-existing network"""
         fake_logger = MagicMock()
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.side_effect = FileNotFoundError('testing')
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_image_catalog.CATALOG.get.side_effect = KeyError('ECS-1.0.0.ova')
 
         with self.assertRaises(ValueError):
             vmware.create_ecs(username='alice',
@@ -164,10 +359,10 @@ class TestVMware(unittest.TestCase):
                                   network='someOtherLAN',
                                   logger=fake_logger)
 
-    @patch.object(vmware.os, 'listdir')
-    def test_list_images(self, fake_listdir):
+    @patch.object(vmware, 'image_catalog')
+    def test_list_images(self, fake_image_catalog):
         """``list_images`` - Returns a list of available Ecs versions that can be deployed"""
-        fake_listdir.return_value = ['3.2.2']
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova']
 
         output = vmware.list_images()
         expected = ['3.2.2']
@@ -175,6 +370,410 @@ class TestVMware(unittest.TestCase):
         # set() avoids ordering issue in test
         self.assertEqual(set(output), set(expected))
 
+    @patch.object(vmware.property_collector, 'wait_for')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_bad_image_no_vcenter(self, fake_image_catalog, fake_vcenter_session, fake_wait_for):
+        """``create_ecs`` rejects an invalid version without connecting to vCenter"""
+        fake_image_catalog.CATALOG.get.side_effect = KeyError('ECS-1.0.0.ova')
+
+        with self.assertRaises(ValueError):
+            vmware.create_ecs(username='alice',
+                              machine_name='EcsBox',
+                              image='1.0.0',
+                              network='someLAN',
+                              logger=MagicMock())
+
+        self.assertFalse(fake_vcenter_session.called)
+
+    @patch.object(vmware.property_collector, 'wait_for')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_image_deleted(self, fake_image_catalog, fake_vcenter_session, fake_wait_for):
+        """``create_ecs`` raises ValueError if the image is deleted before it's opened"""
+        fake_image_catalog.CATALOG.open.side_effect = FileNotFoundError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.create_ecs(username='alice',
+                              machine_name='EcsBox',
+                              image='1.0.0',
+                              network='someLAN',
+                              logger=MagicMock())
+
+    @patch.object(vmware.property_collector, 'wait_for')
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_DEPLOY_MODE='clone'))
+    @patch.object(vmware, 'vm_spec')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'templates')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_clone(self, fake_image_catalog, fake_vcenter_session, fake_templates, fake_deploy_from_ova, fake_get_info, fake_set_meta, fake_vm_spec, fake_wait_for):
+        """``create_ecs`` clones the base VM of the version, instead of importing the OVA"""
+        fake_templates.clone.return_value.name = 'EcsBox'
+        fake_get_info.return_value = {'worked': True}
+
+        output = vmware.create_ecs(username='alice',
+                                   machine_name='EcsBox',
+                                   image='1.0.0',
+                                   network='someLAN',
+                                   logger=MagicMock())
+        expected = {'EcsBox' : {'worked': True}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_deploy_from_ova.called)
+        self.assertFalse(fake_templates.create_template.called)
+        # The network and meta data are set as part of the clone
+        self.assertTrue(fake_templates.clone.call_args[1]['config'] is fake_vm_spec.config_spec.return_value)
+
+    @patch.object(vmware.property_collector, 'wait_for')
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_DEPLOY_MODE='clone'))
+    @patch.object(vmware, 'vm_spec')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'templates')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_makes_template(self, fake_image_catalog, fake_vcenter_session, fake_templates, fake_deploy_from_ova, fake_get_info, fake_set_meta, fake_vm_spec, fake_wait_for):
+        """``create_ecs`` makes the base VM of a version if there isn't one yet"""
+        fake_templates.get_template.return_value = None
+        fake_image_catalog.CATALOG.open.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_ecs(username='alice',
+                          machine_name='EcsBox',
+                          image='1.0.0',
+                          network='someLAN',
+                          logger=MagicMock())
+        template = fake_templates.clone.call_args[0][1]
+
+        self.assertTrue(template is fake_templates.create_template.return_value)
+        self.assertTrue(fake_image_catalog.CATALOG.open.return_value.close.called)
+
+    @patch.object(vmware.property_collector, 'wait_for')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_DEPLOY_MODE='clone'))
+    @patch.object(vmware.virtual_machine, 'adjust_ram')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'templates')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_clone_fallback(self, fake_image_catalog, fake_vcenter_session, fake_templates, fake_deploy_from_ova, fake_get_info, fake_set_meta, fake_adjust_ram, fake_consume_task, fake_wait_for):
+        """``create_ecs`` imports the OVA if the base VM can't be made"""
+        fake_templates.get_template.return_value = None
+        fake_templates.create_template.side_effect = RuntimeError('testing')
+        fake_image_catalog.CATALOG.open.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_ecs(username='alice',
+                          machine_name='EcsBox',
+                          image='1.0.0',
+                          network='someLAN',
+                          logger=MagicMock())
+
+        self.assertTrue(fake_deploy_from_ova.called)
+        self.assertFalse(fake_templates.clone.called)
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'templates')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_sync_templates(self, fake_image_catalog, fake_vcenter_session, fake_templates, fake_consume_task):
+        """``sync_templates`` destroys the base VMs of removed and replaced images"""
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova']
+        fake_image_catalog.CATALOG.get.return_value.mtime = 2
+        current, replaced, removed = MagicMock(), MagicMock(), MagicMock()
+        current.name, replaced.name, removed.name = 'current', 'replaced', 'removed'
+        fake_templates.find_templates.return_value = [(current, {'version': '3.2.2', 'image_mtime': 2}),
+                                                      (replaced, {'version': '3.2.2', 'image_mtime': 1}),
+                                                      (removed, {'version': '3.1.0', 'image_mtime': 2})]
+        fake_templates.users.return_value = {}
+
+        output = vmware.sync_templates(MagicMock())
+        expected = {'removed': ['replaced', 'removed'], 'kept': ['current']}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(current.Destroy_Task.called)
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'templates')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_sync_templates_in_use(self, fake_image_catalog, fake_vcenter_session, fake_templates, fake_consume_task):
+        """``sync_templates`` does not destroy a base VM that linked clones use"""
+        fake_image_catalog.CATALOG.names.return_value = []
+        old = MagicMock()
+        old.name = 'old'
+        fake_templates.find_templates.return_value = [(old, {'version': '3.2.2', 'image_mtime': 1})]
+        fake_templates.users.return_value = {old: ['myEcs']}
+
+        output = vmware.sync_templates(MagicMock())
+        expected = {'removed': [], 'kept': ['old']}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(old.Destroy_Task.called)
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'templates')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_sync_templates_destroy_error(self, fake_image_catalog, fake_vcenter_session, fake_templates, fake_consume_task):
+        """``sync_templates`` keeps a base VM it fails to destroy"""
+        fake_image_catalog.CATALOG.names.return_value = []
+        old = MagicMock()
+        old.name = 'old'
+        fake_templates.find_templates.return_value = [(old, {'version': '3.2.2', 'image_mtime': 1})]
+        fake_templates.users.return_value = {old: []}
+        fake_consume_task.side_effect = RuntimeError('file is locked')
+
+        output = vmware.sync_templates(MagicMock())
+        expected = {'removed': [], 'kept': ['old']}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware.property_collector, 'wait_for')
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=2))
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_pool(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_deploy_from_ova, fake_get_info, fake_set_meta, fake_wait_for):
+        """``create_ecs`` hands over a VM from the warm pool, instead of deploying one"""
+        fake_warm_pool.claim.return_value.name = 'EcsBox'
+        fake_get_info.return_value = {'worked': True}
+
+        output = vmware.create_ecs(username='alice',
+                                   machine_name='EcsBox',
+                                   image='1.0.0',
+                                   network='someLAN',
+                                   logger=MagicMock())
+        expected = {'EcsBox' : {'worked': True}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_deploy_from_ova.called)
+
+    @patch.object(vmware.property_collector, 'wait_for')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=2))
+    @patch.object(vmware.virtual_machine, 'adjust_ram')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_pool_empty(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_deploy_from_ova, fake_get_info, fake_set_meta, fake_adjust_ram, fake_consume_task, fake_wait_for):
+        """``create_ecs`` deploys a new VM when the warm pool is empty"""
+        fake_warm_pool.claim.return_value = None
+        fake_image_catalog.CATALOG.open.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_ecs(username='alice',
+                          machine_name='EcsBox',
+                          image='1.0.0',
+                          network='someLAN',
+                          logger=MagicMock())
+
+        self.assertTrue(fake_deploy_from_ova.called)
+
+    def _pool_vm(self, component='EcsPool', version='3.2.2', image_mtime=1, name='a'):
+        meta = {'component': component, 'version': version, 'image_mtime': image_mtime}
+        return MagicMock(), meta, {'name': name, 'config.changeVersion': '1'}
+
+    def _fake_warm_pool(self, fake_warm_pool):
+        fake_warm_pool.POOL_COMPONENT = warm_pool.POOL_COMPONENT
+        fake_warm_pool.CLAIMED_COMPONENT = warm_pool.CLAIMED_COMPONENT
+        fake_warm_pool.DEPLOYING_COMPONENT = warm_pool.DEPLOYING_COMPONENT
+        fake_warm_pool.is_abandoned.return_value = False
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=2))
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, '_new_ecs')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_refill_pool(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_new_ecs, fake_destroy_vms):
+        """``refill_pool`` reports how many VMs the pool of every version is missing, without deploying any"""
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova', 'ECS-3.1.0.ova']
+        fake_image_catalog.CATALOG.get.return_value.mtime = 1
+        self._fake_warm_pool(fake_warm_pool)
+        fake_warm_pool.find_pooled.return_value = [self._pool_vm()]
+
+        output = vmware.refill_pool(MagicMock())
+        expected = {'3.2.2': {'ready': 1, 'deploying': 0, 'missing': 1},
+                    '3.1.0': {'ready': 0, 'deploying': 0, 'missing': 2}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_new_ecs.called)
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=2))
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_refill_pool_deploying(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_destroy_vms):
+        """``refill_pool`` counts VMs that are still being deployed"""
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova']
+        fake_image_catalog.CATALOG.get.return_value.mtime = 1
+        self._fake_warm_pool(fake_warm_pool)
+        fake_warm_pool.find_pooled.return_value = [self._pool_vm(),
+                                                   self._pool_vm(component=warm_pool.DEPLOYING_COMPONENT)]
+
+        output = vmware.refill_pool(MagicMock())
+
+        self.assertEqual(output['3.2.2']['missing'], 0)
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=1))
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_refill_pool_trim(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_destroy_vms):
+        """``refill_pool`` destroys ready VMs beyond the size of the pool"""
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova']
+        fake_image_catalog.CATALOG.get.return_value.mtime = 1
+        self._fake_warm_pool(fake_warm_pool)
+        keep = self._pool_vm(name='a')
+        extra = self._pool_vm(name='b')
+        fake_warm_pool.find_pooled.return_value = [keep, extra]
+        fake_warm_pool.take.return_value = True
+
+        output = vmware.refill_pool(MagicMock())
+        the_args, _ = fake_destroy_vms.call_args
+
+        self.assertEqual(the_args[1], [extra[0]])
+        self.assertEqual(output['3.2.2'], {'ready': 1, 'deploying': 0, 'missing': 0})
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=1))
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_refill_pool_trim_claimed(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_destroy_vms):
+        """``refill_pool`` doesn't destroy an extra VM that a create claimed first"""
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova']
+        fake_image_catalog.CATALOG.get.return_value.mtime = 1
+        self._fake_warm_pool(fake_warm_pool)
+        fake_warm_pool.find_pooled.return_value = [self._pool_vm(name='a'), self._pool_vm(name='b')]
+        fake_warm_pool.take.return_value = False
+
+        vmware.refill_pool(MagicMock())
+        the_args, _ = fake_destroy_vms.call_args
+
+        self.assertEqual(the_args[1], [])
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=1))
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_refill_pool_stale(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_destroy_vms):
+        """``refill_pool`` destroys pooled VMs of replaced images"""
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova']
+        fake_image_catalog.CATALOG.get.return_value.mtime = 2
+        self._fake_warm_pool(fake_warm_pool)
+        stale = self._pool_vm(image_mtime=1)
+        fake_warm_pool.find_pooled.return_value = [stale]
+
+        output = vmware.refill_pool(MagicMock(), version='3.2.2')
+        the_args, _ = fake_destroy_vms.call_args
+
+        self.assertEqual(the_args[1], [stale[0]])
+        self.assertEqual(output, {'3.2.2': {'ready': 0, 'deploying': 0, 'missing': 1}})
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=1))
+    @patch.object(vmware, '_new_ecs')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_add_to_pool(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_new_ecs):
+        """``add_to_pool`` deploys one VM into the pool"""
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova']
+        fake_image_catalog.CATALOG.get.return_value.mtime = 1
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {vmware.const.VLAB_ECS_WARM_POOL_NETWORK: 'aNetwork'}
+        self._fake_warm_pool(fake_warm_pool)
+        fake_warm_pool.find_pooled.return_value = []
+        fake_warm_pool.pooled_name.return_value = 'ECS-3.2.2-pool-1-abc'
+
+        output = vmware.add_to_pool('3.2.2', MagicMock())
+
+        self.assertEqual(output, 'ECS-3.2.2-pool-1-abc')
+        self.assertEqual(fake_new_ecs.call_count, 1)
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_ECS_WARM_POOL_SIZE=1))
+    @patch.object(vmware, '_new_ecs')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_add_to_pool_full(self, fake_image_catalog, fake_vcenter_session, fake_warm_pool, fake_new_ecs):
+        """``add_to_pool`` does nothing when another refill already filled the pool"""
+        fake_image_catalog.CATALOG.names.return_value = ['ECS-3.2.2.ova']
+        fake_image_catalog.CATALOG.get.return_value.mtime = 1
+        self._fake_warm_pool(fake_warm_pool)
+        fake_warm_pool.find_pooled.return_value = [self._pool_vm(component=warm_pool.DEPLOYING_COMPONENT)]
+
+        output = vmware.add_to_pool('3.2.2', MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_new_ecs.called)
+
+    @patch.object(vmware.property_collector, 'wait_for')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vcenter_session')
+    @patch.object(vmware, 'image_catalog')
+    def test_create_ecs_waits_for_ip(self, fake_image_catalog, fake_vcenter_session, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_wait_for):
+        """``create_ecs`` waits on guest updates for an IP, instead of having ``get_info`` poll"""
+        fake_image_catalog.CATALOG.open.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_ecs(username='alice',
+                          machine_name='EcsBox',
+                          image='1.0.0',
+                          network='someLAN',
+                          logger=MagicMock())
+        the_args, _ = fake_wait_for.call_args
+
+        self.assertEqual(the_args[2], ['guest.net'])
+        self.assertFalse(fake_get_info.call_args[1].get('ensure_ip'))
+
+    def test_has_ip(self):
+        """``_has_ip`` is True once the guest reports an IP"""
+        fake_nic = MagicMock()
+        fake_nic.ipAddress = ['192.168.1.2']
+
+        self.assertTrue(vmware._has_ip({'guest.net': [fake_nic]}))
+
+    def test_has_ip_no_ip(self):
+        """``_has_ip`` is False while the guest has no IP"""
+        fake_nic = MagicMock()
+        fake_nic.ipAddress = []
+
+        self.assertFalse(vmware._has_ip({'guest.net': [fake_nic]}))
+        self.assertFalse(vmware._has_ip({}))
+
+    def test_has_ip_none(self):
+        """``_has_ip`` is False when the update sets 'guest.net' to None"""
+        self.assertFalse(vmware._has_ip({'guest.net': None}))
+
+    def test_make_info_unset(self):
+        """``_make_info`` handles 'guest.net' and 'network' that are None"""
+        fake_vm = MagicMock()
+        fake_vm._moId = 'vm-1'
+        props = {'name': 'Ecs', 'runtime.powerState': 'poweredOff', 'guest.net': None, 'network': None}
+
+        output = vmware._make_info(fake_vm, props, {}, {}, lambda the_vm, name: 'https://some-console-url')
+
+        self.assertEqual(output['ips'], [])
+        self.assertEqual(output['networks'], [])
+
     def test_convert_name(self):
         """``convert_name`` - defaults to converting to the OVA file name"""
         output = vmware.convert_name(name='3.2.2')
@@ -190,40 +789,26 @@ class TestVMware(unittest.TestCase):
         self.assertEqual(output, expected)
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_update_network(self, fake_vcenter_session, fake_find_ecs, fake_change_network):
         """``update_network`` Returns None upon success"""
-        fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'myEcs'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'Ecs'}}
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
 
         result = vmware.update_network(username='pat',
                                        machine_name='myEcs',
                                        new_network='wootTown')
 
         self.assertTrue(result is None)
+        fake_change_network.assert_called_with(fake_find_ecs.return_value, 'someNetworkObject')
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network_no_vm(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_update_network_no_vm(self, fake_vcenter_session, fake_find_ecs, fake_change_network):
         """``update_network`` Raises ValueError if the supplied VM doesn't exist"""
-        fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'myEcs'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'Ecs'}}
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
+        fake_find_ecs.return_value = None
 
         with self.assertRaises(ValueError):
             vmware.update_network(username='pat',
@@ -231,19 +816,11 @@ class TestVMware(unittest.TestCase):
                                   new_network='wootTown')
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network_no_network(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_update_network_no_network(self, fake_vcenter_session, fake_find_ecs, fake_change_network):
         """``update_network`` Raises ValueError if the supplied new network doesn't exist"""
-        fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'myEcs'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'Ecs'}}
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
 
         with self.assertRaises(ValueError):
             vmware.update_network(username='pat',
@@ -251,17 +828,14 @@ class TestVMware(unittest.TestCase):
                                   new_network='dohNet')
 
     @patch.object(vmware.virtual_machine, 'set_meta')
-    @patch.object(vmware, 'vCenter')
-    def test_set_meta(self, fake_vCenter, fake_set_meta):
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_set_meta(self, fake_vcenter_session, fake_find_ecs, fake_set_meta):
         """``set_meta`` Connects to vCenter and updates the VMs meta-data"""
-        fake_vm = MagicMock()
-        fake_vm.name = 'Ecs'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
+        fake_vm = fake_find_ecs.return_value
         fake_meta_data = {'some_data': True}
 
-        vmware.set_meta('alice', fake_vm.name, fake_meta_data)
+        vmware.set_meta('alice', 'Ecs', fake_meta_data)
 
         the_args, _ = fake_set_meta.call_args
         sent_vm = the_args[0]
@@ -270,6 +844,16 @@ class TestVMware(unittest.TestCase):
         self.assertTrue(fake_vm is sent_vm)
         self.assertTrue(fake_meta_data is sent_data)
 
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, '_find_ecs')
+    @patch.object(vmware, 'vcenter_session')
+    def test_set_meta_no_vm(self, fake_vcenter_session, fake_find_ecs, fake_set_meta):
+        """``set_meta`` does nothing if the user has no ECS VM by that name"""
+        fake_find_ecs.return_value = None
+
+        vmware.set_meta('alice', 'Ecs', {'some_data': True})
+
+        self.assertFalse(fake_set_meta.called)
 
 if __name__ == '__main__':
     unittest.main()
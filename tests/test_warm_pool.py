@@ -0,0 +1,248 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``warm_pool.py`` module"""
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_ecs_api.lib.worker import warm_pool
+
+
+class TestPoolStats(unittest.TestCase):
+    """A set of test cases for the ``PoolStats`` object"""
+
+    def test_stats(self):
+        """``PoolStats`` - reports the hit rate and refill latency"""
+        stats = warm_pool.PoolStats()
+        stats.hit()
+        stats.hit()
+        stats.hit()
+        stats.miss()
+        stats.refilled(10)
+        stats.refilled(20)
+        stats.set_size('3.2.2', 2)
+
+        output = stats.stats()
+        expected = {'size': {'3.2.2': 2},
+                    'hits': 3,
+                    'misses': 1,
+                    'hit_rate': 0.75,
+                    'refills': 2,
+                    'refill_seconds_avg': 15,
+                    'refill_seconds_last': 20}
+
+        self.assertEqual(output, expected)
+
+    def test_stats_empty(self):
+        """``PoolStats`` - has no hit rate before any creates"""
+        output = warm_pool.PoolStats().stats()
+
+        self.assertEqual(output['hit_rate'], None)
+
+
+class TestWarmPool(unittest.TestCase):
+    """A set of test cases for the ``warm_pool.py`` module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.stats = warm_pool.PoolStats()
+        patcher = patch.object(warm_pool, 'STATS', self.stats)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _pooled(self, version='3.2.2', image_mtime=1, component=warm_pool.POOL_COMPONENT):
+        the_vm = MagicMock()
+        meta = {'component': component, 'version': version, 'image_mtime': image_mtime}
+        props = {'name': 'ECS-{}-pool-abc'.format(version), 'config.changeVersion': '2020-01-01'}
+        return the_vm, meta, props
+
+    def _vcenter(self):
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
+        return fake_vcenter
+
+    def test_pooled_name(self):
+        """``pooled_name`` makes unique, valid machine names"""
+        names = {warm_pool.pooled_name('3.2.2') for _ in range(10)}
+
+        self.assertEqual(len(names), 10)
+        for name in names:
+            self.assertTrue(warm_pool.templates.MACHINE_NAME_REGEX.match(name))
+
+    @patch.object(warm_pool, 'pool_folder')
+    @patch.object(warm_pool, 'property_collector')
+    def test_find_pooled(self, fake_property_collector, fake_pool_folder):
+        """``find_pooled`` returns pooled and claimed VMs, but not VMs it didn't make"""
+        fake_property_collector.retrieve_children.return_value = [
+            (MagicMock(), {'name': 'a', 'config.annotation': '{"component": "EcsPool"}'}),
+            (MagicMock(), {'name': 'b', 'config.annotation': '{"component": "EcsPoolClaimed"}'}),
+            (MagicMock(), {'name': 'c', 'config.annotation': ''}),
+        ]
+
+        output = [x[2]['name'] for x in warm_pool.find_pooled(MagicMock())]
+
+        self.assertEqual(output, ['a', 'b'])
+
+    @patch.object(warm_pool, 'pool_folder')
+    @patch.object(warm_pool, 'property_collector')
+    def test_find_pooled_deploying(self, fake_property_collector, fake_pool_folder):
+        """``find_pooled`` returns VMs that are still being deployed, with the version and time from their name"""
+        name = warm_pool.pooled_name('3.2.2')
+        fake_property_collector.retrieve_children.return_value = [(MagicMock(), {'name': name})]
+
+        _, meta, _ = warm_pool.find_pooled(MagicMock())[0]
+
+        self.assertEqual(meta['component'], warm_pool.DEPLOYING_COMPONENT)
+        self.assertEqual(meta['version'], '3.2.2')
+        self.assertFalse(warm_pool.is_abandoned(meta))
+
+    def test_is_abandoned_deploying(self):
+        """``is_abandoned`` is True for a deploy that started long ago, but never finished"""
+        meta = {'component': warm_pool.DEPLOYING_COMPONENT, 'created': time.time() - warm_pool.CLAIM_TIMEOUT - 1}
+
+        self.assertTrue(warm_pool.is_abandoned(meta))
+
+    def test_is_abandoned(self):
+        """``is_abandoned`` is True for a VM claimed long ago"""
+        meta = {'component': warm_pool.CLAIMED_COMPONENT, 'claimed': time.time() - warm_pool.CLAIM_TIMEOUT - 1}
+
+        self.assertTrue(warm_pool.is_abandoned(meta))
+
+    def test_is_abandoned_handed_over(self):
+        """``is_abandoned`` is True for a VM given the user's meta data long ago, but never moved"""
+        meta = {'component': 'Ecs', 'created': time.time() - warm_pool.CLAIM_TIMEOUT - 1}
+
+        self.assertTrue(warm_pool.is_abandoned(meta))
+
+    def test_is_abandoned_pooled(self):
+        """``is_abandoned`` is False for a VM waiting in the pool"""
+        meta = {'component': warm_pool.POOL_COMPONENT}
+
+        self.assertFalse(warm_pool.is_abandoned(meta))
+
+    @patch.object(warm_pool, 'vm_spec')
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'find_pooled')
+    def test_claim(self, fake_find_pooled, fake_consume_task, fake_vm_spec):
+        """``claim`` renames the pooled VM, and changes its network and meta data in one reconfigure, then moves it to the user"""
+        the_vm, meta, props = self._pooled()
+        fake_find_pooled.return_value = [(the_vm, meta, props)]
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
+        user_folder = fake_vcenter.get_by_name.return_value
+
+        output = warm_pool.claim(fake_vcenter, '3.2.2', 1, 'alice', 'myEcs', 'someNetwork', {'component': 'Ecs'}, MagicMock())
+
+        self.assertTrue(output is the_vm)
+        fake_vm_spec.config_spec.assert_called_with(meta_data={'component': 'Ecs'},
+                                                    name='myEcs',
+                                                    nic=fake_vm_spec.nic_change.return_value)
+        user_folder.MoveIntoFolder_Task.assert_called_with([the_vm])
+        self.assertEqual(self.stats.stats()['hits'], 1)
+
+    @patch.object(warm_pool, 'vm_spec')
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'find_pooled')
+    def test_claim_change_version(self, fake_find_pooled, fake_consume_task, fake_vm_spec):
+        """``claim`` only marks the VM if no one else changed it first"""
+        the_vm, meta, props = self._pooled()
+        fake_find_pooled.return_value = [(the_vm, meta, props)]
+
+        warm_pool.claim(self._vcenter(), '3.2.2', 1, 'alice', 'myEcs', 'someNetwork', {'component': 'Ecs'}, MagicMock())
+        spec = the_vm.ReconfigVM_Task.call_args_list[0][1]['spec']
+
+        self.assertEqual(spec.changeVersion, '2020-01-01')
+
+    @patch.object(warm_pool, 'vm_spec')
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'find_pooled')
+    def test_claim_race(self, fake_find_pooled, fake_consume_task, fake_vm_spec):
+        """``claim`` moves on to the next pooled VM if another worker claimed the first one"""
+        first = self._pooled()
+        second = self._pooled()
+        fake_find_pooled.return_value = [first, second]
+        fake_consume_task.side_effect = [RuntimeError('changeVersion mismatch'), None, None, None]
+
+        output = warm_pool.claim(self._vcenter(), '3.2.2', 1, 'alice', 'myEcs', 'someNetwork', {'component': 'Ecs'}, MagicMock())
+
+        self.assertTrue(output is second[0])
+
+    @patch.object(warm_pool, 'vm_spec')
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'find_pooled')
+    def test_claim_empty(self, fake_find_pooled, fake_consume_task, fake_vm_spec):
+        """``claim`` returns None when the pool has no VM of the version"""
+        fake_find_pooled.return_value = [self._pooled(version='3.1.0'),
+                                         self._pooled(image_mtime=0),
+                                         self._pooled(component=warm_pool.CLAIMED_COMPONENT)]
+
+        output = warm_pool.claim(self._vcenter(), '3.2.2', 1, 'alice', 'myEcs', 'someNetwork', {'component': 'Ecs'}, MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertEqual(self.stats.stats()['misses'], 1)
+
+    @patch.object(warm_pool, 'vm_spec')
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'find_pooled')
+    def test_claim_handover_fails(self, fake_find_pooled, fake_consume_task, fake_vm_spec):
+        """``claim`` destroys the VM, and returns None, if it can't hand the VM over"""
+        the_vm, meta, props = self._pooled()
+        fake_find_pooled.return_value = [(the_vm, meta, props)]
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
+        fake_consume_task.side_effect = [None, None, RuntimeError('DuplicateName'), None]
+
+        output = warm_pool.claim(fake_vcenter, '3.2.2', 1, 'alice', 'myEcs', 'someNetwork', {'component': 'Ecs'}, MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertTrue(the_vm.Destroy_Task.called)
+
+    @patch.object(warm_pool, 'vm_spec')
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'find_pooled')
+    def test_claim_destroy_fails(self, fake_find_pooled, fake_consume_task, fake_vm_spec):
+        """``claim`` still returns None, so a normal deploy happens, if it can't destroy a VM it couldn't hand over"""
+        fake_find_pooled.return_value = [self._pooled()]
+        fake_consume_task.side_effect = [None, None, RuntimeError('DuplicateName'), RuntimeError('InvalidState')]
+
+        output = warm_pool.claim(self._vcenter(), '3.2.2', 1, 'alice', 'myEcs', 'someNetwork', {'component': 'Ecs'}, MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertEqual(self.stats.stats()['misses'], 1)
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'find_pooled')
+    def test_claim_name_taken(self, fake_find_pooled, fake_consume_task):
+        """``claim`` raises ValueError, without claiming a VM, when the user already has a VM by that name"""
+        fake_find_pooled.return_value = [self._pooled()]
+
+        with self.assertRaises(ValueError):
+            warm_pool.claim(MagicMock(), '3.2.2', 1, 'alice', 'myEcs', 'someNetwork', {'component': 'Ecs'}, MagicMock())
+
+        self.assertFalse(fake_consume_task.called)
+
+    @patch.object(warm_pool, 'consume_task')
+    def test_take(self, fake_consume_task):
+        """``take`` returns True when it marked the VM"""
+        the_vm, _, props = self._pooled()
+
+        self.assertTrue(warm_pool.take(the_vm, props, {'component': warm_pool.CLAIMED_COMPONENT}))
+
+    @patch.object(warm_pool, 'consume_task')
+    def test_take_race(self, fake_consume_task):
+        """``take`` returns False when the VM changed since its properties were read"""
+        the_vm, _, props = self._pooled()
+        fake_consume_task.side_effect = RuntimeError('changeVersion mismatch')
+
+        self.assertFalse(warm_pool.take(the_vm, props, {'component': warm_pool.CLAIMED_COMPONENT}))
+
+    @patch.object(warm_pool, 'find_pooled')
+    def test_claim_bad_name(self, fake_find_pooled):
+        """``claim`` raises ValueError for an invalid machine name, without claiming a VM"""
+        with self.assertRaises(ValueError):
+            warm_pool.claim(MagicMock(), '3.2.2', 1, 'alice', 'my_ecs!', 'someNetwork', {'component': 'Ecs'}, MagicMock())
+
+        self.assertFalse(fake_find_pooled.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,15 +2,17 @@
 from flask import Flask
 from celery import Celery
 
-from vlab_ecs_api.lib import const
-from vlab_ecs_api.lib.views import HealthView, EcsView
+from vlab_ecs_api.lib import const, celery_config
+from vlab_ecs_api.lib.views import HealthView, EcsView, MetricsView
 
 app = Flask(__name__)
-app.celery_app = Celery('ecs', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+app.celery_app = Celery('ecs', broker=const.VLAB_MESSAGE_BROKER)
 app.celery_app.conf.broker_heartbeat = 0 #https://github.com/celery/celery/issues/4895
+celery_config.configure(app.celery_app)
 
 HealthView.register(app)
 EcsView.register(app)
+MetricsView.register(app)
 
 
 if __name__ == '__main__':
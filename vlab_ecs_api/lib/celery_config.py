@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+"""
+Celery settings shared by the API (which sends tasks) and the worker (which
+runs them), so both sides agree on where each task is queued.
+
+Tasks are split by how long they take, so a slow task never sits in front of
+a fast one:
+
+- ``VLAB_ECS_READ_QUEUE``: cheap lookups, like ``ecs.show`` and ``ecs.image``
+- ``VLAB_ECS_VCENTER_QUEUE``: changes made in vCenter, like deploying an OVA
+- ``VLAB_ECS_CONFIG_QUEUE``: ``ecs.config``, which spends nearly all of its
+  time waiting on SSH. The worker for that queue uses the thread pool; one
+  process can then drive many configurations at once.
+
+Concurrency and prefetch are set per worker (i.e. ``-c`` and
+``--prefetch-multiplier``), so each queue gets its own worker; see
+``docker-compose.yml``.
+
+Results are kept in a store that every API process can read, so any process
+behind a load balancer can answer the poll of any task. ``VLAB_ECS_RESULT_BACKEND``
+is a Celery result backend URL, i.e. ``redis://host:6379/0`` (the default),
+``file:///shared/dir``, or ``db+sqlite:///results.db`` for a single host (which
+needs SQLAlchemy; install ``vlab-ecs-api[sqlite]``).
+Results are deleted ``VLAB_ECS_RESULT_EXPIRES`` seconds after the task finishes.
+"""
+from kombu import Queue
+
+from vlab_ecs_api.lib import const
+
+
+# A message header; when it's set, a task returns how long each phase took in its ``params``
+TRACE_HEADER = 'vlab_trace'
+
+TASK_QUEUES = (
+    Queue(const.VLAB_ECS_READ_QUEUE),
+    Queue(const.VLAB_ECS_VCENTER_QUEUE),
+    Queue(const.VLAB_ECS_CONFIG_QUEUE),
+)
+
+TASK_ROUTES = {
+    'ecs.show': {'queue': const.VLAB_ECS_READ_QUEUE},
+    'ecs.image': {'queue': const.VLAB_ECS_READ_QUEUE},
+    'ecs.healthcheck': {'queue': const.VLAB_ECS_READ_QUEUE},
+    'ecs.bulk_results': {'queue': const.VLAB_ECS_READ_QUEUE},
+    'ecs.create': {'queue': const.VLAB_ECS_VCENTER_QUEUE},
+    'ecs.delete': {'queue': const.VLAB_ECS_VCENTER_QUEUE},
+    'ecs.bulk_delete': {'queue': const.VLAB_ECS_VCENTER_QUEUE},
+    'ecs.modify_network': {'queue': const.VLAB_ECS_VCENTER_QUEUE},
+    'ecs.sync_templates': {'queue': const.VLAB_ECS_VCENTER_QUEUE},
+    'ecs.refill_pool': {'queue': const.VLAB_ECS_VCENTER_QUEUE},
+    'ecs.add_to_pool': {'queue': const.VLAB_ECS_VCENTER_QUEUE},
+    'ecs.config': {'queue': const.VLAB_ECS_CONFIG_QUEUE},
+}
+
+# Only used when ``celery beat`` runs; retires base VMs of removed/replaced OVAs
+BEAT_SCHEDULE = {
+    'sync-templates': {'task': 'ecs.sync_templates',
+                       'schedule': 3600,
+                       'kwargs': {'txn_id': 'sync-templates'}},
+}
+# Creates refill the pool as they go; this catches new images and failed refills
+POOL_BEAT_SCHEDULE = {
+    'refill-pool': {'task': 'ecs.refill_pool',
+                    'schedule': 600,
+                    'kwargs': {'txn_id': 'refill-pool'}},
+}
+
+
+def configure(app):
+    """Apply the shared settings to a Celery app
+
+    :Returns: None
+
+    :param app: The Celery app that sends, or runs, the ECS tasks
+    :type app: celery.Celery
+    """
+    app.conf.result_backend = const.VLAB_ECS_RESULT_BACKEND
+    app.conf.result_expires = const.VLAB_ECS_RESULT_EXPIRES
+    # The API looks up the name of a finished task, to know if it changed a user's VMs
+    app.conf.result_extended = True
+    # The inventory in a result of ``ecs.show`` compresses well
+    app.conf.result_compression = const.VLAB_ECS_RESULT_COMPRESSION or None
+    app.conf.task_queues = TASK_QUEUES
+    app.conf.task_routes = TASK_ROUTES
+    # Anything not in TASK_ROUTES is cheap, until proven otherwise
+    app.conf.task_default_queue = const.VLAB_ECS_READ_QUEUE
+    beat_schedule = {}
+    if const.VLAB_ECS_DEPLOY_MODE == 'clone':
+        beat_schedule.update(BEAT_SCHEDULE)
+    if const.VLAB_ECS_WARM_POOL_SIZE:
+        beat_schedule.update(POOL_BEAT_SCHEDULE)
+    app.conf.beat_schedule = beat_schedule
+
+
+def queue_for(task_name):
+    """Look up which queue a task belongs on
+
+    :Returns: String
+
+    :param task_name: The registered name of the task, i.e. ``ecs.show``
+    :type task_name: String
+    """
+    return TASK_ROUTES.get(task_name, {}).get('queue', const.VLAB_ECS_READ_QUEUE)
@@ -10,6 +10,19 @@ from os import environ
 from collections import namedtuple, OrderedDict
 
 
+def _boolean(value):
+    """Environment variables are strings, so ``"false"`` would otherwise be truthy
+
+    :Returns: Boolean
+
+    :param value: The value of the environment variable, or its default
+    :type value: String or Boolean
+    """
+    if isinstance(value, bool):
+        return value
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 DEFINED = OrderedDict([
             ('VLAB_ECS_LOG_LEVEL', environ.get('VLAB_ECS_LOG_LEVEL', 'INFO')),
             ('INF_VCENTER_SERVER', environ.get('INF_VCENTER_SERVER', 'localhost')),
@@ -26,6 +39,30 @@ DEFINED = OrderedDict([
             ('VLAB_VERIFY_TOKEN', environ.get('VLAB_VERIFY_TOKEN', False)),
             ('VLAB_ECS_ADMIN', environ.get('VLAB_ECS_ADMIN', 'admin')),
             ('VLAB_ECS_ADMIN_PW', environ.get('VLAB_ECS_ADMIN_PW', 'ChangeMe')),
+            ('VLAB_ECS_VCENTER_POOL_SIZE', int(environ.get('VLAB_ECS_VCENTER_POOL_SIZE', 4))),
+            ('VLAB_ECS_VCENTER_IDLE_TIMEOUT', int(environ.get('VLAB_ECS_VCENTER_IDLE_TIMEOUT', 600))),
+            ('VLAB_ECS_VCENTER_CHECK_INTERVAL', int(environ.get('VLAB_ECS_VCENTER_CHECK_INTERVAL', 60))),
+            ('VLAB_ECS_INVENTORY_TTL', int(environ.get('VLAB_ECS_INVENTORY_TTL', 30))),
+            ('VLAB_ECS_INVENTORY_WATCH', _boolean(environ.get('VLAB_ECS_INVENTORY_WATCH', False))),
+            ('VLAB_ECS_IMAGE_CHECK_INTERVAL', int(environ.get('VLAB_ECS_IMAGE_CHECK_INTERVAL', 10))),
+            ('VLAB_ECS_DEPLOY_MODE', environ.get('VLAB_ECS_DEPLOY_MODE', 'ova')),
+            ('VLAB_ECS_TEMPLATE_DIR', environ.get('VLAB_ECS_TEMPLATE_DIR', 'vlab-ecs-templates')),
+            ('VLAB_ECS_FULL_CLONE', _boolean(environ.get('VLAB_ECS_FULL_CLONE', False))),
+            ('VLAB_ECS_WARM_POOL_SIZE', int(environ.get('VLAB_ECS_WARM_POOL_SIZE', 0))),
+            ('VLAB_ECS_WARM_POOL_DIR', environ.get('VLAB_ECS_WARM_POOL_DIR', 'vlab-ecs-pool')),
+            ('VLAB_ECS_WARM_POOL_NETWORK', environ.get('VLAB_ECS_WARM_POOL_NETWORK', 'vlab-ecs-pool')),
+            ('VLAB_ECS_RESPONSE_CACHE_TTL', int(environ.get('VLAB_ECS_RESPONSE_CACHE_TTL', 5))),
+            ('VLAB_ECS_RESPONSE_CACHE_MAX_STALE', int(environ.get('VLAB_ECS_RESPONSE_CACHE_MAX_STALE', 300))),
+            ('VLAB_ECS_SINGLE_FLIGHT_WINDOW', int(environ.get('VLAB_ECS_SINGLE_FLIGHT_WINDOW', 30))),
+            ('VLAB_ECS_HEALTH_TTL', int(environ.get('VLAB_ECS_HEALTH_TTL', 10))),
+            ('VLAB_ECS_HEALTH_TIMEOUT', int(environ.get('VLAB_ECS_HEALTH_TIMEOUT', 5))),
+            ('VLAB_ECS_METRICS_PORT', int(environ.get('VLAB_ECS_METRICS_PORT', 9102))),
+            ('VLAB_ECS_RESULT_BACKEND', environ.get('VLAB_ECS_RESULT_BACKEND', 'redis://ecs-results:6379/0')),
+            ('VLAB_ECS_RESULT_EXPIRES', int(environ.get('VLAB_ECS_RESULT_EXPIRES', 86400))),
+            ('VLAB_ECS_RESULT_COMPRESSION', environ.get('VLAB_ECS_RESULT_COMPRESSION', 'zlib')),
+            ('VLAB_ECS_READ_QUEUE', environ.get('VLAB_ECS_READ_QUEUE', 'ecs_read')),
+            ('VLAB_ECS_VCENTER_QUEUE', environ.get('VLAB_ECS_VCENTER_QUEUE', 'ecs_vcenter')),
+            ('VLAB_ECS_CONFIG_QUEUE', environ.get('VLAB_ECS_CONFIG_QUEUE', 'ecs_config')),
           ])
 
 Constants = namedtuple('Constants', list(DEFINED.keys()))
@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+"""
+Prometheus metrics, shared by the API (which sends tasks) and the worker (which
+runs them).
+
+The API serves its metrics on ``/metrics``. A worker serves its metrics on
+``VLAB_ECS_METRICS_PORT``, via an HTTP server started in the main worker
+process. Celery runs tasks in forked child processes, so set
+``PROMETHEUS_MULTIPROC_DIR`` for a prefork worker. Each child then writes its
+metrics to that directory, and the main process adds them all up.
+
+Nothing here changes how a task or function is called. Tasks are timed via
+Celery signals, and the functions in ``vmware.py`` are wrapped by ``timed``.
+"""
+import os
+import glob
+import time
+import functools
+
+from celery.signals import before_task_publish, task_prerun, task_postrun, task_failure, worker_process_shutdown
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, start_http_server
+from prometheus_client import multiprocess
+
+# Tasks range from a cached ecs.show, to an ecs.config that takes most of an hour
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+# The header the API adds to a task, so the worker knows how long it was queued
+SENT_AT_HEADER = 'vlab_sent_at'
+
+TASKS_SENT = Counter('vlab_ecs_tasks_sent_total',
+                     'Tasks sent to the workers',
+                     ['task'])
+TASK_DURATION = Histogram('vlab_ecs_task_duration_seconds',
+                          'How long a task took to run',
+                          ['task'],
+                          buckets=SLOW_BUCKETS)
+TASK_QUEUE_WAIT = Histogram('vlab_ecs_task_queue_wait_seconds',
+                            'How long a task waited in its queue before a worker started it',
+                            ['task'],
+                            buckets=SLOW_BUCKETS)
+VCENTER_CALL = Histogram('vlab_ecs_vcenter_call_seconds',
+                         'How long a call into vCenter (a function in vmware.py) took',
+                         ['function'],
+                         buckets=SLOW_BUCKETS)
+SSH_STAGE = Histogram('vlab_ecs_ssh_stage_seconds',
+                      'How long a stage of configuring ECS, over SSH, took',
+                      ['stage'],
+                      buckets=SLOW_BUCKETS)
+ERRORS = Counter('vlab_ecs_errors_total',
+                 'Errors, by where they happened and the type of exception',
+                 ['where', 'exception'])
+
+# task id -> time.perf_counter() when it started
+_started = {}
+
+
+def timed(func):
+    """Record how long every call to a function in ``vmware.py`` takes, and what it raises
+
+    :Returns: Function
+
+    :param func: The function to time
+    :type func: Function
+    """
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as doh:
+            ERRORS.labels(where=func.__name__, exception=type(doh).__name__).inc()
+            raise
+        finally:
+            VCENTER_CALL.labels(function=func.__name__).observe(time.perf_counter() - start)
+    return inner
+
+
+@before_task_publish.connect
+def _stamp_sent_at(sender=None, headers=None, **kwargs):
+    """Count every task sent, and note when it was sent"""
+    TASKS_SENT.labels(task=sender).inc()
+    if headers is not None:
+        headers[SENT_AT_HEADER] = time.time()
+
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    """Record how long the task was queued for, and start timing it"""
+    _started[task_id] = time.perf_counter()
+    sent_at = getattr(task.request, SENT_AT_HEADER, None)
+    # Tasks sent before this header existed don't have it
+    if isinstance(sent_at, (int, float)):
+        TASK_QUEUE_WAIT.labels(task=task.name).observe(max(time.time() - sent_at, 0))
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, retval=None, **kwargs):
+    """Record how long the task ran, and count the error it returned (if any)"""
+    start = _started.pop(task_id, None)
+    if start is not None:
+        TASK_DURATION.labels(task=task.name).observe(time.perf_counter() - start)
+    # Tasks catch the errors they expect, and return the message
+    if isinstance(retval, dict) and retval.get('error'):
+        ERRORS.labels(where=task.name, exception='TaskError').inc()
+
+
+@task_failure.connect
+def _task_failed(sender=None, exception=None, **kwargs):
+    """Count the exceptions that a task didn't catch"""
+    ERRORS.labels(where=sender.name, exception=type(exception).__name__).inc()
+
+
+@worker_process_shutdown.connect
+def _process_shutdown(pid=None, **kwargs):
+    """Stop reporting the gauges of a worker process that has exited"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def registry():
+    """Obtain the registry to serve metrics from
+
+    :Returns: prometheus_client.CollectorRegistry
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        a_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(a_registry)
+        return a_registry
+    return REGISTRY
+
+
+def start_worker_server(port):
+    """Serve the metrics of a worker, on a port of its own
+
+    :Returns: None
+
+    :param port: The TCP port to listen on
+    :type port: Integer
+    """
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        # The values of a previous run would be added to this one's
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(multiproc_dir, '*.db')):
+            os.remove(stale)
+    start_http_server(port, registry=registry())
@@ -0,0 +1,99 @@
+# -*- coding: UTF-8 -*-
+"""
+Generation counters that every API and worker process can see, kept in the
+Redis that also stores task results (``VLAB_ECS_RESULT_BACKEND``).
+
+The caches in this service live in each process. The process that changes
+something (i.e. an ``ecs-vcenter-worker`` deleting a VM) bumps a generation
+here, and every other process stops using what it cached under an older
+generation, even though it never saw the change happen.
+
+When the result backend isn't Redis there's nothing shared to keep them in, so
+the counters only live in the process; that's all a single host setup (i.e.
+``file://`` results and one worker) needs.
+"""
+import os
+import threading
+
+import redis
+from vlab_api_common import get_logger
+
+from vlab_ecs_api.lib import const
+
+logger = get_logger(__name__, loglevel=const.VLAB_ECS_LOG_LEVEL)
+
+PREFIX = 'vlab-ecs:generation:'
+# Nothing caches for anywhere near this long, so an expired counter (which
+# restarts at zero) can only ever cause a miss
+EXPIRES = 86400
+
+
+class Generations:
+    """Counters, by name, that go up whenever what they name changes
+
+    :param url: Where the counters are kept, i.e. ``redis://ecs-results:6379/0``
+    :type url: String
+    """
+    def __init__(self, url):
+        self._url = url
+        self._shared = url.startswith(('redis://', 'rediss://', 'unix://'))
+        self._lock = threading.Lock()
+        self._local = {}
+        self._client = None
+        self._pid = None
+
+    @property
+    def shared(self):
+        """True when other processes see the counters, False when they only live in this one"""
+        return self._shared
+
+    def _redis(self):
+        """The connection to Redis; a forked child makes its own
+
+        :Returns: redis.Redis
+        """
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._client = redis.Redis.from_url(self._url, socket_timeout=1, socket_connect_timeout=1)
+                self._pid = os.getpid()
+            return self._client
+
+    def get(self, name):
+        """Obtain the current generation
+
+        :Returns: Integer, or None if it couldn't be read (so nothing can be trusted)
+
+        :param name: What the counter is for, i.e. ``inventory:bob``
+        :type name: String
+        """
+        if not self._shared:
+            with self._lock:
+                return self._local.get(name, 0)
+        try:
+            return int(self._redis().get(PREFIX + name) or 0)
+        except redis.RedisError as doh:
+            logger.error('Unable to read generation {}: {}'.format(name, doh))
+            return None
+
+    def bump(self, name):
+        """Record that what a counter is for has changed
+
+        :Returns: None
+
+        :param name: What the counter is for, i.e. ``inventory:bob``
+        :type name: String
+        """
+        with self._lock:
+            self._local[name] = self._local.get(name, 0) + 1
+        if not self._shared:
+            return
+        try:
+            pipe = self._redis().pipeline()
+            pipe.incr(PREFIX + name)
+            pipe.expire(PREFIX + name, EXPIRES)
+            pipe.execute()
+        except redis.RedisError as doh:
+            logger.error('Unable to bump generation {}: {}'.format(name, doh))
+
+
+GENERATIONS = Generations(const.VLAB_ECS_RESULT_BACKEND)
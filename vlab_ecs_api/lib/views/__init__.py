@@ -1,3 +1,4 @@
 # -*- coding: UTF-8 -*-
 from .healthcheck import HealthView
 from .ecs import EcsView
+from .metrics import MetricsView
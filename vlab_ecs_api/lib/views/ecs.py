@@ -3,18 +3,25 @@
 Defines the RESTful API for the ECS service
 """
 import ujson
+from celery import chord
 from flask import current_app
 from flask_classy import request, route, Response
-from vlab_inf_common.views import MachineView
+from vlab_inf_common.views import MachineView, TaskView
 from vlab_inf_common.vmware import vCenter, vim
 from vlab_api_common import describe, get_logger, requires, validate_input
 
 
-from vlab_ecs_api.lib import const
+from vlab_ecs_api.lib import const, celery_config
+from vlab_ecs_api.lib.views.response_cache import RESPONSE_CACHE
+from vlab_ecs_api.lib.views.single_flight import SINGLE_FLIGHT
 
 
 logger = get_logger(__name__, loglevel=const.VLAB_ECS_LOG_LEVEL)
 
+# The tasks that change a user's ECS instances; their results mean a cached ``GET /ecs`` is out of date
+MUTATING_TASKS = frozenset(['ecs.create', 'ecs.delete', 'ecs.config', 'ecs.modify_network',
+                            'ecs.bulk_results', 'ecs.bulk_delete'])
+
 
 class EcsView(MachineView):
     """API end point manage ECS instances"""
@@ -80,19 +87,50 @@ class EcsView(MachineView):
                      "required": ["name", "ssh_port", "gateway_ip", "ecs_ip"]
                     }
 
+    BULK_POST_SCHEMA = { "$schema": "http://json-schema.org/draft-04/schema#",
+                         "type": "object",
+                         "description": "Create many Ecs instances, i.e. one per student in a class",
+                         "properties": {
+                            "names": {
+                                "description": "The names to give your Ecs instances",
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "minItems": 1,
+                                "uniqueItems": True
+                            },
+                            "image": {
+                                "description": "The image/version of Ecs to create",
+                                "type": "string"
+                            },
+                            "network": {
+                                "description": "The network to hook the Ecs instances up to",
+                                "type": "string"
+                            }
+                         },
+                         "required": ["names", "image", "network"]
+                       }
+    BULK_DELETE_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                          "description": "Destroy many Ecs instances",
+                          "type": "object",
+                          "properties": {
+                             "names": {
+                                 "description": "The names of the Ecs instances to destroy",
+                                 "type": "array",
+                                 "items": {"type": "string"},
+                                 "minItems": 1,
+                                 "uniqueItems": True
+                             }
+                          },
+                          "required": ["names"]
+                         }
+
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
     @describe(post=POST_SCHEMA, delete=DELETE_SCHEMA, get=GET_SCHEMA)
     def get(self, *args, **kwargs):
         """Display the ECS instances you own"""
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
-        resp_data = {'user' : username}
-        task = current_app.celery_app.send_task('ecs.show', [username, txn_id])
-        resp_data['content'] = {'task-id': task.id}
-        resp = Response(ujson.dumps(resp_data))
-        resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
-        return resp
+        return self._cached_read('ecs.show', [username], txn_id, ('ecs.show', username), username)
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
     @validate_input(schema=POST_SCHEMA)
@@ -105,7 +143,10 @@ class EcsView(MachineView):
         machine_name = body['name']
         image = body['image']
         network = '{}_{}'.format(username, body['network'])
-        task = current_app.celery_app.send_task('ecs.create', [username, machine_name, image, network, txn_id])
+        self._user_changed(username)
+        task = current_app.celery_app.send_task('ecs.create', [username, machine_name, image, network, txn_id],
+                                                queue=celery_config.queue_for('ecs.create'),
+                                                headers=_trace_headers())
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
@@ -120,7 +161,10 @@ class EcsView(MachineView):
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
         machine_name = kwargs['body']['name']
-        task = current_app.celery_app.send_task('ecs.delete', [username, machine_name, txn_id])
+        self._user_changed(username)
+        task = current_app.celery_app.send_task('ecs.delete', [username, machine_name, txn_id],
+                                                queue=celery_config.queue_for('ecs.delete'),
+                                                headers=_trace_headers())
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
@@ -134,13 +178,7 @@ class EcsView(MachineView):
         """Show available versions of Ecs that can be deployed"""
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
-        resp_data = {'user' : username}
-        task = current_app.celery_app.send_task('ecs.image', [txn_id])
-        resp_data['content'] = {'task-id': task.id}
-        resp = Response(ujson.dumps(resp_data))
-        resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
-        return resp
+        return self._cached_read('ecs.image', [], txn_id, ('ecs.image',), username)
 
     @route('/config', methods=["POST"])
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -156,9 +194,174 @@ class EcsView(MachineView):
         ecs_ip = kwargs['body']['ecs_ip']
         machine_name = kwargs['body']['name']
         resp_data = {'user' : username}
-        task = current_app.celery_app.send_task('ecs.config', [username, machine_name, ssh_port, gateway_ip, ecs_ip, txn_id])
+        self._user_changed(username)
+        task = current_app.celery_app.send_task('ecs.config', [username, machine_name, ssh_port, gateway_ip, ecs_ip, txn_id],
+                                                queue=celery_config.queue_for('ecs.config'),
+                                                headers=_trace_headers())
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
         resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
         return resp
+
+    @route('/bulk', methods=["POST"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(post=BULK_POST_SCHEMA)
+    @validate_input(schema=BULK_POST_SCHEMA)
+    def bulk_create(self, *args, **kwargs):
+        """Create many ECS instances, with one ``ecs.create`` task for each, and one task-id for them all"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        body = kwargs['body']
+        machine_names = body['names']
+        image = body['image']
+        network = '{}_{}'.format(username, body['network'])
+        self._user_changed(username)
+        celery_app = current_app.celery_app
+        # Every worker on the vCenter queue shares the creates, and each create has the full time limit.
+        # How many run at once is the concurrency of those workers, and each reuses the sessions in
+        # its process' pool, so the bulk create needs no limit or vCenter session of its own.
+        creates = [celery_app.signature('ecs.create', args=[username, x, image, network, txn_id],
+                                        kwargs={'bulk': True},
+                                        queue=celery_config.queue_for('ecs.create'),
+                                        headers=_trace_headers())
+                   for x in machine_names]
+        results = celery_app.signature('ecs.bulk_results', args=[machine_names, txn_id],
+                                       queue=celery_config.queue_for('ecs.bulk_results'))
+        task = chord(creates)(results)
+        resp_data['content'] = {'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        return resp
+
+    @route('/bulk', methods=["DELETE"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(delete=BULK_DELETE_SCHEMA)
+    @validate_input(schema=BULK_DELETE_SCHEMA)
+    def bulk_delete(self, *args, **kwargs):
+        """Destroy many ECS instances with one task"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        machine_names = kwargs['body']['names']
+        self._user_changed(username)
+        task = current_app.celery_app.send_task('ecs.bulk_delete', [username, machine_names, txn_id],
+                                                queue=celery_config.queue_for('ecs.bulk_delete'),
+                                                headers=_trace_headers())
+        resp_data['content'] = {'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        return resp
+
+    @route('/network', methods=["PUT"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=MachineView.NETWORK_SCHEMA)
+    @describe(put=MachineView.NETWORK_SCHEMA)
+    def modify_network(self, *args, **kwargs):
+        """Change the network an ECS instance is connected to"""
+        username = kwargs['token']['username']
+        machine_name = kwargs['body']['name']
+        new_network = '{}_{}'.format(username, kwargs['body']['new_network'])
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        self._user_changed(username)
+        task = current_app.celery_app.send_task('ecs.modify_network', [username, machine_name, new_network, txn_id],
+                                                queue=celery_config.queue_for('ecs.modify_network'),
+                                                headers=_trace_headers())
+        resp_data['content'] = {'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        return resp
+
+    @route('/task', methods=["GET"])
+    @route('/task/<tid>', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(get_args=TaskView.TASK_ARGS)
+    def handle_task(self, *args, **kwargs):
+        """Check the status of a task, and cache the result if it was sent for a read"""
+        output = super().handle_task(*args, **kwargs)
+        # Still running, or it's the ``describe`` of the end point
+        if len(output) != 2 or output[1] == 202:
+            return output
+        body, status = output
+        task_id = request.args.get('task-id', kwargs.get('tid', None))
+        SINGLE_FLIGHT.done(task_id)
+        if status == 200:
+            etag = RESPONSE_CACHE.complete(task_id, ujson.loads(body)['content'])
+            if etag:
+                return body, status, {'ETag': '"{}"'.format(etag)}
+        # A read that another API process sent isn't a change; only a task that changes VMs is
+        if current_app.celery_app.AsyncResult(task_id).name in MUTATING_TASKS:
+            self._user_changed(kwargs['token']['username'])
+        return output
+
+    def _user_changed(self, username):
+        """Stop answering ``GET /ecs`` for a user with what was read before a change
+
+        :Returns: None
+
+        :param username: The user whose ECS instances are (being) changed
+        :type username: String
+        """
+        RESPONSE_CACHE.invalidate(('ecs.show', username))
+        SINGLE_FLIGHT.forget('ecs.show', [username])
+
+    def _cached_read(self, task_name, task_args, txn_id, key, username):
+        """Answer a read from the last result, only sending a task when it's needed
+
+        :Returns: flask.Response
+
+        :param task_name: The task that performs the read, i.e. ``ecs.show``
+        :type task_name: String
+
+        :param task_args: The arguments for the task, except the trailing ``txn_id``
+        :type task_args: List
+
+        :param txn_id: A unique string supplied by the client to track the call through logs
+        :type txn_id: String
+
+        :param key: Identifies the read in the cache, i.e. ``('ecs.show', 'bob')``
+        :type key: Tuple
+
+        :param username: The user making the request
+        :type username: String
+        """
+        resp_data = {'user' : username}
+        entry = RESPONSE_CACHE.lookup(key)
+        task_id = None
+        if entry is None or not entry.fresh:
+            task_id = SINGLE_FLIGHT.send(current_app.celery_app, task_name, task_args, txn_id,
+                                         headers=_trace_headers())
+            RESPONSE_CACHE.expect(key, task_id)
+        if entry is None:
+            resp_data['content'] = {'task-id': task_id}
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 202
+        elif request.if_none_match.contains(entry.etag):
+            RESPONSE_CACHE.not_modified()
+            resp = Response(status=304)
+            resp.set_etag(entry.etag)
+        else:
+            resp_data['content'] = entry.content
+            if task_id:
+                resp_data['refresh-task-id'] = task_id
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 200
+            resp.set_etag(entry.etag)
+        if task_id:
+            resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+
+def _trace_headers():
+    """Ask the worker to return the timing of each phase, if the client asked for it
+
+    :Returns: Dictionary, or None when the client didn't send ``X-VLAB-TRACE: true``
+    """
+    if request.headers.get('X-VLAB-TRACE', '').lower() == 'true':
+        return {celery_config.TRACE_HEADER: True}
+    return None
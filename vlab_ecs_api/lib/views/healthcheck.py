@@ -1,15 +1,33 @@
 # -*- coding: UTF-8 -*-
 """
 Enables Health checks for the power API
+
+A plain GET only proves the API is up, so it's cheap enough to call as often as
+a load balancer likes. Adding ``?deep=true`` also probes what the API depends
+on (the broker, the workers, and the workers' sessions to vCenter). Those
+results are cached for ``VLAB_ECS_HEALTH_TTL`` seconds, so an aggressive
+monitor doesn't become load on the dependencies.
 """
-from time import time
-import pkg_resources
+import time
+import threading
 
 import ujson
+from flask import current_app, request
 from flask_classy import FlaskView, Response
-from vlab_inf_common.vmware import vCenter
 
-from vlab_ecs_api.lib import const
+from vlab_ecs_api.lib import const, celery_config
+
+try:
+    from importlib.metadata import version as _dist_version
+except ImportError:
+    # Python < 3.8
+    from pkg_resources import get_distribution
+
+    def _dist_version(name):
+        return get_distribution(name).version
+
+# Looking this up scans the installed packages; the answer can't change while running
+VERSION = _dist_version('vlab-ecs-api')
 
 
 class HealthView(FlaskView):
@@ -23,8 +41,106 @@ class HealthView(FlaskView):
         """End point for health checks"""
         resp = {}
         status = 200
-        resp['version'] = pkg_resources.get_distribution('vlab-ecs-api').version
+        resp['version'] = VERSION
+        if request.args.get('deep', '').lower() == 'true':
+            resp['dependencies'] = DEEP_CHECK.run(current_app.celery_app)
+            if not all(x['ok'] for x in resp['dependencies'].values()):
+                status = 503
         response = Response(ujson.dumps(resp))
         response.status_code = status
         response.headers['Content-Type'] = 'application/json'
         return response
+
+
+class DeepCheck:
+    """Probes the dependencies of the API, and remembers the results for a while
+
+    :param ttl: How many seconds the results of the probes are reused
+    :type ttl: Integer
+
+    :param timeout: The most seconds a single probe waits for an answer
+    :type timeout: Integer
+    """
+    def __init__(self, ttl, timeout):
+        self._ttl = ttl
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._results = {}
+
+    def run(self, celery_app):
+        """Probe every dependency, unless it was done recently
+
+        :Returns: Dictionary
+
+        :param celery_app: The app the API sends tasks with
+        :type celery_app: celery.Celery
+        """
+        # Holding the lock while probing means concurrent checks wait on one set of probes
+        with self._lock:
+            if time.time() - self._checked >= self._ttl:
+                probes = (('broker', self._check_broker),
+                          ('workers', self._check_workers),
+                          ('vcenter', self._check_vcenter))
+                self._results = {name: _probe(probe, celery_app) for name, probe in probes}
+                self._checked = time.time()
+            age = time.time() - self._checked
+            results = {}
+            for name, result in self._results.items():
+                results[name] = dict(result)
+                results[name]['age'] = age
+        return results
+
+    def clear(self):
+        """Forget the results of the last probes
+
+        :Returns: None
+        """
+        with self._lock:
+            self._checked = 0
+            self._results = {}
+
+    def _check_broker(self, celery_app):
+        """Connect to the message broker"""
+        with celery_app.connection_for_write() as conn:
+            conn.ensure_connection(max_retries=1)
+
+    def _check_workers(self, celery_app):
+        """Ask every worker to reply"""
+        replies = celery_app.control.ping(timeout=self._timeout)
+        if not replies:
+            raise RuntimeError('No workers replied within {} seconds'.format(self._timeout))
+
+    def _check_vcenter(self, celery_app):
+        """Have a worker use one of its sessions to vCenter"""
+        task = celery_app.send_task('ecs.healthcheck', ['healthcheck'],
+                                    queue=celery_config.queue_for('ecs.healthcheck'))
+        result = task.get(timeout=self._timeout)
+        if result['error']:
+            raise RuntimeError(result['error'])
+
+
+def _probe(probe, celery_app):
+    """Run a probe, timing how long it takes
+
+    :Returns: Dictionary
+
+    :param probe: Called with the Celery app; raises if the dependency is unhealthy
+    :type probe: Function
+
+    :param celery_app: The app the API sends tasks with
+    :type celery_app: celery.Celery
+    """
+    start = time.perf_counter()
+    try:
+        probe(celery_app)
+    except Exception as doh:
+        # Timeouts, refused connections, etc; all mean the dependency is down
+        error = '{}'.format(doh)
+    else:
+        error = None
+    latency = time.perf_counter() - start
+    return {'ok': error is None, 'latency': round(latency, 4), 'error': error}
+
+
+DEEP_CHECK = DeepCheck(ttl=const.VLAB_ECS_HEALTH_TTL, timeout=const.VLAB_ECS_HEALTH_TIMEOUT)
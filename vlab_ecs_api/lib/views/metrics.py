@@ -0,0 +1,23 @@
+# -*- coding: UTF-8 -*-
+"""
+Exposes the Prometheus metrics of the API
+"""
+from flask_classy import FlaskView, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+from vlab_ecs_api.lib import metrics
+
+
+class MetricsView(FlaskView):
+    """
+    End point that Prometheus scrapes
+    """
+    route_base = '/metrics'
+    trailing_slash = False
+
+    def get(self):
+        """End point for metrics"""
+        response = Response(generate_latest(metrics.registry()))
+        response.status_code = 200
+        response.headers['Content-Type'] = CONTENT_TYPE_LATEST
+        return response
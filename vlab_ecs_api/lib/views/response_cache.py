@@ -0,0 +1,201 @@
+# -*- coding: UTF-8 -*-
+"""
+Keeps the last result of the read-only tasks (``ecs.show`` and ``ecs.image``)
+in the API, so a client that polls doesn't send a new task every time.
+
+The API only sees a result when a client fetches it from the ``/task`` end
+point, so a result is cached when its task was sent by a GET that's expecting
+it. A result is then:
+
+- fresh for ``VLAB_ECS_RESPONSE_CACHE_TTL`` seconds; it's served as-is.
+- stale, but usable, until it's ``VLAB_ECS_RESPONSE_CACHE_MAX_STALE`` seconds
+  old; it's served along with the id of a task that refreshes it.
+- too old after that; the GET works like it did without a cache.
+
+Every result gets an ETag, so a client that sends ``If-None-Match`` gets an
+HTTP 304 when nothing has changed.
+
+The results live in each API process, but they're only good for one shared
+generation (see ``shared_store``). A user's ``ecs.show`` shares the generation
+of their inventory, which the workers bump whenever they change the user's VMs,
+and which the API bumps whenever it sends a change. So no API process serves a
+result from before a change, and a refresh that was running when something
+changed isn't cached, because it might have read what was there before.
+"""
+import copy
+import time
+import hashlib
+import threading
+from collections import namedtuple
+
+import ujson
+
+from vlab_ecs_api.lib import const, shared_store
+
+# ``fresh`` is False when the content should be refreshed
+Entry = namedtuple('Entry', 'content etag fresh')
+
+
+class ResponseCache:
+    """A time-limited mapping of a read (i.e. a user's ``ecs.show``) to its last result
+
+    :param ttl: How many seconds a result is served without refreshing it
+    :type ttl: Integer
+
+    :param max_stale: How many seconds a result is served at all
+    :type max_stale: Integer
+
+    :param generations: Where the generation of every read is kept
+    :type generations: vlab_ecs_api.lib.shared_store.Generations
+    """
+    def __init__(self, ttl, max_stale, generations=shared_store.GENERATIONS):
+        self._ttl = ttl
+        self._max_stale = max_stale
+        self._generations = generations
+        self._lock = threading.Lock()
+        # key -> (stored at, content, etag, generation)
+        self._entries = {}
+        # task id -> (key, sent at, generation); the tasks that will refresh an entry
+        self._pending = {}
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'not_modified': 0}
+
+    def lookup(self, key):
+        """Obtain the cached result of a read
+
+        :Returns: Entry, or None if there's no usable result
+
+        :param key: Identifies the read, i.e. ``('ecs.show', 'bob')``
+        :type key: Tuple
+        """
+        generation = self._generations.get(generation_name(key))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            age = time.time() - entry[0]
+            if age >= self._max_stale or generation is None or entry[3] != generation:
+                # Too old, or something changed since it was read (maybe in another process)
+                self._entries.pop(key)
+                self._stats['misses'] += 1
+                return None
+            fresh = age < self._ttl
+            self._stats['hits' if fresh else 'stale_hits'] += 1
+            return Entry(copy.deepcopy(entry[1]), entry[2], fresh)
+
+    def not_modified(self):
+        """Count a read that was answered with HTTP 304
+
+        :Returns: None
+        """
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def expect(self, key, task_id):
+        """Remember that the result of a task should be cached
+
+        :Returns: None
+
+        :param key: Identifies the read, i.e. ``('ecs.show', 'bob')``
+        :type key: Tuple
+
+        :param task_id: The id of the task that was sent for the read
+        :type task_id: String
+        """
+        generation = self._generations.get(generation_name(key))
+        oldest = time.time() - self._max_stale
+        with self._lock:
+            for pending_id, (_, sent, _) in list(self._pending.items()):
+                if sent < oldest:
+                    # Nobody fetched its result, and it's too old to cache now
+                    self._pending.pop(pending_id)
+            if generation is not None:
+                self._pending[task_id] = (key, time.time(), generation)
+
+    def complete(self, task_id, content):
+        """Cache the content of a finished task, if it was sent for a read
+
+        :Returns: String (the ETag of the content), or None if the task wasn't expected
+
+        :param task_id: The id of the finished task
+        :type task_id: String
+
+        :param content: The ``content`` of the task result
+        :type content: Dictionary
+        """
+        with self._lock:
+            pending = self._pending.pop(task_id, None)
+        if pending is None:
+            return None
+        key, _, generation = pending
+        if self._generations.get(generation_name(key)) != generation:
+            # Something changed while the task ran; it might have read what was there before
+            return None
+        etag = make_etag(content)
+        with self._lock:
+            self._entries[key] = (time.time(), copy.deepcopy(content), etag, generation)
+        return etag
+
+    def invalidate(self, key):
+        """Forget the result of a read, and any refresh of it that's running, in every API process
+
+        :Returns: None
+
+        :param key: Identifies the read, i.e. ``('ecs.show', 'bob')``
+        :type key: Tuple
+        """
+        self._generations.bump(generation_name(key))
+        with self._lock:
+            self._entries.pop(key, None)
+            # A refresh that started before a change could miss the change
+            for task_id, (pending_key, _, _) in list(self._pending.items()):
+                if pending_key == key:
+                    self._pending.pop(task_id)
+
+    def clear(self):
+        """Forget every cached result
+
+        :Returns: None
+        """
+        with self._lock:
+            self._entries = {}
+            self._pending = {}
+
+    def stats(self):
+        """Obtain the hit/miss counters of the cache
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+def generation_name(key):
+    """Name the shared generation that the result of a read is only good for
+
+    :Returns: String
+
+    :param key: Identifies the read, i.e. ``('ecs.show', 'bob')``
+    :type key: Tuple
+    """
+    if key[0] == 'ecs.show':
+        # The same counter the workers bump when they change the user's VMs
+        return 'inventory:{}'.format(key[1])
+    return 'response:{}'.format(':'.join(key))
+
+
+def make_etag(content):
+    """Compute an ETag that changes whenever the content does
+
+    :Returns: String
+
+    :param content: The content of a task result
+    :type content: Dictionary
+    """
+    return hashlib.sha1(ujson.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+RESPONSE_CACHE = ResponseCache(ttl=const.VLAB_ECS_RESPONSE_CACHE_TTL,
+                               max_stale=const.VLAB_ECS_RESPONSE_CACHE_MAX_STALE)
@@ -0,0 +1,125 @@
+# -*- coding: UTF-8 -*-
+"""
+Coalesces identical read-only tasks, so a burst of the same request (i.e. a UI
+refreshing, or a class all loading ``/image``) only sends one task.
+
+A task is "in flight" until a client fetches its finished result from the
+``/task`` end point, or ``VLAB_ECS_SINGLE_FLIGHT_WINDOW`` seconds pass (in case
+nobody ever does). An identical request made while a task is in flight gets the
+id of that task, instead of a new one.
+
+Only tasks that just read are coalesced; two identical requests to change
+something are two changes.
+"""
+import time
+import threading
+
+from vlab_api_common import get_logger
+
+from vlab_ecs_api.lib import const, celery_config
+
+logger = get_logger(__name__, loglevel=const.VLAB_ECS_LOG_LEVEL)
+
+
+class SingleFlight:
+    """Tracks the read-only tasks that are in flight, by task name and arguments
+
+    :param window: The most seconds a task is considered in flight
+    :type window: Integer
+    """
+    def __init__(self, window):
+        self._window = window
+        self._lock = threading.Lock()
+        # (task name, *args) -> (task id, sent at)
+        self._in_flight = {}
+        self._stats = {'sent': 0, 'coalesced': 0}
+
+    def send(self, celery_app, task_name, args, txn_id, headers=None):
+        """Send a task, unless an identical one is already in flight
+
+        :Returns: String (the task id)
+
+        :param celery_app: The app to send the task with
+        :type celery_app: celery.Celery
+
+        :param task_name: The registered name of the task, i.e. ``ecs.show``
+        :type task_name: String
+
+        :param args: The arguments of the task, except the trailing ``txn_id``
+        :type args: List
+
+        :param txn_id: A unique string supplied by the client to track the call through logs
+        :type txn_id: String
+
+        :param headers: Extra message headers for the task, i.e. to trace its phases
+        :type headers: Dictionary
+        """
+        # The txn_id differs on every request, so it can't be part of the key
+        key = (task_name,) + tuple(args)
+        if headers:
+            # A traced request can't join an untraced task; it wouldn't get the timings
+            key += (tuple(sorted(headers.items())),)
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            if in_flight and in_flight[1] > time.time() - self._window:
+                self._stats['coalesced'] += 1
+                logger.info('Request {} joined task {}'.format(txn_id, in_flight[0]))
+                return in_flight[0]
+            task = celery_app.send_task(task_name, list(args) + [txn_id],
+                                        queue=celery_config.queue_for(task_name),
+                                        headers=headers)
+            self._in_flight[key] = (task.id, time.time())
+            self._stats['sent'] += 1
+        return task.id
+
+    def done(self, task_id):
+        """Stop coalescing requests onto a finished task
+
+        :Returns: None
+
+        :param task_id: The id of the finished task
+        :type task_id: String
+        """
+        with self._lock:
+            for key, (in_flight_id, _) in list(self._in_flight.items()):
+                if in_flight_id == task_id:
+                    self._in_flight.pop(key)
+
+    def forget(self, task_name, args):
+        """Stop coalescing requests onto a task, because what it read has changed
+
+        :Returns: None
+
+        :param task_name: The registered name of the task, i.e. ``ecs.show``
+        :type task_name: String
+
+        :param args: The arguments of the task, except the trailing ``txn_id``
+        :type args: List
+        """
+        prefix = (task_name,) + tuple(args)
+        with self._lock:
+            # Traced tasks have their headers on the end of the key
+            for key in list(self._in_flight.keys()):
+                if key[:len(prefix)] == prefix:
+                    self._in_flight.pop(key)
+
+    def clear(self):
+        """Forget every task in flight
+
+        :Returns: None
+        """
+        with self._lock:
+            self._in_flight = {}
+
+    def stats(self):
+        """Obtain how many tasks were sent, and how many requests were coalesced
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._in_flight)
+        return stats
+
+
+SINGLE_FLIGHT = SingleFlight(window=const.VLAB_ECS_SINGLE_FLIGHT_WINDOW)
@@ -0,0 +1,95 @@
+# -*- coding: UTF-8 -*-
+"""
+An ``Ova`` that's built from the details ``image_catalog`` already read,
+instead of re-opening the tarball and re-parsing the OVF on every deploy.
+"""
+import os
+
+from vlab_inf_common.vmware.ova import Ova, FileHandle
+
+
+class MemberReader:
+    """A read-only, file-like view of one file within the OVA tarball
+
+    Reads go through the OVA's file handle, so ``Ova.deploy_progress`` keeps
+    working.
+
+    :param handle: The open OVA file
+    :type handle: vlab_inf_common.vmware.ova.FileHandle
+
+    :param offset: Where the file's data starts within the tarball
+    :type offset: Integer
+
+    :param size: How many bytes the file is
+    :type size: Integer
+    """
+    def __init__(self, handle, offset, size):
+        self._handle = handle
+        self._offset = offset
+        self.size = size
+        self._position = 0
+
+    def read(self, amount=-1):
+        """Read up to ``amount`` bytes; everything left if ``amount`` is negative
+
+        :Returns: Bytes
+        """
+        remaining = self.size - self._position
+        if amount is None or amount < 0 or amount > remaining:
+            amount = remaining
+        if amount == 0:
+            return b''
+        self._handle.seek(self._offset + self._position)
+        data = self._handle.read(amount)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        """Move to a position within the file, just like ``io.IOBase.seek``
+
+        :Returns: Integer
+        """
+        if whence == 0:
+            position = offset
+        elif whence == 1:
+            position = self._position + offset
+        else:
+            position = self.size + offset
+        self._position = max(0, min(position, self.size))
+        return self._position
+
+    def tell(self):
+        """The current position within the file
+
+        :Returns: Integer
+        """
+        return self._position
+
+
+class CachedOva(Ova):
+    """Same as ``vlab_inf_common.vmware.Ova``, but doesn't read the tarball's
+    headers or OVF; the disks are read straight from their offset.
+
+    :param image_info: The details of the image, from ``image_catalog``
+    :type image_info: vlab_ecs_api.lib.worker.image_catalog.ImageInfo
+    """
+    def __init__(self, image_info):
+        self._spec = None
+        self._lease = None
+        self._host = None
+        self._prog = None
+        self._handle = FileHandle(image_info.path)
+        self._tar = None
+        self._ovf = image_info.ovf
+        self._networks = list(image_info.networks)
+        self._disks = {}
+        for name, (offset, size) in image_info.disks.items():
+            self._disks[name] = MemberReader(self._handle, offset, size)
+        stat = os.fstat(self._handle.fh.fileno())
+        # Offsets of a file that's been replaced are meaningless
+        self.stale = stat.st_mtime_ns != image_info.mtime or stat.st_size != image_info.size
+
+    @property
+    def networks(self):
+        """Return a list of network names that a VM has configured"""
+        return list(self._networks)
@@ -0,0 +1,189 @@
+# -*- coding: UTF-8 -*-
+"""
+Keeps track of the OVAs in ``VLAB_ECS_IMAGES_DIR``, so listing (and looking up)
+images doesn't hit the (slow, network backed) image storage on every task.
+
+The directory is only re-read when its mtime changes, and the mtime is only
+checked every ``VLAB_ECS_IMAGE_CHECK_INTERVAL`` seconds. Details about an image
+(size, the OVF and its networks, where each disk is within the tarball, and the
+manifest checksums) are read from the OVA the first time they're asked for, and
+kept until that file changes. Deploys use those details via ``CachedOva``, so
+the tarball isn't re-parsed every time.
+
+inotify isn't used because it doesn't see changes made by other NFS clients.
+"""
+import os
+import re
+import time
+import tarfile
+import threading
+from collections import namedtuple
+
+from vlab_ecs_api.lib import const
+from vlab_ecs_api.lib.worker.cached_ova import CachedOva
+
+# Same as ``vlab_inf_common.vmware.Ova.networks``
+NETWORK_REGEX = re.compile(r'Network ovf:name=[\w\ \"]{1,50}')
+# i.e. SHA256(ECS.ovf)= 0a1b2c...
+MANIFEST_REGEX = re.compile(r'^(\w+)\((.+)\)\s*=\s*([0-9a-fA-F]+)\s*$')
+
+# ``disks`` maps the name of each VMDK to its (offset, size) within the tarball
+ImageInfo = namedtuple('ImageInfo', 'name path size mtime ovf networks disks checksums')
+
+
+class ImageCatalog:
+    """The OVAs available to deploy, and what's inside them
+
+    :param images_dir: The directory that holds the OVAs
+    :type images_dir: String
+
+    :param check_interval: The most seconds before a change to the directory is noticed
+    :type check_interval: Integer
+    """
+    def __init__(self, images_dir, check_interval):
+        self._images_dir = images_dir
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._next_check = 0
+        self._names = []
+        # file name -> ImageInfo
+        self._details = {}
+
+    def names(self):
+        """The file names of every image
+
+        :Returns: List
+        """
+        with self._lock:
+            self._refresh()
+            return list(self._names)
+
+    def get(self, name):
+        """Obtain the details of an image
+
+        :Returns: ImageInfo
+
+        :Raises: KeyError if there's no such image
+
+        :param name: The file name of the image, i.e. ``ECS-3.2.2.ova``
+        :type name: String
+        """
+        with self._lock:
+            self._refresh()
+            if name not in self._names:
+                raise KeyError(name)
+            details = self._details.get(name)
+        if details is None:
+            # Reading the OVA is slow; don't block lookups of other images on it
+            details = _read_image(os.path.join(self._images_dir, name))
+            with self._lock:
+                self._details[name] = details
+        return details
+
+    def open(self, name):
+        """Open an image for deployment, without re-parsing the OVA
+
+        :Returns: vlab_ecs_api.lib.worker.cached_ova.CachedOva
+
+        :Raises: KeyError if there's no such image, FileNotFoundError if it's since been deleted
+
+        :param name: The file name of the image, i.e. ``ECS-3.2.2.ova``
+        :type name: String
+        """
+        ova = CachedOva(self.get(name))
+        if ova.stale:
+            # Replaced since we last looked; the offsets are no good
+            ova.close()
+            with self._lock:
+                self._details.pop(name, None)
+            ova = CachedOva(self.get(name))
+        return ova
+
+    def clear(self):
+        """Forget everything, so the next lookup re-reads the directory
+
+        :Returns: None
+        """
+        with self._lock:
+            self._dir_mtime = None
+            self._next_check = 0
+            self._names = []
+            self._details = {}
+
+    def _refresh(self):
+        """Re-read the directory if it's changed; caller must hold the lock"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        dir_mtime = os.stat(self._images_dir).st_mtime_ns
+        if dir_mtime != self._dir_mtime:
+            with os.scandir(self._images_dir) as entries:
+                files = {x.name: x.stat().st_mtime_ns for x in entries if x.is_file()}
+            self._names = sorted(files.keys())
+            # An image replaced in place (same name) gets re-read
+            self._details = {k: v for k, v in self._details.items() if files.get(k) == v.mtime}
+            self._dir_mtime = dir_mtime
+        self._next_check = now + self._check_interval
+
+
+def _read_image(path):
+    """Pull the details of an image out of the OVA
+
+    :Returns: ImageInfo
+
+    :param path: The location of the OVA
+    :type path: String
+    """
+    stat = os.stat(path)
+    ovf = ''
+    disks = {}
+    checksums = {}
+    with tarfile.open(path) as the_ova:
+        for member in the_ova.getmembers():
+            if member.name.endswith('.vmdk'):
+                disks[member.name] = (member.offset_data, member.size)
+            elif member.name.endswith('.ovf'):
+                ovf = the_ova.extractfile(member).read().decode()
+            elif member.name.endswith('.mf'):
+                checksums = _parse_manifest(the_ova.extractfile(member).read().decode())
+    return ImageInfo(name=os.path.basename(path),
+                     path=path,
+                     size=stat.st_size,
+                     mtime=stat.st_mtime_ns,
+                     ovf=ovf,
+                     networks=_parse_networks(ovf),
+                     disks=disks,
+                     checksums=checksums)
+
+
+def _parse_networks(ovf):
+    """Obtain the names of the networks an OVF defines
+
+    :Returns: List
+
+    :param ovf: The OVF descriptor
+    :type ovf: String
+    """
+    # Gives us output like ['Network ovf:name="some network name"']
+    return [x.split('=')[1].replace('"', '') for x in NETWORK_REGEX.findall(ovf)]
+
+
+def _parse_manifest(manifest):
+    """Obtain the checksum of every file listed in an OVA manifest
+
+    :Returns: Dictionary of file name to (algorithm, digest)
+
+    :param manifest: The contents of the ``.mf`` file
+    :type manifest: String
+    """
+    checksums = {}
+    for line in manifest.splitlines():
+        match = MANIFEST_REGEX.match(line)
+        if match:
+            algorithm, file_name, digest = match.groups()
+            checksums[file_name] = (algorithm.upper(), digest.lower())
+    return checksums
+
+
+CATALOG = ImageCatalog(const.VLAB_ECS_IMAGES_DIR, check_interval=const.VLAB_ECS_IMAGE_CHECK_INTERVAL)
@@ -0,0 +1,246 @@
+# -*- coding: UTF-8 -*-
+"""
+Caches the output of ``vmware.show_ecs`` per user, so the (very frequent)
+``ecs.show`` task doesn't walk vCenter when nothing has changed.
+
+Entries expire after ``VLAB_ECS_INVENTORY_TTL`` seconds, and the tasks that
+change a user's VMs explicitly invalidate that user's entry. The entries live in
+each worker process, but an invalidation bumps the user's generation in the
+shared result store (see ``shared_store.py``), so the ``ecs-worker`` serving
+``ecs.show`` stops using its entry as soon as an ``ecs-vcenter-worker`` changes
+the user's VMs. Setting ``VLAB_ECS_INVENTORY_WATCH`` also subscribes to VM
+changes in vCenter (via ``WaitForUpdatesEx``), which catches changes made
+outside of this service. Because the watcher invalidates through the shared
+generations, one watcher (in the main process of a worker) covers every process
+of every worker; only when the generations aren't shared does each worker
+process need a watcher of its own.
+"""
+import copy
+import time
+import threading
+
+from pyVmomi import vmodl
+from vlab_api_common import get_logger
+from vlab_inf_common.vmware import vim
+
+from vlab_ecs_api.lib import const, shared_store
+from vlab_ecs_api.lib.worker import session_pool, property_collector
+
+logger = get_logger(__name__, loglevel=const.VLAB_ECS_LOG_LEVEL)
+
+# Any change to these means a user's ``ecs.show`` output could be different
+WATCHED_PROPERTIES = ['name', 'parent', 'runtime.powerState', 'config.annotation', 'guest.net', 'network']
+
+
+class InventoryCache:
+    """A time-limited mapping of username to the output of ``show_ecs``
+
+    :param ttl: How many seconds an entry is valid for
+    :type ttl: Integer
+
+    :param generations: Where invalidations are recorded, so every process sees them
+    :type generations: shared_store.Generations
+    """
+    def __init__(self, ttl, generations=shared_store.GENERATIONS):
+        self._ttl = ttl
+        self._generations = generations
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Bumped by 'clear'; stops a lookup that started before the clear from
+        # caching what it found.
+        self._epoch = 0
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, username, loader):
+        """Obtain a user's inventory, calling ``loader`` if it's not cached
+
+        :Returns: Dictionary
+
+        :param username: The user who owns the inventory
+        :type username: String
+
+        :param loader: Called with the username to look up the inventory
+        :type loader: Function
+        """
+        name = 'inventory:{}'.format(username)
+        generation = self._generations.get(name)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry and entry[0] > time.time() and generation is not None and entry[1] == generation:
+                self._stats['hits'] += 1
+                return copy.deepcopy(entry[2])
+            self._stats['misses'] += 1
+            epoch = self._epoch
+        info = loader(username)
+        # A user whose VMs changed during the lookup could have gotten the old
+        # inventory, and an unknown generation can't be checked later on
+        if generation is not None and self._generations.get(name) == generation:
+            with self._lock:
+                if self._epoch == epoch:
+                    self._entries[username] = (time.time() + self._ttl, generation, copy.deepcopy(info))
+        return info
+
+    @property
+    def shared(self):
+        """True when an invalidation in this process reaches the caches of every other process"""
+        return self._generations.shared
+
+    def invalidate(self, username):
+        """Forget the cached inventory of a user, in every process
+
+        :Returns: None
+
+        :param username: The user whose VMs changed
+        :type username: String
+        """
+        self._generations.bump('inventory:{}'.format(username))
+        with self._lock:
+            self._entries.pop(username, None)
+            self._stats['invalidations'] += 1
+
+    def clear(self):
+        """Forget every inventory cached by this process
+
+        :Returns: None
+        """
+        with self._lock:
+            self._entries = {}
+            self._epoch += 1
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        """Obtain the hit/miss counters of the cache
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+class InventoryWatcher(threading.Thread):
+    """Invalidates cached inventories when VMs change in vCenter
+
+    The watcher uses its own vCenter session, because ``WaitForUpdatesEx``
+    blocks for a long time and would otherwise hold a pooled session forever.
+
+    :param cache: The cache to invalidate
+    :type cache: InventoryCache
+
+    :param login: Called with no arguments to log into vCenter
+    :type login: Function
+
+    :param max_wait: How many seconds a single ``WaitForUpdatesEx`` call blocks for
+    :type max_wait: Integer
+    """
+    def __init__(self, cache, login, max_wait=60):
+        super().__init__(name='InventoryWatcher', daemon=True)
+        self._cache = cache
+        self._login = login
+        self._max_wait = max_wait
+        self._stopped = threading.Event()
+        # VM moId -> the name of the folder (i.e. user) that owns it
+        self._owners = {}
+        self._folder_names = {}
+
+    def stop(self):
+        """Have the watcher exit after its current wait"""
+        self._stopped.set()
+
+    def run(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                self._watch()
+            except Exception as doh:
+                logger.exception('Inventory watcher failed, retrying in %s seconds: %s', backoff, doh)
+                # Whatever changed while we weren't watching is unknown
+                self._cache.clear()
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            else:
+                backoff = 1
+
+    def _watch(self):
+        """Block on vCenter, invalidating entries as updates arrive"""
+        vcenter = self._login()
+        try:
+            collector, view = self._make_filter(vcenter)
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self._max_wait)
+            version = ''
+            while not self._stopped.is_set():
+                update = collector.WaitForUpdatesEx(version, options)
+                if update is None:
+                    continue
+                version = update.version
+                for filter_set in update.filterSet:
+                    for object_update in filter_set.objectSet:
+                        self._handle(object_update)
+            collector.DestroyPropertyCollector()
+            view.DestroyView()
+        finally:
+            session_pool.logout(vcenter)
+
+    def _make_filter(self, vcenter):
+        """Subscribe to changes of every VM under the vLab base folder
+
+        :Returns: Tuple (vmodl.query.PropertyCollector, vim.view.ContainerView)
+        """
+        content = vcenter.content
+        folder = vcenter.get_vm_folder(path=const.INF_VCENTER_TOP_LVL_DIR)
+        view = content.viewManager.CreateContainerView(container=folder,
+                                                       type=[vim.VirtualMachine],
+                                                       recursive=True)
+        filter_spec = property_collector.view_filter_spec(view, WATCHED_PROPERTIES, vim.VirtualMachine)
+        collector = content.propertyCollector.CreatePropertyCollector()
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        return collector, view
+
+    def _handle(self, object_update):
+        """Invalidate the inventory of the user who owns the updated VM
+
+        :Returns: None
+
+        :param object_update: The change to a single VM
+        :type object_update: vmodl.query.PropertyCollector.ObjectUpdate
+        """
+        vm_id = object_update.obj._moId
+        for change in object_update.changeSet:
+            if change.name == 'parent' and change.val is not None:
+                # A move changes the owner; the old owner's inventory changed too
+                old_owner = self._owners.get(vm_id)
+                if old_owner:
+                    self._cache.invalidate(old_owner)
+                self._owners[vm_id] = self._folder_name(change.val)
+        owner = self._owners.get(vm_id)
+        if owner is None:
+            self._cache.clear()
+        else:
+            self._cache.invalidate(owner)
+        if object_update.kind == 'leave':
+            self._owners.pop(vm_id, None)
+
+    def _folder_name(self, folder):
+        """Look up (and remember) the name of a folder
+
+        :Returns: String
+        """
+        name = self._folder_names.get(folder._moId)
+        if name is None:
+            name = folder.name
+            self._folder_names[folder._moId] = name
+        return name
+
+
+INVENTORY = InventoryCache(ttl=const.VLAB_ECS_INVENTORY_TTL)
+
+
+def start_watcher():
+    """Begin invalidating the process' inventory cache based on vCenter updates
+
+    :Returns: InventoryWatcher
+    """
+    watcher = InventoryWatcher(cache=INVENTORY, login=session_pool.login)
+    watcher.start()
+    return watcher
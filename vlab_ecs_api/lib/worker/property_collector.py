@@ -0,0 +1,284 @@
+# -*- coding: UTF-8 -*-
+"""
+Reads vSphere properties in bulk via the PropertyCollector.
+
+Accessing an attribute on a pyVmomi object (i.e. ``vm.runtime.powerState``) is
+a SOAP round trip. These functions fetch many properties, of many objects, in a
+single request so the cost of a call doesn't scale with the number of VMs.
+"""
+import time
+
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+
+
+def retrieve_children(vcenter, folder, properties, vimtype=vim.VirtualMachine):
+    """Obtain the requested properties for every object directly within a folder
+
+    :Returns: List of Tuples (object, Dictionary)
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param folder: The folder that contains the objects
+    :type folder: vim.Folder
+
+    :param properties: The property paths to read, i.e. ``runtime.powerState``
+    :type properties: List
+
+    :param vimtype: The kind of object to read the properties of
+    :type vimtype: pyVmomi.VmomiSupport.LazyType
+    """
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(name='folderChildren',
+                                                            path='childEntity',
+                                                            skip=False,
+                                                            type=vim.Folder)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=folder,
+                                                        skip=True,
+                                                        selectSet=[traversal])
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vimtype,
+                                                           pathSet=list(properties),
+                                                           all=False)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec],
+                                                           propSet=[prop_spec])
+    contents = vcenter.content.propertyCollector.RetrieveContents([filter_spec])
+    return [(x.obj, _to_dict(x.propSet)) for x in contents]
+
+
+def retrieve(vcenter, obj, properties):
+    """Obtain the requested properties of a single object
+
+    :Returns: Dictionary
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param obj: The object to read the properties of, i.e. a vim.VirtualMachine
+    :type obj: pyVmomi.VmomiSupport.ManagedObject
+
+    :param properties: The property paths to read, i.e. ``config.annotation``
+    :type properties: List
+    """
+    filter_spec = _objects_filter_spec([obj], properties)
+    contents = vcenter.content.propertyCollector.RetrieveContents([filter_spec])
+    if not contents:
+        return {}
+    return _to_dict(contents[0].propSet)
+
+
+def retrieve_many(vcenter, objs, properties):
+    """Obtain the requested properties of many objects, of the same type, in one call
+
+    :Returns: Dictionary of object -> Dictionary
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param objs: The objects to read the properties of, i.e. a list of vim.VirtualMachine
+    :type objs: List
+
+    :param properties: The property paths to read, i.e. ``runtime.powerState``
+    :type properties: List
+    """
+    if not objs:
+        return {}
+    filter_spec = _objects_filter_spec(objs, properties)
+    contents = vcenter.content.propertyCollector.RetrieveContents([filter_spec])
+    return {x.obj: _to_dict(x.propSet) for x in contents}
+
+
+def retrieve_by_type(vcenter, properties, vimtype):
+    """Obtain the requested properties for every object of a given type in vCenter
+
+    :Returns: List of Tuples (object, Dictionary)
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param properties: The property paths to read, i.e. ``name``
+    :type properties: List
+
+    :param vimtype: The kind of object to read the properties of
+    :type vimtype: pyVmomi.VmomiSupport.LazyType
+    """
+    content = vcenter.content
+    view = content.viewManager.CreateContainerView(container=content.rootFolder,
+                                                   type=[vimtype],
+                                                   recursive=True)
+    try:
+        filter_spec = view_filter_spec(view, properties, vimtype)
+        contents = content.propertyCollector.RetrieveContents([filter_spec])
+    finally:
+        view.DestroyView()
+    return [(x.obj, _to_dict(x.propSet)) for x in contents]
+
+
+def view_filter_spec(view, properties, vimtype):
+    """Select the requested properties of every object within a ContainerView
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param view: The view containing the objects
+    :type view: vim.view.ContainerView
+
+    :param properties: The property paths to read, i.e. ``name``
+    :type properties: List
+
+    :param vimtype: The kind of object to read the properties of
+    :type vimtype: pyVmomi.VmomiSupport.LazyType
+    """
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(name='viewObjects',
+                                                            path='view',
+                                                            skip=False,
+                                                            type=vim.view.ContainerView)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view,
+                                                        skip=True,
+                                                        selectSet=[traversal])
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vimtype,
+                                                           pathSet=list(properties),
+                                                           all=False)
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec],
+                                                    propSet=[prop_spec])
+
+
+def wait_for(vcenter, obj, properties, done, timeout):
+    """Block until the properties of an object satisfy ``done``
+
+    Instead of re-reading the properties on an interval, this blocks in
+    ``WaitForUpdatesEx``, which returns as soon as vCenter sees a change.
+
+    :Returns: Dictionary
+
+    :Raises: RuntimeError if ``done`` isn't satisfied within ``timeout`` seconds
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param obj: The object to watch, i.e. a vim.VirtualMachine
+    :type obj: pyVmomi.VmomiSupport.ManagedObject
+
+    :param properties: The property paths to watch, i.e. ``guest.net``
+    :type properties: List
+
+    :param done: Called with the properties (as a Dictionary) whenever they change
+    :type done: Function
+
+    :param timeout: The most seconds to wait
+    :type timeout: Integer
+    """
+    return wait_for_many(vcenter, [obj], properties, done, timeout)[obj]
+
+
+def wait_for_many(vcenter, objs, properties, done, timeout):
+    """Block until the properties of every object satisfy ``done``
+
+    All the objects are watched by one PropertyCollector, so waiting on N
+    objects costs the same as waiting on one.
+
+    :Returns: Dictionary of object -> Dictionary
+
+    :Raises: RuntimeError if ``done`` isn't satisfied within ``timeout`` seconds
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param objs: The objects to watch, all of the same type
+    :type objs: List
+
+    :param properties: The property paths to watch, i.e. ``info.state``
+    :type properties: List
+
+    :param done: Called with the properties (as a Dictionary) of an object whenever they change
+    :type done: Function
+
+    :param timeout: The most seconds to wait
+    :type timeout: Integer
+    """
+    props = {x: {} for x in objs}
+    if not objs:
+        return props
+    filter_spec = _objects_filter_spec(objs, properties)
+    # A collector of our own, so the updates are only about these objects
+    collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+    try:
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        deadline = time.time() + timeout
+        version = ''
+        pending = set(objs)
+        while True:
+            remaining = int(deadline - time.time())
+            if remaining <= 0:
+                break
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=remaining)
+            update = collector.WaitForUpdatesEx(version, options)
+            if update is None:
+                # maxWaitSeconds passed without a change
+                continue
+            version = update.version
+            for filter_set in update.filterSet:
+                for object_update in filter_set.objectSet:
+                    for change in object_update.changeSet:
+                        props[object_update.obj][change.name] = change.val
+                    if done(props[object_update.obj]):
+                        pending.discard(object_update.obj)
+            if not pending:
+                return props
+    finally:
+        collector.DestroyPropertyCollector()
+    waiting_on = ', '.join(sorted(x._moId for x in pending))
+    error = 'Timed out after {} seconds waiting on {} of {}'.format(timeout, ', '.join(properties), waiting_on)
+    raise RuntimeError(error)
+
+
+def wait_for_tasks(vcenter, tasks, timeout):
+    """Block until every task has finished, successfully or not
+
+    :Returns: Dictionary of vim.Task -> Dictionary with ``info.state`` and ``info.error``
+
+    :Raises: RuntimeError if a task is still running after ``timeout`` seconds
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param tasks: The tasks to wait on
+    :type tasks: List of vim.Task
+
+    :param timeout: The most seconds to wait
+    :type timeout: Integer
+    """
+    finished = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+    return wait_for_many(vcenter, tasks, ['info.state', 'info.error'],
+                         lambda x: x.get('info.state') in finished, timeout)
+
+
+def _objects_filter_spec(objs, properties):
+    """Select the requested properties of each of the supplied objects
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param objs: The objects, all of the same type
+    :type objs: List
+
+    :param properties: The property paths to read
+    :type properties: List
+    """
+    obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=x, skip=False) for x in objs]
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=type(objs[0]),
+                                                           pathSet=list(properties),
+                                                           all=False)
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs,
+                                                    propSet=[prop_spec])
+
+
+def _to_dict(prop_set):
+    """Convert the properties of a single object into a dictionary
+
+    Properties that are unset in vCenter (i.e. the config of a VM that's still
+    being deployed) are not returned at all, so they are not in the dictionary.
+
+    :Returns: Dictionary
+
+    :param prop_set: The properties returned for an object
+    :type prop_set: List of vmodl.DynamicProperty
+    """
+    return {x.name: x.val for x in prop_set}
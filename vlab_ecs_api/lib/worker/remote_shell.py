@@ -1,6 +1,101 @@
 # -*- coding: UTF-8 -*-
+import re
+import codecs
+import selectors
+
 import paramiko
 
+# How much to read from the channel at once
+RECV_SIZE = 32768
+# Upper bound on how long to sleep between checks of the exit status. Output (and
+# the channel closing) wakes the reader right away; this only matters if the
+# server sends the exit status without closing the channel.
+POLL_INTERVAL = 1
+# How much of the end of stdout/stderr ``stream_command`` keeps for error reports
+TAIL_SIZE = 16384
+# A PTY ends lines with \r\n, and progress bars redraw a line with a bare \r
+LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+
+class TailBuffer:
+    """Keeps only the last ``max_size`` bytes written to it
+
+    :param max_size: The most bytes to hold on to
+    :type max_size: Integer
+    """
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._data = bytearray()
+
+    def write(self, data):
+        """Append some bytes, discarding the oldest ones if over the limit
+
+        :Returns: None
+        """
+        self._data += data[-self._max_size:]
+        excess = len(self._data) - self._max_size
+        if excess > 0:
+            del self._data[:excess]
+
+    def getvalue(self):
+        """The retained bytes, decoded; a character split by the cutoff is replaced
+
+        :Returns: String
+        """
+        return self._data.decode(errors='replace')
+
+
+class LineSplitter:
+    """Turns chunks of raw output into whole, decoded lines
+
+    A multi-byte character or line can be split across chunks, so the trailing
+    partial line is held until the rest of it arrives. A "line" that never ends
+    is handed over once it's ``max_line`` characters long, so it can't grow
+    without bound.
+
+    :param callback: Called with every line of output
+    :type callback: Function
+
+    :param max_line: The most characters to hold on to while waiting for a line break
+    :type max_line: Integer
+    """
+    def __init__(self, callback, max_line=TAIL_SIZE):
+        self._callback = callback
+        self._max_line = max_line
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial = ''
+
+    def feed(self, data):
+        """Decode a chunk of output, calling back with every line it completes
+
+        :Returns: None
+        """
+        self._emit(self._partial + self._decoder.decode(data))
+
+    def flush(self):
+        """Call back with whatever output is left once the command is done
+
+        :Returns: None
+        """
+        lines = LINE_BREAK.split(self._partial + self._decoder.decode(b'', final=True))
+        self._partial = ''
+        if not lines[-1]:
+            lines.pop()
+        for line in lines:
+            self._callback(line)
+
+    def _emit(self, text):
+        lines = LINE_BREAK.split(text)
+        self._partial = lines.pop()
+        # A \r\n split across chunks would otherwise produce an empty line
+        if text.endswith('\r'):
+            self._partial = lines.pop() + '\r' if lines else '\r'
+        for line in lines:
+            self._callback(line)
+        while len(self._partial) > self._max_line:
+            self._callback(self._partial[:self._max_line])
+            self._partial = self._partial[self._max_line:]
+
 
 class SSHClient:
     """An API-similar implementation paramiko.client.SSHClient that blocks on
@@ -35,33 +130,89 @@ class SSHClient:
         self._ssh.invoke_shell() # Load all the env stuff, just like a normal shell!
 
     @staticmethod
-    def _block_on_command(channel):
+    def _iter_output(channel, poll_interval=POLL_INTERVAL):
         """Read stdin and stdout while a command executes to completion.
 
         Failure to read stdin and/or stdout can cause that socket buffer to fill.
         If one of those buffers fills, the command will appear to "hang" to the client.
 
+        The channel is watched with a selector, so this sleeps until there's
+        output to read (or the command exits) instead of spinning on the CPU.
+
+        :Returns: Generator of Tuple (is_stderr, chunk)
+
+        :param channel: The SSH channel the command is executing within
+        :type channel: paramiko.channel.Channel
+
+        :param poll_interval: The most seconds to sleep before checking the exit status
+        :type poll_interval: Integer
+        """
+        with selectors.DefaultSelector() as selector:
+            # paramiko signals an OS-level pipe whenever the channel has data or closes
+            selector.register(channel, selectors.EVENT_READ)
+            while True:
+                got_output = False
+                if channel.recv_ready():
+                    yield False, channel.recv(RECV_SIZE)
+                    got_output = True
+                if channel.recv_stderr_ready():
+                    yield True, channel.recv_stderr(RECV_SIZE)
+                    got_output = True
+                if got_output:
+                    continue
+                # Output is always delivered before the exit status, so once the
+                # exit status is here and the buffers are empty, we have it all
+                if channel.exit_status_ready() or channel.closed:
+                    break
+                selector.select(poll_interval)
+
+    @staticmethod
+    def _block_on_command(channel, poll_interval=POLL_INTERVAL):
+        """Collect the whole output of a command, and its exit code.
+
         :Returns: Tuple (stdout, stderr, exit_code)
 
         :param channel: The SSH channel the command is executing within
         :type channel: paramiko.channel.Channel
+
+        :param poll_interval: The most seconds to sleep before checking the exit status
+        :type poll_interval: Integer
+        """
+        # bytearray grows in place; bytes += copies the whole output every read
+        output = {False: bytearray(), True: bytearray()}
+        for is_stderr, chunk in SSHClient._iter_output(channel, poll_interval):
+            output[is_stderr] += chunk
+        exit_code = channel.recv_exit_status()
+        return output[False].decode(), output[True].decode(), exit_code
+
+    @staticmethod
+    def _stream_command(channel, callback, tail_size=TAIL_SIZE, poll_interval=POLL_INTERVAL):
+        """Hand each line of output to ``callback`` as the command produces it,
+        only keeping the end of the output around.
+
+        :Returns: Tuple (stdout_tail, stderr_tail, exit_code)
+
+        :param channel: The SSH channel the command is executing within
+        :type channel: paramiko.channel.Channel
+
+        :param callback: Called with every line of stdout and stderr
+        :type callback: Function
+
+        :param tail_size: How many bytes at the end of stdout and stderr to return
+        :type tail_size: Integer
+
+        :param poll_interval: The most seconds to sleep before checking the exit status
+        :type poll_interval: Integer
         """
-        # The old pattern in Py2 would be to create a list, append to it, then
-        # after all the data has been collected, call join() to form the final
-        # response. In Py3 with bytes, the += operator is more performant and
-        # what "other language" users would expect.
-        stdout = b''
-        stderr = b''
-        exit_code = -1
-        while (channel.recv_stderr_ready() or channel.recv_ready() or channel.send_ready()):
-            if channel.recv_ready():
-                stdout += channel.recv(4096)
-            if channel.recv_stderr_ready():
-                stderr += channel.recv_stderr(4096)
-            if channel.exit_status_ready():
-                break
+        tails = {False: TailBuffer(tail_size), True: TailBuffer(tail_size)}
+        splitters = {False: LineSplitter(callback), True: LineSplitter(callback)}
+        for is_stderr, chunk in SSHClient._iter_output(channel, poll_interval):
+            tails[is_stderr].write(chunk)
+            splitters[is_stderr].feed(chunk)
+        for splitter in splitters.values():
+            splitter.flush()
         exit_code = channel.recv_exit_status()
-        return stdout.decode(), stderr.decode(), exit_code
+        return tails[False].getvalue(), tails[True].getvalue(), exit_code
 
     def exec_command(self, command, get_pty=True, **kwargs):
         """Just like Paramiko's SSHClient.exec_command, expect blocking and no
@@ -82,3 +233,28 @@ class SSHClient:
         channel.exec_command(command, **kwargs)
         stdout, stderr, exit_code = self._block_on_command(channel)
         return stdout, stderr, exit_code
+
+    def stream_command(self, command, callback, get_pty=True, tail_size=TAIL_SIZE, **kwargs):
+        """Like ``exec_command``, but the output is handed to ``callback`` line
+        by line while the command runs, instead of being held in memory.
+
+        :Returns: Tuple (stdout_tail, stderr_tail, exit_code)
+
+        :param command: The CLI command to run. Syntax should be 1-for-1 to normal SSH/Shell
+        :type command: String
+
+        :param callback: Called with every line of output, i.e. ``logger.info``
+        :type callback: Function
+
+        :param get_pty: Obtain a pseudoterminal. Default is True
+        :type get_pty: Boolean
+
+        :param tail_size: How many bytes at the end of stdout and stderr to return
+        :type tail_size: Integer
+        """
+        transport = self._ssh.get_transport()
+        channel = transport.open_session()
+        if get_pty:
+            channel.get_pty()
+        channel.exec_command(command, **kwargs)
+        return self._stream_command(channel, callback, tail_size=tail_size)
@@ -0,0 +1,245 @@
+# -*- coding: UTF-8 -*-
+"""
+A per-process pool of logged in vCenter sessions.
+
+Logging into (and out of) vCenter is several SOAP round trips, which is a large
+part of the time spent by short tasks like ``ecs.show``. Instead of doing a full
+login/logout per function call, the functions in ``vmware.py`` borrow an
+established session from this pool, and hand it back once they're done.
+
+.. note::
+    Celery forks its worker processes, and a forked child must never reuse the
+    socket of a session that was opened in the parent. The pool notices when
+    it's being used from a new PID, and starts over without logging out the
+    sessions it inherited.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from vlab_inf_common.vmware import vCenter, vim
+
+from vlab_ecs_api.lib import const
+from vlab_ecs_api.lib.worker import timing
+
+
+class SessionPool:
+    """Hands out logged in vCenter sessions, and keeps them alive between uses.
+
+    :param factory: Called with no arguments to log into vCenter
+    :type factory: Callable
+
+    :param max_size: The most sessions that can be open at once
+    :type max_size: Integer
+
+    :param idle_timeout: How many seconds an unused session is kept before logging it out
+    :type idle_timeout: Integer
+
+    :param check_interval: How many seconds a session can go without verifying it's still logged in
+    :type check_interval: Integer
+    """
+    def __init__(self, factory, max_size, idle_timeout, check_interval):
+        self._factory = factory
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._check_interval = check_interval
+        self._reset()
+
+    def _reset(self):
+        """Forget every session, along with the lock that guards them"""
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        # Each item is [vcenter, last_used, last_checked]; the end of the list
+        # is the most recently used session.
+        self._idle = []
+        self._in_use = 0
+        self._stats = {'hits': 0,
+                       'logins': 0,
+                       'relogins': 0,
+                       'expired': 0,
+                       'waits': 0,
+                       'wait_time': 0.0,
+                      }
+
+    def stats(self):
+        """Obtain counters about how the pool has been used
+
+        :Returns: Dictionary
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._in_use
+        return stats
+
+    def close(self):
+        """Log out every idle session
+
+        :Returns: None
+        """
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for vcenter, _, _ in idle:
+            logout(vcenter)
+
+    @contextmanager
+    def session(self):
+        """Borrow a logged in session for the duration of the ``with`` block
+
+        :Returns: vlab_inf_common.vmware.vCenter
+        """
+        with timing.phase('vcenter_session'):
+            entry = self._checkout()
+        healthy = True
+        try:
+            yield entry[0]
+        except vim.fault.NotAuthenticated:
+            healthy = False
+            raise
+        except Exception:
+            # Could be a dropped connection; make the next user verify the session
+            entry[2] = 0
+            raise
+        finally:
+            self._checkin(entry, healthy)
+
+    def _checkout(self):
+        """Take an idle session, or log in if there isn't one
+
+        :Returns: List
+        """
+        if os.getpid() != self._pid:
+            self._reset()
+        with self._cond:
+            expired = self._pop_expired()
+            if not self._idle and self._in_use >= self._max_size:
+                started = time.time()
+                while not self._idle and self._in_use >= self._max_size:
+                    self._cond.wait()
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += time.time() - started
+            self._in_use += 1
+            entry = self._idle.pop() if self._idle else None
+            if entry:
+                self._stats['hits'] += 1
+        for vcenter, _, _ in expired:
+            logout(vcenter)
+        if entry:
+            # vCenter memoizes the network list; a new network must be visible to the next task
+            entry[0]._net_cache = None
+        try:
+            if entry is None:
+                entry = self._login(relogin=False)
+            elif time.time() - entry[2] > self._check_interval:
+                if _is_logged_in(entry[0]):
+                    entry[2] = time.time()
+                else:
+                    logout(entry[0])
+                    entry = self._login(relogin=True)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return entry
+
+    def _checkin(self, entry, healthy):
+        """Return a borrowed session to the pool
+
+        :Returns: None
+
+        :param entry: The session, and when it was last used and checked
+        :type entry: List
+
+        :param healthy: Set to False to log out the session instead of keeping it
+        :type healthy: Boolean
+        """
+        if not healthy:
+            logout(entry[0])
+        with self._cond:
+            self._in_use -= 1
+            if healthy:
+                entry[1] = time.time()
+                self._idle.append(entry)
+            self._cond.notify()
+
+    def _login(self, relogin):
+        """Open a new session to vCenter
+
+        :Returns: List
+
+        :param relogin: Set to True if this login replaces a timed out session
+        :type relogin: Boolean
+        """
+        vcenter = self._factory()
+        now = time.time()
+        with self._cond:
+            if relogin:
+                self._stats['relogins'] += 1
+            else:
+                self._stats['logins'] += 1
+        return [vcenter, now, now]
+
+    def _pop_expired(self):
+        """Remove sessions that have been idle too long. Caller must hold the lock.
+
+        :Returns: List
+        """
+        cutoff = time.time() - self._idle_timeout
+        expired = [x for x in self._idle if x[1] < cutoff]
+        if expired:
+            self._idle = [x for x in self._idle if x[1] >= cutoff]
+            self._stats['expired'] += len(expired)
+        return expired
+
+
+def _is_logged_in(vcenter):
+    """Determine if vCenter still considers the session valid
+
+    :Returns: Boolean
+
+    :param vcenter: The session to check
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    try:
+        return vcenter.content.sessionManager.currentSession is not None
+    except Exception:
+        return False
+
+
+def logout(vcenter):
+    """Close a session, ignoring errors because the session might already be dead
+
+    :Returns: None
+
+    :param vcenter: The session to close
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    try:
+        vcenter.close()
+    except Exception:
+        pass
+
+
+def login():
+    """Log into the vCenter server defined by the service's constants
+
+    :Returns: vlab_inf_common.vmware.vCenter
+    """
+    return vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER,
+                   password=const.INF_VCENTER_PASSWORD)
+
+
+POOL = SessionPool(factory=login,
+                   max_size=const.VLAB_ECS_VCENTER_POOL_SIZE,
+                   idle_timeout=const.VLAB_ECS_VCENTER_IDLE_TIMEOUT,
+                   check_interval=const.VLAB_ECS_VCENTER_CHECK_INTERVAL)
+
+
+def vcenter_session():
+    """Borrow a logged in vCenter session from this process' pool
+
+    :Returns: contextlib.ContextManager
+    """
+    return POOL.session()
@@ -4,15 +4,24 @@ Contains logic for bootstrapping a CentOS 7 VM into an ECS appliance.
 For whatever reason, ECS requires a TTY (or PTY) to configure. As a workaround,
 this module leverages SSH to mimic a user.
 """
+import re
+import shlex
 import textwrap
+from collections import namedtuple
 
-from vlab_ecs_api.lib import const
+from vlab_ecs_api.lib import const, metrics
+from vlab_ecs_api.lib.worker import timing
 from vlab_ecs_api.lib.worker.remote_shell import SSHClient
 
 
 CONFIG_FILE = '/home/admin/ECS-CommunityEdition/deploy.yml'
-ECS_VM_LOGFILE = '2>&1 >> /home/admin/auto_config.log' # redirects stderr and stdout to a file
+# Copies stderr and stdout to a file on the VM, while still sending it back to
+# the worker so it can be logged as the step runs
+ECS_VM_LOGFILE = '2>&1 | /usr/bin/tee -a /home/admin/auto_config.log'
 SED_COMMAND = '/usr/bin/sed'
+GREP_COMMAND = '/usr/bin/grep'
+# Prefixes the lines of output that report an edit which didn't take
+EDIT_FAILED = 'EDIT FAILED:'
 # Gross, right? Well ECS devs assume a TTY, and have shitty path management.
 # This means if you just "sudo at the start" to avoid the prompt in your
 # automation, you'll break the path. So fuck it, just run some bull shit command
@@ -20,12 +29,27 @@ SED_COMMAND = '/usr/bin/sed'
 # a password.
 # Finally, it's up to the client to read the profile to set some env vars
 # if we don't do this, for some reason, starting ntpd hangs...
-PRIME_SUDO = '. .profile ; /bin/echo {} | /usr/bin/sudo -Si /usr/bin/date &&'.format(const.VLAB_ECS_ADMIN_PW)
+# The pipefail is so piping to ``tee`` doesn't hide the exit code of the step.
+PRIME_SUDO = 'set -o pipefail ; . .profile ; /bin/echo {} | /usr/bin/sudo -Si /usr/bin/date &&'.format(const.VLAB_ECS_ADMIN_PW)
 
+# A literal substitution to make in deploy.yml; ``description`` finishes the
+# sentence "Failed to ..." in error messages. Only whole values are replaced,
+# so ``old`` doesn't match the start of a longer value (i.e. 192.168.2.25).
+ConfigEdit = namedtuple('ConfigEdit', 'description old new')
+# One resumable step of configuring ECS; ``run`` is called with the SSH client and logger
+Stage = namedtuple('Stage', 'name description run')
+STAGES = ('update_config', 'update_deploy', 'step1', 'step2')
+# The ECS IP in deploy.yml until ``update_config`` changes it
+DEFAULT_ECS_IP = '192.168.2.200'
 
-def configure(ssh_port, gateway_ip, ecs_ip, logger):
+
+def configure(ssh_port, gateway_ip, ecs_ip, logger, completed=(), checkpoint=None, config_ip=DEFAULT_ECS_IP):
     """A convenient wrapper function to bootstrap a CentOS 7 VM into an ECS instance.
 
+    The work is split into the named stages in ``STAGES``. A stage listed in
+    ``completed`` is skipped, so a configuration that failed (or was killed)
+    part way through can resume where it left off.
+
     :Returns: None
 
     :param ssh_port: The port on the gateway which forwards SSH to the ECS instance
@@ -39,115 +63,111 @@ def configure(ssh_port, gateway_ip, ecs_ip, logger):
 
     :param logger: The task logging object
     :type logger: logging.LoggerAdapter
+
+    :param completed: The names of the stages a previous attempt finished
+    :type completed: List
+
+    :param checkpoint: Called with the name of each stage once it's done
+    :type checkpoint: Function
+
+    :param config_ip: The ECS IP that deploy.yml has now, i.e. the one a previous attempt set
+    :type config_ip: String
     """
+    remaining = [x for x in _stages(ecs_ip, config_ip) if x.name not in completed]
+    if not remaining:
+        return
+    if len(remaining) < len(STAGES):
+        logger.info('Resuming at stage {}'.format(remaining[0].name))
     logger.info("SSHing into {} via port {}".format(gateway_ip, ssh_port))
-    ssh_client = SSHClient(hostname=gateway_ip,
-                           port=ssh_port,
-                           username=const.VLAB_ECS_ADMIN,
-                           password=const.VLAB_ECS_ADMIN_PW)
-
-    logger.info('Updating config: {}'.format(CONFIG_FILE))
-    _accept_license(ssh_client, CONFIG_FILE, logger)
-    _update_ip(ssh_client, ecs_ip, CONFIG_FILE, logger)
-    _update_disk(ssh_client, CONFIG_FILE, logger)
-    _update_dns_and_ntp(ssh_client, CONFIG_FILE, logger)
-    logger.info('Running update_deploy')
-    _run_update_deploy(ssh_client, logger)
-    logger.info('Running Step 1')
-    _run_step1(ssh_client, logger)
-    logger.info('Running Step 2')
-    _run_step2(ssh_client, logger)
-
-
-def _accept_license(ssh_client, config_file, logger):
-    """Update the ECS config so it doesn't prompt the automation to accept the EULA
+    with timing.phase('ssh_connect'):
+        ssh_client = SSHClient(hostname=gateway_ip,
+                               port=ssh_port,
+                               username=const.VLAB_ECS_ADMIN,
+                               password=const.VLAB_ECS_ADMIN_PW)
+    for stage in remaining:
+        logger.info(stage.description)
+        with metrics.SSH_STAGE.labels(stage=stage.name).time(), timing.phase(stage.name):
+            stage.run(ssh_client, logger)
+        if checkpoint:
+            checkpoint(stage.name)
 
-    :Returns: None
 
-    :Raises: RuntimeError
+def _stages(ecs_ip, config_ip=DEFAULT_ECS_IP):
+    """The steps to configure ECS, in the order they must run
 
-    :param ssh_client: An established ssh connection to the ECS instance
-    :type ssh_client: vlab_ecs_api.lib.worker.remote_shell.SSHClient
+    :Returns: List of Stage
 
-    :param config_file: The location of the ECS deploy.yml file
-    :type config_file: String
+    :param ecs_ip: The IP (inside the NAT) that the ECS instance should bind to
+    :type ecs_ip: String
 
-    :param logger: The task logging object
-    :type logger: logging.LoggerAdapter
+    :param config_ip: The ECS IP that deploy.yml has now
+    :type config_ip: String
     """
-    license_string = 'license_accepted: false'
-    license_accept = 'license_accepted: true'
-    args = " -i -e 's/{}/{}/g' {}".format(license_string, license_accept, config_file)
-    command = '{} {}'.format(SED_COMMAND, args)
-    stdout, stderr, exit_code = ssh_client.exec_command(command)
-    if exit_code:
-        message = 'Failed to update config to accept software license'
-        logger.error(message)
-        logger.error('EC: {}, TYPE: {}'.format(exit_code, type(exit_code)))
-        logger.error('\nCMD: {}\nEC: {}\nSTDOUT:{}\nSTDERR:{}'.format(command, exit_code, stdout, stderr))
-        raise RuntimeError(message)
-
+    def update_config(ssh_client, logger):
+        _edit_config(ssh_client, _config_edits(ecs_ip, config_ip), CONFIG_FILE, logger)
 
-def _update_ip(ssh_client, ecs_ip, config_file, logger):
-    """Update the ECS config to bind to the external IP of the CentOS VM
+    return [Stage('update_config', 'Updating config: {}'.format(CONFIG_FILE), update_config),
+            Stage('update_deploy', 'Running update_deploy', _run_update_deploy),
+            Stage('step1', 'Running Step 1', _run_step1),
+            Stage('step2', 'Running Step 2', _run_step2)]
 
-    :Returns: None
 
-    :Raises: RuntimeError
+def _config_edits(ecs_ip, config_ip=DEFAULT_ECS_IP):
+    """The changes ``deploy.yml`` needs before ECS can be deployed in vLab
 
-    :param ssh_client: An established ssh connection to the ECS instance
-    :type ssh_client: vlab_ecs_api.lib.worker.remote_shell.SSHClient
+    :Returns: List of ConfigEdit
 
     :param ecs_ip: The IP (inside the NAT) that the ECS instance should bind to
     :type ecs_ip: String
 
-    :param config_file: The location of the ECS deploy.yml file
-    :type config_file: String
-
-    :param logger: The task logging object
-    :type logger: logging.LoggerAdapter
+    :param config_ip: The ECS IP that deploy.yml has now
+    :type config_ip: String
     """
-    default_ecs_ip = '192.168.2.200'
-    args = " -i -e 's/{}/{}/g' {}".format(default_ecs_ip, ecs_ip, config_file)
-    command = '{} {}'.format(SED_COMMAND, args)
-    stdout, stderr, exit_code = ssh_client.exec_command(command)
-    if exit_code:
-        message = 'Failed to change the default ECS IP in the config'
-        logger.error(message)
-        logger.error('\nCMD: {}\nEC: {}\nSTDOUT:{}\nSTDERR:{}'.format(command, exit_code, stdout, stderr))
-        raise RuntimeError(message)
+    return [ConfigEdit('accept the software license', 'license_accepted: false', 'license_accepted: true'),
+            ConfigEdit('change the ECS IP', config_ip, ecs_ip),
+            ConfigEdit('use the correct block device for the object store', '/dev/vda', '/dev/sdb'),
+            ConfigEdit("use the user's vLab gateway for DNS and NTP", '192.168.2.2', '192.168.1.1')]
 
 
-def _update_disk(ssh_client, config_file, logger):
-    """Update the ECS config to use the correct block device for the object store
+def _sed_escape(text, replacement=False):
+    """Escape a literal string so ``sed`` doesn't treat any of it as a regex
 
-    :Returns: None
+    :Returns: String
 
-    :Raises: RuntimeError
+    :param text: The literal string
+    :type text: String
 
-    :param ssh_client: An established ssh connection to the ECS instance
-    :type ssh_client: vlab_ecs_api.lib.worker.remote_shell.SSHClient
+    :param replacement: Set to True if ``text`` is the replacement of an ``s`` command
+    :type replacement: Boolean
+    """
+    if replacement:
+        return re.sub(r'([\\/&])', r'\\\1', text)
+    return re.sub(r'([\\/.*\[\]^$])', r'\\\1', text)
 
-    :param config_file: The location of the ECS deploy.yml file
-    :type config_file: String
 
-    :param logger: The task logging object
-    :type logger: logging.LoggerAdapter
+def _value_pattern(text):
+    """Make a (basic) regex that only matches ``text`` as a whole value, not part of a longer one
+
+    :Returns: String
+
+    :param text: The literal value, i.e. ``192.168.2.2``
+    :type text: String
     """
-    old_disk = '\/dev\/vda'
-    new_disk = '\/dev\/sdb'
-    args = " -i -e 's/{}/{}/g' {}".format(old_disk, new_disk, config_file)
-    command = '{} {}'.format(SED_COMMAND, args)
-    stdout, stderr, exit_code = ssh_client.exec_command(command)
-    if exit_code:
-        message = 'Failed to update the disk in config file'
-        logger.error(message)
-        logger.error('\nCMD: {}\nEC: {}\nSTDOUT:{}\nSTDERR:{}'.format(command, exit_code, stdout, stderr))
-        raise RuntimeError(message)
+    pattern = _sed_escape(text)
+    # A word boundary only exists next to a word character; '/dev/vda' can't start with one
+    if re.match(r'\w', text[0]):
+        pattern = r'\b' + pattern
+    if re.match(r'\w', text[-1]):
+        pattern += r'\b'
+    return pattern
 
 
-def _update_dns_and_ntp(ssh_client, config_file, logger):
-    """Update the ECS config to use the user's vLab gateway for DNS and NTP
+def _edit_config(ssh_client, edits, config_file, logger):
+    """Apply every edit to the ECS config with a single remote command
+
+    All the substitutions are made by one ``sed`` call, then every edit is
+    checked (the old value is gone, and the new one is present) so a failure
+    names exactly which edits didn't take.
 
     :Returns: None
 
@@ -156,22 +176,39 @@ def _update_dns_and_ntp(ssh_client, config_file, logger):
     :param ssh_client: An established ssh connection to the ECS instance
     :type ssh_client: vlab_ecs_api.lib.worker.remote_shell.SSHClient
 
+    :param edits: The changes to make to the config
+    :type edits: List of ConfigEdit
+
     :param config_file: The location of the ECS deploy.yml file
     :type config_file: String
 
     :param logger: The task logging object
     :type logger: logging.LoggerAdapter
     """
-    default_ip = '192.168.2.2'
-    new_ip = '192.168.1.1'
-    args = " -i -e 's/{}/{}/g' {}".format(default_ip, new_ip, config_file)
-    command = '{} {}'.format(SED_COMMAND, args)
+    expressions = []
+    checks = []
+    for edit in edits:
+        expression = 's/{}/{}/g'.format(_value_pattern(edit.old), _sed_escape(edit.new, replacement=True))
+        expressions.append('-e {}'.format(shlex.quote(expression)))
+        check = '{{ {0} -q -- {1} {3} || ! {0} -q -- {2} {3} ; }} && /bin/echo {4} ;'
+        checks.append(check.format(GREP_COMMAND,
+                                   shlex.quote(_value_pattern(edit.old)),
+                                   shlex.quote(_value_pattern(edit.new)),
+                                   config_file,
+                                   shlex.quote('{} {}'.format(EDIT_FAILED, edit.description))))
+    # The trailing "true" keeps the exit code about sed; the checks report via stdout
+    command = '{} -i {} {} && {{ {} true ; }}'.format(SED_COMMAND, ' '.join(expressions), config_file, ' '.join(checks))
     stdout, stderr, exit_code = ssh_client.exec_command(command)
     if exit_code:
-        message = 'Failed to update NTP and DNS servers'
+        message = 'Failed to update config file {}'.format(config_file)
         logger.error(message)
         logger.error('\nCMD: {}\nEC: {}\nSTDOUT:{}\nSTDERR:{}'.format(command, exit_code, stdout, stderr))
         raise RuntimeError(message)
+    failed = [x[len(EDIT_FAILED):].strip() for x in stdout.splitlines() if x.startswith(EDIT_FAILED)]
+    if failed:
+        message = 'Failed to {} in config file {}'.format(', '.join(failed), config_file)
+        logger.error(message)
+        raise RuntimeError(message)
 
 
 def _run_update_deploy(ssh_client, logger):
@@ -189,7 +226,7 @@ def _run_update_deploy(ssh_client, logger):
     """
     update_deploy = '/home/admin/bin/update_deploy'
     command = "{} {} {}".format(PRIME_SUDO, update_deploy, ECS_VM_LOGFILE)
-    stdout, stderr, exit_code = ssh_client.exec_command(command)
+    stdout, stderr, exit_code = ssh_client.stream_command(command, callback=logger.info)
     if exit_code:
         message = 'Failed to run update_deploy'
         logger.error(message)
@@ -212,9 +249,9 @@ def _run_step1(ssh_client, logger):
     """
     step1 = '/home/admin/bin/ova-step1'
     command = "{} {} {}".format(PRIME_SUDO, step1, ECS_VM_LOGFILE)
-    stdout, stderr, exit_code = ssh_client.exec_command(command)
+    stdout, stderr, exit_code = ssh_client.stream_command(command, callback=logger.info)
     if exit_code:
-        stdout, stderr, exit_code = ssh_client.exec_command(command)
+        stdout, stderr, exit_code = ssh_client.stream_command(command, callback=logger.info)
         # not sure why, but this typically fails the first time, but works the 2nd
         if exit_code:
             message = 'Failed to run step1'
@@ -238,7 +275,7 @@ def _run_step2(ssh_client, logger):
     """
     step2 = '/home/admin/bin/ova-step2'
     command = "{} {} {}".format(PRIME_SUDO, step2, ECS_VM_LOGFILE)
-    stdout, stderr, exit_code = ssh_client.exec_command(command)
+    stdout, stderr, exit_code = ssh_client.stream_command(command, callback=logger.info)
     if exit_code:
         message = 'Failed to run step2'
         logger.error(message)
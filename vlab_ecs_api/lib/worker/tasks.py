@@ -2,16 +2,60 @@
 """
 Entry point logic for available backend worker tasks
 """
+import functools
+
 from celery import Celery
+from celery.signals import worker_process_init, worker_init
 from vlab_api_common import get_task_logger
 
-from vlab_ecs_api.lib import const
-from vlab_ecs_api.lib.worker import vmware, setup_ecs
+from vlab_ecs_api.lib import const, celery_config, metrics
+from vlab_ecs_api.lib.worker import vmware, setup_ecs, inventory_cache, warm_pool, timing
+
+app = Celery('ecs', broker=const.VLAB_MESSAGE_BROKER)
+celery_config.configure(app)
+
+
+def _traced(func):
+    """Time the phases of a task, and return them in its ``params`` when the sender asked to
+
+    :Returns: Function
+
+    :param func: The (bound) task function
+    :type func: Function
+    """
+    @functools.wraps(func)
+    def inner(self, *args, **kwargs):
+        with timing.trace() as timer:
+            resp = func(self, *args, **kwargs)
+        if getattr(self.request, celery_config.TRACE_HEADER, False):
+            resp['params']['timings'] = timer.trace()
+        return resp
+    return inner
+
 
-app = Celery('ecs', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+@worker_init.connect
+def _start_metrics_server(**kwargs):
+    """Serve the worker's metrics from the main process, which outlives the task processes"""
+    if const.VLAB_ECS_METRICS_PORT:
+        metrics.start_worker_server(const.VLAB_ECS_METRICS_PORT)
+
+
+@worker_init.connect
+def _start_inventory_watcher(**kwargs):
+    """Invalidations go through the shared result store, so one watcher (in the main process) serves every process"""
+    if const.VLAB_ECS_INVENTORY_WATCH and inventory_cache.INVENTORY.shared:
+        inventory_cache.start_watcher()
+
+
+@worker_process_init.connect
+def _start_process_inventory_watcher(**kwargs):
+    """Without a shared result store, a worker process only sees the invalidations of its own watcher"""
+    if const.VLAB_ECS_INVENTORY_WATCH and not inventory_cache.INVENTORY.shared:
+        inventory_cache.start_watcher()
 
 
 @app.task(name='ecs.show', bind=True)
+@_traced
 def show(self, username, txn_id):
     """Obtain basic information about Ecs
 
@@ -27,18 +71,20 @@ def show(self, username, txn_id):
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
     try:
-        info = vmware.show_ecs(username)
+        info = inventory_cache.INVENTORY.get(username, vmware.show_ecs)
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
     else:
         logger.info('Task complete')
         resp['content'] = info
+    resp['params']['inventory_cache'] = inventory_cache.INVENTORY.stats()
     return resp
 
 
 @app.task(name='ecs.create', bind=True)
-def create(self, username, machine_name, image, network, txn_id):
+@_traced
+def create(self, username, machine_name, image, network, txn_id, bulk=False):
     """Deploy a new instance of Ecs
 
     :Returns: Dictionary
@@ -57,6 +103,10 @@ def create(self, username, machine_name, image, network, txn_id):
 
     :param txn_id: A unique string supplied by the client to track the call through logs
     :type txn_id: String
+
+    :param bulk: Set when the task is part of a bulk create; any failure is then
+                 reported in the result, so it only fails this one instance
+    :type bulk: Boolean
     """
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
@@ -66,11 +116,24 @@ def create(self, username, machine_name, image, network, txn_id):
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    except Exception as doh:
+        if not bulk:
+            raise
+        # A failed task would fail the chord, and lose the result of every other instance
+        logger.exception('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    finally:
+        inventory_cache.INVENTORY.invalidate(username)
+        if const.VLAB_ECS_WARM_POOL_SIZE:
+            # Replace the VM that was (or should have been) taken from the pool
+            refill_pool.apply_async(kwargs={'txn_id': txn_id, 'version': image})
+            resp['params']['warm_pool'] = warm_pool.STATS.stats()
     logger.info('Task complete')
     return resp
 
 
 @app.task(name='ecs.delete', bind=True)
+@_traced
 def delete(self, username, machine_name, txn_id):
     """Destroy an instance of Ecs
 
@@ -95,10 +158,68 @@ def delete(self, username, machine_name, txn_id):
         resp['error'] = '{}'.format(doh)
     else:
         logger.info('Task complete')
+    finally:
+        inventory_cache.INVENTORY.invalidate(username)
+    return resp
+
+
+@app.task(name='ecs.bulk_results', bind=True)
+def bulk_results(self, results, machine_names, txn_id):
+    """Combine the results of the ``ecs.create`` tasks of a bulk create, i.e. the callback of its chord
+
+    :Returns: Dictionary
+
+    :param results: The result of every ``ecs.create`` task, in the same order as ``machine_names``
+    :type results: List
+
+    :param machine_names: The names of the new instances of Ecs
+    :type machine_names: List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    for machine_name, result in zip(machine_names, results):
+        resp['content'][machine_name] = {'content': result['content'].get(machine_name, {}),
+                                         'error': result['error']}
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='ecs.bulk_delete', bind=True)
+@_traced
+def bulk_delete(self, username, machine_names, txn_id):
+    """Destroy many instances of Ecs at once
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants to delete the instances of Ecs
+    :type username: String
+
+    :param machine_names: The names of the instances of Ecs
+    :type machine_names: List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.bulk_delete_ecs(username, machine_names, logger)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    finally:
+        inventory_cache.INVENTORY.invalidate(username)
+    logger.info('Task complete')
     return resp
 
 
 @app.task(name='ecs.image', bind=True)
+@_traced
 def image(self, txn_id):
     """Obtain a list of available images/versions of Ecs that can be created
 
@@ -115,7 +236,104 @@ def image(self, txn_id):
     return resp
 
 
+@app.task(name='ecs.healthcheck', bind=True)
+@_traced
+def healthcheck(self, txn_id):
+    """Check that this worker can use its sessions to vCenter
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    try:
+        vmware.ping_vcenter()
+    except Exception as doh:
+        # Whatever the failure, the answer is "vCenter isn't reachable"
+        logger.error('Health check failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    return resp
+
+
+@app.task(name='ecs.sync_templates', bind=True)
+@_traced
+def sync_templates(self, txn_id):
+    """Destroy the base VMs (used to clone ECS) of images that were removed or replaced
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    resp['content'] = vmware.sync_templates(logger)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='ecs.refill_pool', bind=True)
+@_traced
+def refill_pool(self, txn_id, version=None):
+    """Queue an ``ecs.add_to_pool`` for every VM missing from the warm pool
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+
+    :param version: Only refill the pool of this version. Default is every version.
+    :type version: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.refill_pool(logger, version=version)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        # One task per VM, so deploys spread over the workers and queue behind user creates
+        for a_version, size in resp['content'].items():
+            for _ in range(size['missing']):
+                add_to_pool.apply_async(kwargs={'txn_id': txn_id, 'version': a_version})
+    resp['params']['warm_pool'] = warm_pool.STATS.stats()
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='ecs.add_to_pool', bind=True)
+@_traced
+def add_to_pool(self, txn_id, version):
+    """Deploy one VM into the warm pool, unless the pool filled up in the meantime
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+
+    :param version: The version of ECS to deploy
+    :type version: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = {'added': vmware.add_to_pool(version, logger)}
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    resp['params']['warm_pool'] = warm_pool.STATS.stats()
+    logger.info('Task complete')
+    return resp
+
+
 @app.task(name='ecs.modify_network', bind=True)
+@_traced
 def modify_network(self, username, machine_name, new_network, txn_id):
     """Change the network an InsightIQ instance is connected to"""
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
@@ -126,11 +344,27 @@ def modify_network(self, username, machine_name, new_network, txn_id):
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    finally:
+        inventory_cache.INVENTORY.invalidate(username)
     logger.info('Task complete')
     return resp
 
 
+def _report_progress(task, **progress):
+    """Publish how far along a long running task is, as the PROGRESS state
+
+    :Returns: None
+
+    :param task: The bound, running task
+    :type task: celery.Task
+    """
+    # No task id means it wasn't sent via the broker (i.e. called directly)
+    if task.request.id:
+        task.update_state(state='PROGRESS', meta=progress)
+
+
 @app.task(name='ecs.config', bind=True)
+@_traced
 def config(self, username, machine_name, ssh_port, gateway_ip, ecs_ip, txn_id):
     """Turn the ECS instance into a 'ready to use thing'"""
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ECS_LOG_LEVEL.upper())
@@ -139,9 +373,30 @@ def config(self, username, machine_name, ssh_port, gateway_ip, ecs_ip, txn_id):
     try:
         the_vm = vmware.show_ecs(username)[machine_name]
         if not the_vm['meta']['configured']:
-            setup_ecs.configure(ssh_port, gateway_ip, ecs_ip, logger)
-            the_vm['meta']['configured'] = True
-            vmware.set_meta(username, machine_name, the_vm['meta'])
+            meta = the_vm['meta']
+            progress = meta.get('config_stages', {})
+            # deploy.yml keeps the IP it was last given, even when the stages start over
+            config_ip = progress.get('config_ip', setup_ecs.DEFAULT_ECS_IP)
+            if progress.get('ecs_ip') != ecs_ip:
+                # The finished stages were for a different IP; they don't count
+                progress = {'ecs_ip': ecs_ip, 'completed': [], 'config_ip': config_ip}
+            meta['config_stages'] = progress
+
+            def checkpoint(stage):
+                progress['completed'].append(stage)
+                if stage == 'update_config':
+                    progress['config_ip'] = ecs_ip
+                vmware.set_meta(username, machine_name, meta)
+                inventory_cache.INVENTORY.invalidate(username)
+                _report_progress(self, stage=stage, completed=list(progress['completed']),
+                                 stages=list(setup_ecs.STAGES))
+
+            setup_ecs.configure(ssh_port, gateway_ip, ecs_ip, logger,
+                                completed=list(progress['completed']),
+                                checkpoint=checkpoint,
+                                config_ip=config_ip)
+            meta['configured'] = True
+            vmware.set_meta(username, machine_name, meta)
         else:
             resp['error'] = 'Unable to configure an already configured ECS instance'
     except (ValueError, RuntimeError) as doh:
@@ -149,5 +404,7 @@ def config(self, username, machine_name, ssh_port, gateway_ip, ecs_ip, txn_id):
         resp['error'] = '{}'.format(doh)
     except KeyError:
         resp['error'] = 'No such ECS instanced named {} found'.format(machine_name)
+    finally:
+        inventory_cache.INVENTORY.invalidate(username)
     logger.info('Task complete')
     return resp
@@ -0,0 +1,262 @@
+# -*- coding: UTF-8 -*-
+"""
+Base VMs that new ECS instances are cloned from, so creating an instance
+doesn't upload several GB of OVA every time.
+
+When ``VLAB_ECS_DEPLOY_MODE`` is ``clone``, the first deploy of an image version
+imports the OVA into the ``VLAB_ECS_TEMPLATE_DIR`` folder (under the vLab base
+folder), and snapshots it. Every deploy after that clones that base VM. By
+default the clone is a linked clone, which shares the base VM's disks and only
+writes what changes; set ``VLAB_ECS_FULL_CLONE`` to copy the disks instead.
+
+A base VM records the mtime of the OVA it came from, so replacing an OVA (or
+removing it) retires the base VM; see ``vmware.sync_templates``. A retired base
+VM is only destroyed once no VM's disks are children of its disks, because
+vCenter lets you destroy a base VM out from under a powered off linked clone.
+"""
+import re
+import time
+
+import ujson
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim, virtual_machine, consume_task
+
+from vlab_ecs_api.lib import const
+from vlab_ecs_api.lib.worker import property_collector
+
+# The meta data "component" of a base VM; keeps them out of ``show_ecs``
+TEMPLATE_COMPONENT = 'EcsTemplate'
+SNAPSHOT_NAME = 'vlab-base'
+# Same as ``virtual_machine.deploy_from_ova``, which clones skip
+MACHINE_NAME_REGEX = re.compile(r'^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$')
+# Copying the disks of a full clone can take a while
+CLONE_TIMEOUT = 1800
+
+
+def template_name(version, image_mtime):
+    """The name of the base VM made from a specific OVA of a version of ECS
+
+    The mtime is part of the name so a base VM for a replaced OVA can be made
+    while linked clones of the old one still exist (and still need its disks).
+
+    :Returns: String
+
+    :param version: The version of ECS, i.e. ``3.2.2``
+    :type version: String
+
+    :param image_mtime: The ``st_mtime_ns`` of the OVA
+    :type image_mtime: Integer
+    """
+    return 'ECS-{}-base-{}'.format(version, image_mtime)
+
+
+def service_folder(vcenter, name):
+    """Obtain (creating if needed) a folder, under the vLab base folder, that
+    holds VMs this service manages for itself (instead of for a user)
+
+    :Returns: vim.Folder
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param name: The name of the folder
+    :type name: String
+    """
+    path = '{}/{}'.format(const.INF_VCENTER_TOP_LVL_DIR, name)
+    try:
+        return vcenter.get_vm_folder(path=path)
+    except FileNotFoundError:
+        vcenter.create_vm_folder(path=path)
+        return vcenter.get_vm_folder(path=path)
+
+
+def template_folder(vcenter):
+    """Obtain (creating if needed) the folder that holds every base VM
+
+    :Returns: vim.Folder
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    return service_folder(vcenter, const.VLAB_ECS_TEMPLATE_DIR)
+
+
+def find_templates(vcenter):
+    """Obtain every usable base VM, and its meta data
+
+    :Returns: List of Tuples (vim.VirtualMachine, Dictionary)
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    found = []
+    folder = template_folder(vcenter)
+    for the_vm, props in property_collector.retrieve_children(vcenter, folder, ['name', 'config.annotation']):
+        try:
+            meta = ujson.loads(props['config.annotation'])
+        except (KeyError, ValueError, TypeError):
+            # Still being built, or the build failed
+            continue
+        if meta.get('component') == TEMPLATE_COMPONENT:
+            found.append((the_vm, meta))
+    return found
+
+
+def get_template(vcenter, version, image_mtime):
+    """Obtain the base VM for a version of ECS, if it was made from the current OVA
+
+    :Returns: vim.VirtualMachine or None
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param version: The version of ECS, i.e. ``3.2.2``
+    :type version: String
+
+    :param image_mtime: The ``st_mtime_ns`` of the OVA for the version
+    :type image_mtime: Integer
+    """
+    for the_vm, meta in find_templates(vcenter):
+        if meta['version'] == version and meta.get('image_mtime') == image_mtime:
+            return the_vm
+    return None
+
+
+def users(vcenter, template_vms):
+    """Find the VMs whose disks are children (i.e. linked clones) of a base VM's disks
+
+    Every VM's disks are read in one call, however many base VMs are checked.
+
+    :Returns: Dictionary of vim.VirtualMachine (the base VM) -> List of names of the VMs using it
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param template_vms: The base VMs to check
+    :type template_vms: List of vim.VirtualMachine
+    """
+    found = {x: [] for x in template_vms}
+    if not template_vms:
+        return found
+    everything = property_collector.retrieve_by_type(vcenter, ['name', 'config.hardware.device'], vim.VirtualMachine)
+    chains = {the_vm: _disk_chain(props.get('config.hardware.device')) for the_vm, props in everything}
+    for the_vm, props in everything:
+        if the_vm in found:
+            continue
+        for template_vm in template_vms:
+            if chains[the_vm] & chains.get(template_vm, set()):
+                found[template_vm].append(props.get('name', the_vm._moId))
+    return found
+
+
+def _disk_chain(devices):
+    """The files of every disk of a VM, along with the files of every disk they're a child of
+
+    :Returns: Set
+
+    :param devices: The virtual hardware of a VM (it's unset while a VM is being made)
+    :type devices: List of vim.vm.device.VirtualDevice
+    """
+    files = set()
+    for device in devices or []:
+        if not isinstance(device, vim.vm.device.VirtualDisk):
+            continue
+        backing = device.backing
+        while backing is not None:
+            file_name = getattr(backing, 'fileName', None)
+            if file_name:
+                files.add(file_name)
+            backing = getattr(backing, 'parent', None)
+    return files
+
+
+def create_template(vcenter, ova, network_map, version, image_mtime, mb_of_ram, logger):
+    """Import an OVA as the base VM for a version of ECS
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The OVA of the version
+    :type ova: vlab_inf_common.vmware.Ova
+
+    :param network_map: How the network in the OVA maps to one in vCenter
+    :type network_map: List of vim.OvfManager.NetworkMapping
+
+    :param version: The version of ECS, i.e. ``3.2.2``
+    :type version: String
+
+    :param image_mtime: The ``st_mtime_ns`` of the OVA
+    :type image_mtime: Integer
+
+    :param mb_of_ram: How much RAM clones of the base VM get
+    :type mb_of_ram: Integer
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    folder = template_folder(vcenter)
+    the_vm = virtual_machine.deploy_from_ova(vcenter=vcenter,
+                                             ova=ova,
+                                             network_map=network_map,
+                                             username=folder.name,
+                                             machine_name=template_name(version, image_mtime),
+                                             logger=logger,
+                                             power_on=False)
+    try:
+        virtual_machine.adjust_ram(the_vm, mb_of_ram=mb_of_ram)
+        snapshot_task = the_vm.CreateSnapshot_Task(name=SNAPSHOT_NAME,
+                                                   description='Linked clones of ECS {} share this'.format(version),
+                                                   memory=False,
+                                                   quiesce=False)
+        consume_task(snapshot_task)
+        # Set last; the meta data is what marks the base VM as usable
+        meta_data = {'component': TEMPLATE_COMPONENT,
+                     'created': time.time(),
+                     'version': version,
+                     'configured': False,
+                     'generation': 1,
+                     'image_mtime': image_mtime,
+                    }
+        virtual_machine.set_meta(the_vm, meta_data)
+    except (RuntimeError, vmodl.MethodFault):
+        # A half-built base VM would block making a good one (same name)
+        consume_task(the_vm.Destroy_Task())
+        raise
+    return the_vm
+
+
+def clone(vcenter, template, username, machine_name, config=None):
+    """Make a new VM from a base VM
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: ValueError if the machine name is invalid
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param template: The base VM to clone
+    :type template: vim.VirtualMachine
+
+    :param username: The user who will own the new VM
+    :type username: String
+
+    :param machine_name: The name to give the new VM
+    :type machine_name: String
+
+    :param config: Changes to make to the new VM as part of the clone
+    :type config: vim.vm.ConfigSpec
+    """
+    if not MACHINE_NAME_REGEX.match(machine_name):
+        error = 'Invalid machine name. Names can only contain characters a-z, A-Z, 0-9, periods (".") and dashes ("-"). Supplied: {}'.format(machine_name)
+        raise ValueError(error)
+    folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    relocate_spec = vim.vm.RelocateSpec(pool=vcenter.resource_pools[const.INF_VCENTER_RESORUCE_POOL])
+    clone_spec = vim.vm.CloneSpec(location=relocate_spec, powerOn=False, template=False, config=config)
+    if not const.VLAB_ECS_FULL_CLONE:
+        relocate_spec.diskMoveType = 'createNewChildDiskBacking'
+        clone_spec.snapshot = template.snapshot.currentSnapshot
+    task = template.CloneVM_Task(folder=folder, name=machine_name, spec=clone_spec)
+    return consume_task(task, timeout=CLONE_TIMEOUT)
@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+"""
+Measures how long each phase of a long running task takes
+
+A task can make a PhaseTimer the active one (see ``trace``) for the thread
+that runs it. Code deep in the call stack then records its phases with the
+module level ``phase``, without a timer being passed down to it. Outside of
+a trace, ``phase`` does nothing.
+"""
+import time
+import threading
+import contextlib
+
+from vlab_api_common import get_logger
+
+from vlab_ecs_api.lib import const
+
+logger = get_logger(__name__, loglevel=const.VLAB_ECS_LOG_LEVEL)
+_local = threading.local()
+
+
+class PhaseTimer:
+    """Records the wall-clock seconds of named phases, in the order they ran
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    def __init__(self, logger):
+        self._logger = logger
+        self._phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the body of a ``with`` block as the phase ``name``
+
+        The phase is recorded even if the block raises, so a failure still
+        shows how long it took to fail.
+
+        :Returns: None
+
+        :param name: What the phase is called, i.e. ``deploy``
+        :type name: String
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._phases.append((name, elapsed))
+            self._logger.debug('Phase {} took {:.2f} seconds'.format(name, elapsed))
+
+    def timings(self):
+        """Obtain how long each phase took; a repeated phase is summed
+
+        :Returns: Dictionary
+        """
+        timings = {}
+        for name, elapsed in self._phases:
+            timings[name] = timings.get(name, 0) + elapsed
+        return timings
+
+    def trace(self):
+        """Obtain every phase, in the order they ran, and the total
+
+        :Returns: Dictionary
+        """
+        phases = [{'name': x, 'seconds': round(y, 4)} for x, y in self._phases]
+        return {'phases': phases, 'total': round(sum(x[1] for x in self._phases), 4)}
+
+    def log(self):
+        """Log every phase, and the total, on a single line
+
+        :Returns: None
+        """
+        phases = ', '.join('{}={:.2f}s'.format(x, y) for x, y in self._phases)
+        total = sum(x[1] for x in self._phases)
+        self._logger.info('Timings: {} (total {:.2f}s)'.format(phases, total))
+
+
+@contextlib.contextmanager
+def trace():
+    """Make a new PhaseTimer the active one, for the body of a ``with`` block
+
+    :Returns: PhaseTimer
+    """
+    previous = active()
+    timer = PhaseTimer(logger)
+    _local.timer = timer
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+def active():
+    """Obtain the PhaseTimer of the trace that this thread is in
+
+    :Returns: PhaseTimer, or None when not in a trace
+    """
+    return getattr(_local, 'timer', None)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time the body of a ``with`` block as the phase ``name`` of the active trace
+
+    :Returns: None
+
+    :param name: What the phase is called, i.e. ``folder_lookup``
+    :type name: String
+    """
+    timer = active()
+    if timer is None:
+        yield
+        return
+    with timer.phase(name):
+        yield
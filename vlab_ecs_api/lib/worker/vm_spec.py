@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+"""
+Builds the ``vim.vm.ConfigSpec`` for a new ECS VM, so every change it needs
+(RAM, meta data, name and network) is made by one reconfigure (or clone) task
+instead of a vCenter task per change.
+"""
+import ujson
+from vlab_inf_common.vmware import vim
+
+# The keys ``virtual_machine.set_meta`` requires
+META_KEYS = {'component', 'created', 'version', 'generation', 'configured'}
+ADAPTER_LABEL = 'Network adapter 1'
+
+
+def config_spec(mb_of_ram=None, meta_data=None, name=None, nic=None):
+    """Combine changes to a VM into a single spec; only the supplied changes are made
+
+    :Returns: vim.vm.ConfigSpec
+
+    :Raises: ValueError - when invalid meta data supplied
+
+    :param mb_of_ram: The number of MB of RAM to give the VM
+    :type mb_of_ram: Integer
+
+    :param meta_data: The meta data to store in the notes of the VM
+    :type meta_data: Dictionary
+
+    :param name: The new name of the VM
+    :type name: String
+
+    :param nic: The change to the VM's network adapter, from ``nic_change``
+    :type nic: vim.vm.device.VirtualDeviceSpec
+    """
+    spec = vim.vm.ConfigSpec()
+    if mb_of_ram is not None:
+        spec.memoryMB = mb_of_ram
+    if meta_data is not None:
+        provided = set(meta_data.keys())
+        if not META_KEYS.issubset(provided):
+            error = "Invalid meta data schema. Supplied: {}, Required: {}".format(provided, META_KEYS)
+            raise ValueError(error)
+        spec.annotation = ujson.dumps(meta_data)
+    if name is not None:
+        spec.name = name
+    if nic is not None:
+        spec.deviceChange = [nic]
+    return spec
+
+
+def nic_change(devices, network, adapter_label=ADAPTER_LABEL):
+    """Connect a VM's network adapter to a different (distributed) network; the
+    same change as ``virtual_machine.change_network`` makes.
+
+    :Returns: vim.vm.device.VirtualDeviceSpec
+
+    :Raises: RuntimeError if the VM has no such network adapter
+
+    :param devices: The virtual hardware of the VM, i.e. ``vm.config.hardware.device``
+    :type devices: List of vim.vm.device.VirtualDevice
+
+    :param network: The network to connect to
+    :type network: vim.dvs.DistributedVirtualPortgroup
+
+    :param adapter_label: The name of the virtual NIC to connect
+    :type adapter_label: String
+    """
+    nics = [x for x in devices if x.deviceInfo.label == adapter_label]
+    if not nics:
+        error = "VM has no network adapter named {}".format(adapter_label)
+        raise RuntimeError(error)
+    nic_spec = vim.vm.device.VirtualDeviceSpec()
+    nic_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+    nic_spec.device = nics[0]
+    nic_spec.device.wakeOnLanEnabled = True
+    port = vim.dvs.PortConnection()
+    port.portgroupKey = network.key
+    port.switchUuid = network.config.distributedVirtualSwitch.uuid
+    nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+    nic_spec.device.backing.port = port
+    nic_spec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
+    nic_spec.device.connectable.startConnected = True
+    nic_spec.device.connectable.allowGuestControl = True
+    nic_spec.device.connectable.connected = True
+    return nic_spec
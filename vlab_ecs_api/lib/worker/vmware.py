@@ -1,13 +1,30 @@
 # -*- coding: UTF-8 -*-
 """Business logic for backend worker tasks"""
+import ssl
 import time
 import random
-import os.path
-from vlab_inf_common.vmware import vCenter, Ova, vim, virtual_machine, consume_task
+import hashlib
 
-from vlab_ecs_api.lib import const
+import ujson
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim, virtual_machine, consume_task
 
+from vlab_ecs_api.lib import const, metrics
+from vlab_ecs_api.lib.worker import property_collector, image_catalog, templates, warm_pool, vm_spec, timing
+from vlab_ecs_api.lib.worker.session_pool import vcenter_session
 
+# Every property show_ecs needs, so they're all obtained in one round trip
+VM_PROPERTIES = ['name', 'runtime.powerState', 'config.annotation', 'guest.net', 'network']
+# 16GB - https://github.com/EMCECS/ECS-CommunityEdition#quick-start-guide
+ECS_RAM = 16384
+# How many seconds a new VM has to report an IP; same as ``get_info(ensure_ip=True)``
+IP_TIMEOUT = 600
+# The most seconds to wait on powering off, or destroying, VMs
+TASK_TIMEOUT = 1800
+CONSOLE_URL = 'https://{0}/ui/webconsole.html?vmId={1}&vmName={2}&serverGuid={3}&locale=en_US&host={0}&sessionTicket={4}&thumbprint={5}'
+
+
+@metrics.timed
 def show_ecs(username):
     """Obtain basic information about Ecs
 
@@ -17,16 +34,187 @@ def show_ecs(username):
     :type username: String
     """
     ecs_vms = {}
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for vm in folder.childEntity:
-            info = virtual_machine.get_info(vcenter, vm, username)
-            if info['meta']['component'] == 'Ecs':
-                ecs_vms[vm.name] = info
+    with vcenter_session() as vcenter:
+        folder = _user_folder(vcenter, username)
+        ecs = []
+        for vm, props in property_collector.retrieve_children(vcenter, folder, VM_PROPERTIES):
+            meta = _parse_meta(props)
+            if meta['component'] == 'Ecs':
+                ecs.append((vm, props, meta))
+        if ecs:
+            networks = _user_networks(vcenter, username)
+            console_url = _console_url_maker(vcenter)
+            for vm, props, meta in ecs:
+                ecs_vms[props['name']] = _make_info(vm, props, meta, networks, console_url)
     return ecs_vms
 
 
+def _user_folder(vcenter, username):
+    """Look up the folder that holds a user's VMs
+
+    ``SearchIndex.FindChild`` asks vCenter for the folder by name, instead of
+    reading the name of every folder under the vLab base folder.
+
+    :Returns: vim.Folder
+
+    :Raises: ValueError if the user has no folder
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The name of the user who owns the folder
+    :type username: String
+    """
+    with timing.phase('folder_lookup'):
+        base_folder = vcenter.get_vm_folder(path=const.INF_VCENTER_TOP_LVL_DIR)
+        folder = vcenter.content.searchIndex.FindChild(entity=base_folder, name=username)
+        if folder is None:
+            # Not directly under the base folder; search all of it
+            folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    return folder
+
+
+@metrics.timed
+def _find_ecs(vcenter, username, machine_name):
+    """Look up a user's ECS VM by name
+
+    :Returns: vim.VirtualMachine, or None if the user has no ECS VM by that name
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The name of the user who owns the VM
+    :type username: String
+
+    :param machine_name: The name of the VM
+    :type machine_name: String
+    """
+    folder = _user_folder(vcenter, username)
+    the_vm = vcenter.content.searchIndex.FindChild(entity=folder, name=machine_name)
+    if not isinstance(the_vm, vim.VirtualMachine):
+        return None
+    # The notes are all that's needed to know it's ECS; get_info reads much more
+    props = property_collector.retrieve(vcenter, the_vm, ['config.annotation'])
+    if _parse_meta(props)['component'] != 'Ecs':
+        return None
+    return the_vm
+
+
+def _parse_meta(props):
+    """Extract the meta data stored in the notes of a VM
+
+    :Returns: Dictionary
+
+    :param props: The properties of the VM, from the PropertyCollector
+    :type props: Dictionary
+    """
+    try:
+        return ujson.loads(props['config.annotation'])
+    except (KeyError, ValueError, TypeError):
+        # KeyError   -> A VM being deployed has no config
+        # ValueError -> VM created, but notes not updated
+        # TypeError  -> VM failed to be created; notes are None
+        return {'component': 'Unknown',
+                'created': 0,
+                'version': "Unknown",
+                'generation': 0,
+                'configured': False
+               }
+
+
+def _user_networks(vcenter, username):
+    """Map the moId of each network a user owns to the name the user knows it by
+
+    :Returns: Dictionary
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The name of the user who owns the networks
+    :type username: String
+    """
+    networks = {}
+    for network, props in property_collector.retrieve_by_type(vcenter, ['name'], vim.Network):
+        if props['name'].startswith(username):
+            networks[network._moId] = props['name'].replace('{}_'.format(username), '')
+    return networks
+
+
+def _console_url_maker(vcenter):
+    """Obtain a function that creates the HTML5 console URL of a VM.
+
+    The bits of the URL that are the same for every VM are only looked up once;
+    the session ticket is single-use, so every URL gets a new one.
+
+    :Returns: Function
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    vcenter_cert = ssl.get_server_certificate((const.INF_VCENTER_SERVER, const.INF_VCENTER_PORT))
+    digest = hashlib.sha1(ssl.PEM_cert_to_DER_cert(vcenter_cert)).digest()
+    thumbprint = ':'.join('{:02X}'.format(x) for x in digest)
+    content = vcenter.content
+    server_guid = content.about.instanceUuid
+
+    def console_url(the_vm, name):
+        session = content.sessionManager.AcquireCloneTicket()
+        return CONSOLE_URL.format(const.INF_VCENTER_SERVER, the_vm._moId, name,
+                                  server_guid, session, thumbprint)
+    return console_url
+
+
+def _make_info(the_vm, props, meta, networks, console_url):
+    """Build the same information about a VM as ``virtual_machine.get_info``
+
+    :Returns: Dictionary
+
+    :param the_vm: The pyVmomi Virtual machine object
+    :type the_vm: vim.VirtualMachine
+
+    :param props: The properties of the VM, from the PropertyCollector
+    :type props: Dictionary
+
+    :param meta: The meta data of the VM
+    :type meta: Dictionary
+
+    :param networks: A mapping of network moIds to network names the user owns
+    :type networks: Dictionary
+
+    :param console_url: Creates the HTML5 console URL of a VM
+    :type console_url: Function
+    """
+    ips = []
+    # A property that's set, but empty, is None (i.e. a VM that was just powered on)
+    for nic in props.get('guest.net') or []:
+        ips += nic.ipAddress or []
+    # No point is showing the IPv6 link local addrs if a firewall wont forward them
+    ips = [x for x in ips if not x.startswith('fe80::')]
+    vm_networks = {x._moId for x in props.get('network') or []}
+    details = {}
+    details['state'] = props['runtime.powerState']
+    details['console'] = console_url(the_vm, props['name'])
+    details['ips'] = ips
+    details['networks'] = [y for x, y in networks.items() if x in vm_networks]
+    details['moid'] = the_vm._moId
+    details['meta'] = meta
+    return details
+
+
+@metrics.timed
+def ping_vcenter():
+    """Check that a pooled session to vCenter still works
+
+    :Returns: None
+
+    :Raises: RuntimeError if vCenter no longer considers the session logged in
+    """
+    with vcenter_session() as vcenter:
+        if vcenter.content.sessionManager.currentSession is None:
+            raise RuntimeError('Session to vCenter {} is not logged in'.format(const.INF_VCENTER_SERVER))
+
+
+@metrics.timed
 def delete_ecs(username, machine_name, logger):
     """Unregister and destroy a user's Ecs
 
@@ -41,23 +229,120 @@ def delete_ecs(username, machine_name, logger):
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == 'Ecs':
-                    logger.debug('powering off VM')
-                    virtual_machine.power(entity, state='off')
-                    delete_task = entity.Destroy_Task()
-                    logger.debug('blocking while VM is being destroyed')
-                    consume_task(delete_task)
-                    break
-        else:
-            raise ValueError('No {} named {} found'.format('ecs', machine_name))
+    with vcenter_session() as vcenter:
+        _delete_ecs(vcenter, username, machine_name, logger)
+
+
+@metrics.timed
+def bulk_delete_ecs(username, machine_names, logger):
+    """Destroy many of a user's Ecs at once, sharing one vCenter session
+
+    :Returns: Dictionary
+
+    :param username: The user who wants to delete their Ecs instances
+    :type username: String
+
+    :param machine_names: The names of the VMs to delete
+    :type machine_names: List
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    results = {}
+    with vcenter_session() as vcenter:
+        vms = {}
+        for machine_name in machine_names:
+            the_vm = _find_ecs(vcenter, username, machine_name)
+            if the_vm is None:
+                results[machine_name] = {'content': {}, 'error': 'No {} named {} found'.format('ecs', machine_name)}
+            else:
+                vms[the_vm] = machine_name
+        errors = _destroy_vms(vcenter, list(vms.keys()), logger)
+    for the_vm, machine_name in vms.items():
+        results[machine_name] = {'content': {}, 'error': errors[the_vm]}
+    return results
+
+
+def _delete_ecs(vcenter, username, machine_name, logger):
+    """Destroy a user's Ecs, with an established vCenter session
+
+    :Returns: None
+
+    :Raises: ValueError if there's no such VM, RuntimeError if it cannot be destroyed
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The user who wants to delete their jumpbox
+    :type username: String
+
+    :param machine_name: The name of the VM to delete
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    the_vm = _find_ecs(vcenter, username, machine_name)
+    if the_vm is None:
+        raise ValueError('No {} named {} found'.format('ecs', machine_name))
+    error = _destroy_vms(vcenter, [the_vm], logger)[the_vm]
+    if error:
+        raise RuntimeError(error)
 
 
+@metrics.timed
+def _destroy_vms(vcenter, vms, logger):
+    """Power off, then destroy, many VMs at once
+
+    vCenter won't destroy a VM that's on, so this is two rounds of tasks: one
+    to power off the VMs that are on, then one to destroy them all. The tasks
+    of a round are started together, and waited on by a single PropertyCollector.
+    A VM that fails to power off isn't destroyed.
+
+    :Returns: Dictionary of vim.VirtualMachine -> error message, or None
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param vms: The VMs to destroy
+    :type vms: List of vim.VirtualMachine
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    errors = {x: None for x in vms}
+    # One read for every VM, instead of a round trip per VM to check if it's on
+    states = property_collector.retrieve_many(vcenter, vms, ['runtime.powerState'])
+    powered_on = [x for x in vms if states.get(x, {}).get('runtime.powerState') != vim.VirtualMachinePowerState.poweredOff]
+    logger.debug('powering off {} of {} VMs'.format(len(powered_on), len(vms)))
+    _wait_on_tasks(vcenter, {x: x.PowerOffVM_Task() for x in powered_on}, errors)
+    logger.debug('blocking while VMs are being destroyed')
+    _wait_on_tasks(vcenter, {x: x.Destroy_Task() for x in vms if errors[x] is None}, errors)
+    return errors
+
+
+def _wait_on_tasks(vcenter, vm_tasks, errors):
+    """Block until the task of every VM finishes, and record the ones that failed
+
+    :Returns: None
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param vm_tasks: The task running against each VM
+    :type vm_tasks: Dictionary of vim.VirtualMachine -> vim.Task
+
+    :param errors: Updated with the error message of each VM whose task failed
+    :type errors: Dictionary
+    """
+    results = property_collector.wait_for_tasks(vcenter, list(vm_tasks.values()), TASK_TIMEOUT)
+    for the_vm, task in vm_tasks.items():
+        info = results[task]
+        if info.get('info.state') == vim.TaskInfo.State.error:
+            errors[the_vm] = '{}'.format(info['info.error'].msg)
+
+
+@metrics.timed
 def create_ecs(username, machine_name, image, network, logger):
     """Deploy a new instance of Ecs
 
@@ -78,43 +363,453 @@ def create_ecs(username, machine_name, image, network, logger):
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER,
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        image_name = convert_name(image)
-        logger.info(image_name)
-        try:
-            ova = Ova(os.path.join(const.VLAB_ECS_IMAGES_DIR, image_name))
-        except FileNotFoundError:
-            error = 'Invalid version of ECS supplied: {}'.format(image)
-            raise ValueError(error)
-        try:
-            network_map = vim.OvfManager.NetworkMapping()
-            network_map.name = ova.networks[0]
-            try:
-                network_map.network = vcenter.networks[network]
-            except KeyError:
-                raise ValueError('No such network named {}'.format(network))
+    # Checked before connecting to vCenter; a typo shouldn't cost a session
+    image_info = _image_info(image)
+    with vcenter_session() as vcenter:
+        return _create_ecs(vcenter, username, machine_name, image, image_info, network, logger)
+
+
+def _image_info(image):
+    """Look up the OVA of a version of Ecs in the catalog
+
+    :Returns: vlab_ecs_api.lib.worker.image_catalog.ImageInfo
+
+    :Raises: ValueError if there's no such version
+
+    :param image: The image/version of Ecs
+    :type image: String
+    """
+    try:
+        return image_catalog.CATALOG.get(convert_name(image))
+    except KeyError:
+        raise ValueError('Invalid version of ECS supplied: {}'.format(image))
+
+
+def _create_ecs(vcenter, username, machine_name, image, image_info, network, logger):
+    """Deploy a new instance of Ecs, with an established vCenter session
+
+    :Returns: Dictionary
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The name of the user who wants to create a new Ecs
+    :type username: String
+
+    :param machine_name: The name of the new instance of Ecs
+    :type machine_name: String
+
+    :param image: The image/version of Ecs to create
+    :type image: String
+
+    :param image_info: The catalog entry of the OVA for the version
+    :type image_info: vlab_ecs_api.lib.worker.image_catalog.ImageInfo
+
+    :param network: The name of the network to connect the new Ecs instance up to
+    :type network: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    # Part of the task's trace, unless this is one of many VMs made by threads
+    timer = timing.active() or timing.PhaseTimer(logger)
+    meta_data = {'component' : "Ecs",
+                 'created': time.time(),
+                 'version': image,
+                 'configured': False,
+                 'generation': 1,
+                }
+    logger.info(image_info.name)
+    try:
+        the_network = vcenter.networks[network]
+    except KeyError:
+        raise ValueError('No such network named {}'.format(network))
+    the_vm = None
+    if const.VLAB_ECS_WARM_POOL_SIZE:
+        with timer.phase('claim'):
+            the_vm = warm_pool.claim(vcenter, image, image_info.mtime, username, machine_name,
+                                     the_network, meta_data, logger)
+    if the_vm is None:
+        the_vm = _new_ecs(vcenter, username, machine_name, image, image_info, the_network, meta_data, logger, timer)
+    with timer.phase('power_on'):
+        virtual_machine.power(the_vm, state='on')
+    with timer.phase('wait_for_ip'):
+        property_collector.wait_for(vcenter, the_vm, ['guest.net'], _has_ip, IP_TIMEOUT)
+    with timer.phase('get_info'):
+        info = virtual_machine.get_info(vcenter, the_vm, username)
+    timer.log()
+    return {the_vm.name: info}
+
+
+def _has_ip(props):
+    """Check if the guest of a VM reports an IP, like ``get_info(ensure_ip=True)`` does
+
+    :Returns: Boolean
+
+    :param props: The watched properties of the VM
+    :type props: Dictionary
+    """
+    # The watched value of a property that was cleared (i.e. at power on) is None
+    return any(x.ipAddress for x in props.get('guest.net') or [])
+
+
+def _new_ecs(vcenter, username, machine_name, image, image_info, network, meta_data, logger, timer):
+    """Create a powered off ECS VM, cloning it or importing the OVA depending
+    on ``VLAB_ECS_DEPLOY_MODE``
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The name of the user (i.e. folder) who gets the new VM
+    :type username: String
+
+    :param machine_name: The name of the new instance of Ecs
+    :type machine_name: String
+
+    :param image: The image/version of Ecs to create
+    :type image: String
+
+    :param image_info: The catalog entry of the OVA for the version
+    :type image_info: vlab_ecs_api.lib.worker.image_catalog.ImageInfo
+
+    :param network: The network to connect the new Ecs instance up to
+    :type network: vim.Network
+
+    :param meta_data: The meta data to give the new VM
+    :type meta_data: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param timer: Records how long each phase takes
+    :type timer: vlab_ecs_api.lib.worker.timing.PhaseTimer
+    """
+    the_vm = None
+    if const.VLAB_ECS_DEPLOY_MODE == 'clone':
+        the_vm = _clone_ecs(vcenter, username, machine_name, image, image_info, network, meta_data, logger, timer)
+    if the_vm is None:
+        the_vm = _deploy_ecs(vcenter, username, machine_name, image_info.name, network, meta_data, logger, timer)
+    return the_vm
+
+
+def _open_ova(image_name):
+    """Open an OVA from the catalog
+
+    :Returns: vlab_ecs_api.lib.worker.cached_ova.CachedOva
+
+    :Raises: ValueError if the OVA no longer exists
+
+    :param image_name: The file name of the OVA, i.e. ``ECS-3.2.2.ova``
+    :type image_name: String
+    """
+    try:
+        return image_catalog.CATALOG.open(image_name)
+    except (KeyError, FileNotFoundError):
+        # Deleted since the catalog last looked
+        raise ValueError('Invalid version of ECS supplied: {}'.format(convert_name(image_name, to_version=True)))
+
+
+def _network_map(ova, network):
+    """Map the (only) network in an OVA to a network in vCenter
+
+    :Returns: List of vim.OvfManager.NetworkMapping
+    """
+    network_map = vim.OvfManager.NetworkMapping()
+    network_map.name = ova.networks[0]
+    network_map.network = network
+    return [network_map]
+
+
+@metrics.timed
+def _deploy_ecs(vcenter, username, machine_name, image_name, network, meta_data, logger, timer):
+    """Create a powered off ECS VM by importing its OVA
+
+    The network is set by the import; the RAM and meta data are then set by a
+    single reconfigure.
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The name of the user who wants to create a new Ecs
+    :type username: String
+
+    :param machine_name: The name of the new instance of Ecs
+    :type machine_name: String
+
+    :param image_name: The file name of the OVA, i.e. ``ECS-3.2.2.ova``
+    :type image_name: String
+
+    :param network: The network to connect the new Ecs instance up to
+    :type network: vim.Network
+
+    :param meta_data: The meta data to give the new VM
+    :type meta_data: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param timer: Records how long each phase takes
+    :type timer: vlab_ecs_api.lib.worker.timing.PhaseTimer
+    """
+    spec = vm_spec.config_spec(mb_of_ram=ECS_RAM, meta_data=meta_data)
+    with timer.phase('open_ova'):
+        ova = _open_ova(image_name)
+    try:
+        with timer.phase('import'):
             the_vm = virtual_machine.deploy_from_ova(vcenter=vcenter,
                                                      ova=ova,
-                                                     network_map=[network_map],
+                                                     network_map=_network_map(ova, network),
                                                      username=username,
                                                      machine_name=machine_name,
                                                      logger=logger,
                                                      power_on=False)
+    finally:
+        ova.close()
+    with timer.phase('reconfigure'):
+        consume_task(the_vm.ReconfigVM_Task(spec=spec))
+    return the_vm
+
+
+@metrics.timed
+def _clone_ecs(vcenter, username, machine_name, image, image_info, network, meta_data, logger, timer):
+    """Create a powered off ECS VM by cloning the base VM of its version,
+    making the base VM first if there isn't one.
+
+    The network and meta data are set by the clone itself.
+
+    :Returns: vim.VirtualMachine, or None if the base VM couldn't be made
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The name of the user who wants to create a new Ecs
+    :type username: String
+
+    :param machine_name: The name of the new instance of Ecs
+    :type machine_name: String
+
+    :param image: The image/version of Ecs to create
+    :type image: String
+
+    :param image_info: The catalog entry of the OVA for the version
+    :type image_info: vlab_ecs_api.lib.worker.image_catalog.ImageInfo
+
+    :param network: The network to connect the new Ecs instance up to
+    :type network: vim.Network
+
+    :param meta_data: The meta data to give the new VM
+    :type meta_data: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param timer: Records how long each phase takes
+    :type timer: vlab_ecs_api.lib.worker.timing.PhaseTimer
+    """
+    template = templates.get_template(vcenter, image, image_info.mtime)
+    if template is None:
+        logger.info('Making base VM for ECS {}'.format(image))
+        ova = _open_ova(image_info.name)
+        try:
+            with timer.phase('make_template'):
+                template = templates.create_template(vcenter=vcenter,
+                                                     ova=ova,
+                                                     network_map=_network_map(ova, network),
+                                                     version=image,
+                                                     image_mtime=image_info.mtime,
+                                                     mb_of_ram=ECS_RAM,
+                                                     logger=logger)
+        except (ValueError, RuntimeError, vmodl.MethodFault) as doh:
+            # i.e. another worker is making the same base VM right now
+            logger.error('Unable to make base VM for ECS {}, importing the OVA instead: {}'.format(image, doh))
+            return None
         finally:
             ova.close()
-        # 16GB - https://github.com/EMCECS/ECS-CommunityEdition#quick-start-guide
-        virtual_machine.adjust_ram(the_vm, mb_of_ram=16384)
-        virtual_machine.power(the_vm, state='on')
-        meta_data = {'component' : "Ecs",
-                     'created': time.time(),
-                     'version': image,
-                     'configured': False,
-                     'generation': 1,
-                    }
-        virtual_machine.set_meta(the_vm, meta_data)
-        info = virtual_machine.get_info(vcenter, the_vm, username, ensure_ip=True)
-        return {the_vm.name: info}
+    # The base VM is attached to whichever network the first user picked
+    nic = vm_spec.nic_change(template.config.hardware.device, network)
+    spec = vm_spec.config_spec(meta_data=meta_data, nic=nic)
+    with timer.phase('clone'):
+        return templates.clone(vcenter, template, username, machine_name, config=spec)
+
+
+@metrics.timed
+def sync_templates(logger):
+    """Destroy the base VMs of versions that are gone, or whose OVA was replaced
+
+    A base VM that linked clones still depend on is kept, and checked again
+    the next sync.
+
+    :Returns: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    current = {}
+    for image_name in image_catalog.CATALOG.names():
+        try:
+            current[convert_name(image_name, to_version=True)] = image_catalog.CATALOG.get(image_name).mtime
+        except KeyError:
+            continue
+    result = {'removed': [], 'kept': []}
+    with vcenter_session() as vcenter:
+        retired = []
+        for the_vm, meta in templates.find_templates(vcenter):
+            if current.get(meta['version']) == meta.get('image_mtime'):
+                result['kept'].append(the_vm.name)
+            else:
+                retired.append(the_vm)
+        # Destroying a base VM doesn't fail while powered off linked clones use its disks
+        users = templates.users(vcenter, retired)
+        for the_vm in retired:
+            name = the_vm.name
+            if users.get(the_vm):
+                logger.info('Keeping base VM {}; {} VM(s) use it, i.e. {}'.format(name, len(users[the_vm]), users[the_vm][0]))
+                result['kept'].append(name)
+                continue
+            logger.info('Destroying base VM {}'.format(name))
+            try:
+                consume_task(the_vm.Destroy_Task())
+            except (RuntimeError, vmodl.MethodFault) as doh:
+                logger.error('Unable to destroy base VM {}: {}'.format(name, doh))
+                result['kept'].append(name)
+            else:
+                result['removed'].append(name)
+    return result
+
+
+@metrics.timed
+def refill_pool(logger, version=None):
+    """Work out how many VMs the warm pool of every version is missing
+
+    Pooled VMs of removed or replaced OVAs, and claimed (or deploying) VMs whose
+    handover (or deploy) died part way through, are destroyed. So are ready VMs
+    beyond ``VLAB_ECS_WARM_POOL_SIZE``, i.e. from refills that ran at the same
+    time. VMs that are still being deployed count towards the size.
+
+    :Returns: Dictionary of version -> Dictionary with ``ready``, ``deploying`` and ``missing``
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param version: Only refill the pool of this version. Default is every version.
+    :type version: String
+    """
+    images = _pool_images()
+    versions = [version] if version else sorted(images.keys())
+    sizes = {}
+    with vcenter_session() as vcenter:
+        ready, deploying, doomed = _pool_inventory(vcenter, images)
+        for a_version in versions:
+            if a_version not in images:
+                continue
+            extra = ready.get(a_version, [])[const.VLAB_ECS_WARM_POOL_SIZE:]
+            for the_vm, props in extra:
+                marker = {'component': warm_pool.CLAIMED_COMPONENT, 'claimed': time.time(), 'version': a_version, 'owner': None}
+                # Only destroy it if no create claimed it in the meantime
+                if warm_pool.take(the_vm, props, marker):
+                    doomed[the_vm] = props['name']
+            if extra:
+                ready[a_version] = ready[a_version][:const.VLAB_ECS_WARM_POOL_SIZE]
+        for the_vm, name in doomed.items():
+            logger.info('Destroying pooled VM {}'.format(name))
+        for the_vm, error in _destroy_vms(vcenter, list(doomed.keys()), logger).items():
+            if error:
+                logger.error('Unable to destroy pooled VM {}: {}'.format(doomed[the_vm], error))
+    for a_version in versions:
+        if a_version not in images:
+            continue
+        count = len(ready.get(a_version, []))
+        sizes[a_version] = {'ready': count,
+                            'deploying': deploying.get(a_version, 0),
+                            'missing': max(const.VLAB_ECS_WARM_POOL_SIZE - count - deploying.get(a_version, 0), 0),
+                           }
+        warm_pool.STATS.set_size(a_version, count)
+    return sizes
+
+
+@metrics.timed
+def add_to_pool(version, logger):
+    """Deploy one VM into the warm pool of a version, unless it's already full
+
+    :Returns: String (the name of the new VM), or None if the pool is full
+
+    :Raises: ValueError if there's no such version, or no pool network
+
+    :param version: The version of ECS, i.e. ``3.2.2``
+    :type version: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    image_info = _image_info(version)
+    with vcenter_session() as vcenter:
+        # Checked again; other refills may have filled the pool since this was queued
+        ready, deploying, _ = _pool_inventory(vcenter, _pool_images())
+        if len(ready.get(version, [])) + deploying.get(version, 0) >= const.VLAB_ECS_WARM_POOL_SIZE:
+            return None
+        try:
+            network = vcenter.networks[const.VLAB_ECS_WARM_POOL_NETWORK]
+        except KeyError:
+            raise ValueError('No such network named {}'.format(const.VLAB_ECS_WARM_POOL_NETWORK))
+        start = time.time()
+        folder = warm_pool.pool_folder(vcenter)
+        machine_name = warm_pool.pooled_name(version)
+        logger.info('Adding {} to the warm pool'.format(machine_name))
+        timer = timing.active() or timing.PhaseTimer(logger)
+        _new_ecs(vcenter, folder.name, machine_name, version, image_info, network,
+                 warm_pool.pool_meta(version, image_info.mtime), logger, timer)
+        timer.log()
+        warm_pool.STATS.refilled(time.time() - start)
+    return machine_name
+
+
+def _pool_images():
+    """Look up the OVA of every version of Ecs in the catalog
+
+    :Returns: Dictionary of version -> vlab_ecs_api.lib.worker.image_catalog.ImageInfo
+    """
+    images = {}
+    for image_name in image_catalog.CATALOG.names():
+        try:
+            images[convert_name(image_name, to_version=True)] = image_catalog.CATALOG.get(image_name)
+        except KeyError:
+            continue
+    return images
+
+
+def _pool_inventory(vcenter, images):
+    """Sort the VMs in the warm pool into ready, still deploying, and stale
+
+    :Returns: Tuple (ready, deploying, stale)
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param images: The catalog entry of the OVA of every version
+    :type images: Dictionary
+    """
+    # version -> List of Tuples (vim.VirtualMachine, props)
+    ready = {}
+    # version -> how many
+    deploying = {}
+    # vim.VirtualMachine -> name
+    stale = {}
+    for the_vm, meta, props in warm_pool.find_pooled(vcenter):
+        if meta['component'] == warm_pool.POOL_COMPONENT:
+            image_info = images.get(meta['version'])
+            if image_info is None or image_info.mtime != meta.get('image_mtime'):
+                stale[the_vm] = props['name']
+            else:
+                ready.setdefault(meta['version'], []).append((the_vm, props))
+        elif warm_pool.is_abandoned(meta):
+            stale[the_vm] = props['name']
+        elif meta['component'] == warm_pool.DEPLOYING_COMPONENT:
+            deploying[meta['version']] = deploying.get(meta['version'], 0) + 1
+    return ready, deploying, stale
 
 
 def list_images():
@@ -122,7 +817,7 @@ def list_images():
 
     :Returns: List
     """
-    images = os.listdir(const.VLAB_ECS_IMAGES_DIR)
+    images = image_catalog.CATALOG.names()
     images = [convert_name(x, to_version=True) for x in images]
     return images
 
@@ -145,6 +840,7 @@ def convert_name(name, to_version=False):
         return 'ECS-{}.ova'.format(name)
 
 
+@metrics.timed
 def update_network(username, machine_name, new_network):
     """Implements the VM network update
 
@@ -157,16 +853,9 @@ def update_network(username, machine_name, new_network):
     :param new_network: The name of the new network to connect the VM to
     :type new_network: String
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == 'Ecs':
-                    the_vm = entity
-                    break
-        else:
+    with vcenter_session() as vcenter:
+        the_vm = _find_ecs(vcenter, username, machine_name)
+        if the_vm is None:
             error = 'No VM named {} found'.format(machine_name)
             raise ValueError(error)
 
@@ -179,6 +868,7 @@ def update_network(username, machine_name, new_network):
             virtual_machine.change_network(the_vm, network)
 
 
+@metrics.timed
 def set_meta(username, machine_name, meta_data):
     """Connect to vCenter and update the VMs meta data
 
@@ -193,9 +883,7 @@ def set_meta(username, machine_name, meta_data):
     :param meta_data: The key-value meta-data object to apply to the VM.
     :type meta_data: Dictionary
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for vm in folder.childEntity:
-            if vm.name == machine_name:
-                virtual_machine.set_meta(vm, meta_data)
+    with vcenter_session() as vcenter:
+        the_vm = _find_ecs(vcenter, username, machine_name)
+        if the_vm is not None:
+            virtual_machine.set_meta(the_vm, meta_data)
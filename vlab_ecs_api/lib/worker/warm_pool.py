@@ -0,0 +1,301 @@
+# -*- coding: UTF-8 -*-
+"""
+A pool of already deployed ECS VMs, so ``ecs.create`` can hand one over instead
+of deploying a new VM while the user waits.
+
+Setting ``VLAB_ECS_WARM_POOL_SIZE`` keeps that many VMs per image version in the
+``VLAB_ECS_WARM_POOL_DIR`` folder (under the vLab base folder), connected to
+``VLAB_ECS_WARM_POOL_NETWORK``. Pooled VMs are deployed and have their RAM set,
+but are powered off and not configured: configuring ECS binds it to an IP on the
+user's network (via the user's gateway), which isn't known until it's claimed.
+
+Claiming a VM marks it with a ``ReconfigVM_Task`` that's conditional on the
+VM's ``config.changeVersion``, so two workers can't both claim the same VM.
+The claimed VM is then renamed, given the user's meta data and connected to
+the user's network (all in one reconfigure), and moved to the user's folder.
+
+``ecs.refill_pool`` replaces claimed VMs in the background, by queueing one
+``ecs.add_to_pool`` per missing VM. A pooled VM has no meta data until its
+deploy finishes, so the version and creation time are also in its name; that's
+how VMs that are still deploying are counted (and how dead deploys are found).
+"""
+import re
+import time
+import uuid
+import threading
+
+import ujson
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim, consume_task
+
+from vlab_ecs_api.lib import const
+from vlab_ecs_api.lib.worker import property_collector, templates, vm_spec
+
+# The meta data "component" of a VM waiting in the pool
+POOL_COMPONENT = 'EcsPool'
+# A VM that's being handed over; only left in the pool folder if the handover died
+CLAIMED_COMPONENT = 'EcsPoolClaimed'
+# A handed over VM has the user's meta data before it's moved to the user's folder
+HANDED_OVER_COMPONENT = 'Ecs'
+# A VM (named by ``pooled_name``) that doesn't have its meta data yet
+DEPLOYING_COMPONENT = 'EcsPoolDeploying'
+# How many seconds a handover (or deploy) can take before the VM is considered abandoned
+CLAIM_TIMEOUT = 3600
+POOLED_NAME_REGEX = re.compile(r'^ECS-(?P<version>.+)-pool-(?P<created>\d+)-[0-9a-f]+$')
+POOL_PROPERTIES = ['name', 'config.annotation', 'config.changeVersion']
+
+
+class PoolStats:
+    """Counters about how well the pool is working, for this worker process"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._refills = 0
+        self._refill_seconds = 0.0
+        self._last_refill_seconds = None
+        self._sizes = {}
+
+    def hit(self):
+        """Record a create that was handed a pooled VM"""
+        with self._lock:
+            self._hits += 1
+
+    def miss(self):
+        """Record a create that had to deploy a new VM"""
+        with self._lock:
+            self._misses += 1
+
+    def refilled(self, seconds):
+        """Record how long it took to add a VM to the pool
+
+        :param seconds: The time taken to deploy the VM
+        :type seconds: Float
+        """
+        with self._lock:
+            self._refills += 1
+            self._refill_seconds += seconds
+            self._last_refill_seconds = seconds
+
+    def set_size(self, version, size):
+        """Record how many VMs of a version were last seen in the pool
+
+        :param version: The version of ECS, i.e. ``3.2.2``
+        :type version: String
+
+        :param size: The number of pooled VMs
+        :type size: Integer
+        """
+        with self._lock:
+            self._sizes[version] = size
+
+    def stats(self):
+        """Obtain the pool size, hit rate and refill latency
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            requests = self._hits + self._misses
+            return {'size': dict(self._sizes),
+                    'hits': self._hits,
+                    'misses': self._misses,
+                    'hit_rate': self._hits / requests if requests else None,
+                    'refills': self._refills,
+                    'refill_seconds_avg': self._refill_seconds / self._refills if self._refills else None,
+                    'refill_seconds_last': self._last_refill_seconds,
+                   }
+
+
+STATS = PoolStats()
+
+
+def pool_folder(vcenter):
+    """Obtain (creating if needed) the folder that holds the pooled VMs
+
+    :Returns: vim.Folder
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    return templates.service_folder(vcenter, const.VLAB_ECS_WARM_POOL_DIR)
+
+
+def pooled_name(version):
+    """Make a unique name for a VM in the pool
+
+    :Returns: String
+
+    :param version: The version of ECS, i.e. ``3.2.2``
+    :type version: String
+    """
+    return 'ECS-{}-pool-{}-{}'.format(version, int(time.time()), uuid.uuid4().hex[:8])
+
+
+def pool_meta(version, image_mtime):
+    """The meta data of a VM waiting in the pool
+
+    :Returns: Dictionary
+
+    :param version: The version of ECS, i.e. ``3.2.2``
+    :type version: String
+
+    :param image_mtime: The ``st_mtime_ns`` of the OVA the VM was made from
+    :type image_mtime: Integer
+    """
+    return {'component': POOL_COMPONENT,
+            'created': time.time(),
+            'version': version,
+            'configured': False,
+            'generation': 1,
+            'image_mtime': image_mtime,
+           }
+
+
+def find_pooled(vcenter):
+    """Obtain every VM in the pool folder, with its meta data and properties
+
+    :Returns: List of Tuples (vim.VirtualMachine, Dictionary, Dictionary)
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    found = []
+    folder = pool_folder(vcenter)
+    for the_vm, props in property_collector.retrieve_children(vcenter, folder, POOL_PROPERTIES):
+        try:
+            meta = ujson.loads(props['config.annotation'])
+        except (KeyError, ValueError, TypeError):
+            meta = _deploying_meta(props.get('name', ''))
+            if meta is None:
+                continue
+        if meta.get('component') in (POOL_COMPONENT, CLAIMED_COMPONENT, HANDED_OVER_COMPONENT, DEPLOYING_COMPONENT):
+            found.append((the_vm, meta, props))
+    return found
+
+
+def _deploying_meta(name):
+    """Stand-in meta data for a pooled VM that's still being deployed
+
+    :Returns: Dictionary, or None if the VM wasn't named by ``pooled_name``
+
+    :param name: The name of the VM
+    :type name: String
+    """
+    match = POOLED_NAME_REGEX.match(name)
+    if not match:
+        return None
+    return {'component': DEPLOYING_COMPONENT,
+            'created': int(match.group('created')),
+            'version': match.group('version'),
+           }
+
+
+def is_abandoned(meta):
+    """Check if the handover of a claimed VM, or the deploy of a pooled VM, died part way through
+
+    :Returns: Boolean
+
+    :param meta: The meta data of a VM in the pool folder
+    :type meta: Dictionary
+    """
+    if meta['component'] == POOL_COMPONENT:
+        return False
+    claimed = meta.get('claimed', meta.get('created', 0))
+    return claimed + CLAIM_TIMEOUT < time.time()
+
+
+def claim(vcenter, version, image_mtime, username, machine_name, network, meta_data, logger):
+    """Hand a pooled VM over to a user
+
+    :Returns: vim.VirtualMachine, or None if the pool has no VM to hand over
+
+    :Raises: ValueError if the machine name is invalid, or the user already has a VM by that name
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param version: The version of ECS, i.e. ``3.2.2``
+    :type version: String
+
+    :param image_mtime: The ``st_mtime_ns`` of the current OVA for the version
+    :type image_mtime: Integer
+
+    :param username: The user who gets the VM
+    :type username: String
+
+    :param machine_name: The name to give the VM
+    :type machine_name: String
+
+    :param network: The network to connect the VM to
+    :type network: vim.Network
+
+    :param meta_data: The meta data to give the VM
+    :type meta_data: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    if not templates.MACHINE_NAME_REGEX.match(machine_name):
+        # Same error the deploy would raise, without spending a pooled VM on it
+        error = 'Invalid machine name. Names can only contain characters a-z, A-Z, 0-9, periods (".") and dashes ("-"). Supplied: {}'.format(machine_name)
+        raise ValueError(error)
+    folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    if vcenter.content.searchIndex.FindChild(entity=folder, name=machine_name) is not None:
+        # Checked first; a failed handover would spend a pooled VM, and a deploy would fail the same way
+        raise ValueError('A VM named {} already exists'.format(machine_name))
+    pooled = [(x, z) for x, y, z in find_pooled(vcenter)
+              if y['component'] == POOL_COMPONENT and y['version'] == version and y.get('image_mtime') == image_mtime]
+    the_vm = None
+    for candidate, props in pooled:
+        marker = {'component': CLAIMED_COMPONENT, 'claimed': time.time(), 'version': version, 'owner': username}
+        if take(candidate, props, marker):
+            the_vm = candidate
+            break
+    STATS.set_size(version, max(len(pooled) - 1, 0) if the_vm else 0)
+    if the_vm is None:
+        STATS.miss()
+        return None
+    logger.info('Claimed pooled VM {}'.format(props['name']))
+    try:
+        nic = vm_spec.nic_change(the_vm.config.hardware.device, network)
+        spec = vm_spec.config_spec(meta_data=meta_data, name=machine_name, nic=nic)
+        consume_task(the_vm.ReconfigVM_Task(spec=spec))
+        consume_task(folder.MoveIntoFolder_Task([the_vm]))
+    except (RuntimeError, vmodl.MethodFault) as doh:
+        # A new deploy will report the problem just like it would without the pool
+        logger.error('Unable to hand over pooled VM {}: {}'.format(props['name'], doh))
+        try:
+            consume_task(the_vm.Destroy_Task())
+        except (RuntimeError, vmodl.MethodFault) as doh:
+            # It's marked as claimed, so refilling the pool destroys it once the claim times out
+            logger.error('Unable to destroy pooled VM {}: {}'.format(props['name'], doh))
+        STATS.miss()
+        return None
+    STATS.hit()
+    return the_vm
+
+
+def take(the_vm, props, marker):
+    """Mark a pooled VM as taken, unless it changed since ``props`` were read
+
+    The reconfigure is conditional on ``config.changeVersion``, so only one
+    worker can take a VM, whether it's to hand it over or to destroy it.
+
+    :Returns: Boolean
+
+    :param the_vm: The pooled VM
+    :type the_vm: vim.VirtualMachine
+
+    :param props: The properties of the VM, as returned by ``find_pooled``
+    :type props: Dictionary
+
+    :param marker: The meta data to give the VM
+    :type marker: Dictionary
+    """
+    spec = vim.vm.ConfigSpec(changeVersion=props['config.changeVersion'], annotation=ujson.dumps(marker))
+    try:
+        consume_task(the_vm.ReconfigVM_Task(spec=spec))
+    except (RuntimeError, vmodl.MethodFault):
+        # Another worker took it first
+        return False
+    return True